@@ -0,0 +1,60 @@
+from typing import NamedTuple
+import torch
+
+
+class AttentionBatch(NamedTuple):
+    """Attention context of a batch of events, stored in the layout used by the AttentionBlock.
+
+    Token histories and the current activity are sequence-first ([len, batch]) as expected by the
+    transformer encoder/decoder, key padding masks are batch-first ([batch, len]). Being a tuple,
+    it can be passed directly as `x_attention` to tabularUnet / MultinomialDiffusion.
+    """
+    prev_acts: torch.Tensor          # [src_len, batch_size]
+    prev_res: torch.Tensor           # [src_len, batch_size]
+    prev_acts_padding: torch.Tensor  # [batch_size, src_len]
+    prev_res_padding: torch.Tensor   # [batch_size, src_len]
+    curr_act: torch.Tensor           # [1, batch_size]
+
+    @classmethod
+    def from_rows(cls, prev_acts, prev_res, prev_acts_padding, prev_res_padding, curr_act, device=None):
+        """Builds a batch from batch-first rows (one history per event), transposing only once."""
+        return cls(torch.tensor(prev_acts, device=device).t().contiguous(),
+                   torch.tensor(prev_res, device=device).t().contiguous(),
+                   torch.tensor(prev_acts_padding, device=device),
+                   torch.tensor(prev_res_padding, device=device),
+                   torch.tensor(curr_act, device=device).t().contiguous())
+
+    @classmethod
+    def from_lists(cls, attention_list, device=None):
+        """Builds a batch from the five per-column lists returned by tabular_dataload.load_data."""
+        return cls.from_rows(*attention_list, device=device)
+
+    @property
+    def num_rows(self):
+        return self.curr_act.shape[1]
+
+    def rows(self, start, end):
+        """Rows [start, end) as views, without copying."""
+        return AttentionBatch(self.prev_acts[:, start:end],
+                              self.prev_res[:, start:end],
+                              self.prev_acts_padding[start:end],
+                              self.prev_res_padding[start:end],
+                              self.curr_act[:, start:end])
+
+    def take(self, index):
+        """Arbitrary rows given by a 1-d index (copies)."""
+        index = torch.as_tensor(index, device=self.curr_act.device)
+        return AttentionBatch(self.prev_acts.index_select(1, index),
+                              self.prev_res.index_select(1, index),
+                              self.prev_acts_padding.index_select(0, index),
+                              self.prev_res_padding.index_select(0, index),
+                              self.curr_act.index_select(1, index))
+
+    def to(self, device):
+        return AttentionBatch(*[each.to(device) for each in self])
+
+    def iter_batches(self, batch_size):
+        """Endless sequential batches, matching infiniteloop(DataLoader(..., batch_size)) over the rows."""
+        while True:
+            for start in range(0, self.num_rows, batch_size):
+                yield self.rows(start, start + batch_size)
@@ -0,0 +1,119 @@
+import copy
+import logging
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from types import SimpleNamespace
+import numpy as np
+import pandas as pd
+import torch
+import torch.multiprocessing as mp
+import telemetry
+from utils import sample_chunks, conditions_from_rows, decode_samples, pipelined
+
+
+def write_samples(path, num_rows, conditions, net_sampler, trainer_dis_list, job, device):
+    # samples `num_rows` rows chunk by chunk, appending each decoded chunk to the csv at `path`; with
+    # job.decode_workers > 0 chunks are decoded and formatted in worker threads while the next chain runs
+    chunks = sample_chunks(num_rows, job.chunk_size, conditions, net_sampler, trainer_dis_list, job.num_class,
+                           job.cont_dim, job.transformer_con, job, device)
+
+    def decode(start, x_cont, x_dis_list):
+        sample = decode_samples(x_cont, x_dis_list, job.transformer_con, job.transformer_dis, job.con_idx, job.dis_idx)
+        return pd.DataFrame(sample).to_csv(header=start == 0, index=False)
+
+    with open(path, 'w', newline='') as f:
+        for text in pipelined(chunks, decode, job.decode_workers):
+            f.write(text)
+    return path
+
+
+# state of the background worker process, set once by _init_worker
+_WORKER = {}
+
+
+def _init_worker(attention, still_cond_used_for_sampling_list, index, job):
+    _WORKER['conditions'] = conditions_from_rows(attention, still_cond_used_for_sampling_list, index)
+    _WORKER['job'] = job
+    if job.num_threads > 0:
+        torch.set_num_threads(job.num_threads)
+
+
+def _sample_job(step, path, num_rows, samplers):
+    job = _WORKER['job']
+    torch.manual_seed(job.seed + step)
+    np.random.seed(job.seed + step)
+    net_sampler, trainer_dis_list = samplers
+    start = time.perf_counter()
+    write_samples(path, num_rows, _WORKER['conditions'], net_sampler, trainer_dis_list, job, torch.device('cpu'))
+    return step, path, num_rows, time.perf_counter() - start
+
+
+class PeriodicSampler:
+    """Evaluation sampling at every `sample_step` during training.
+
+    Samples `FLAGS.sample_rows` rows (as many as the training set if 0) conditioned on training rows: a fixed
+    random subset when fewer, cycling over the training set when more. Chains run over chunks of
+    `FLAGS.eval_batch_size` rows and every chunk is appended to `sample_<step>.csv` in `FLAGS.logdir`. With
+    `FLAGS.sample_async` this happens in a separate process on a CPU snapshot of the samplers, so the
+    optimizer keeps stepping.
+    """
+
+    def __init__(self, FLAGS, attention, still_cond_used_for_sampling_list, num_class, cont_dim,
+                 transformer_con, transformer_dis, con_idx, dis_idx):
+        rows = attention.num_rows
+        self.num_rows = FLAGS.sample_rows if FLAGS.sample_rows > 0 else rows
+        index = None
+        if self.num_rows < rows:
+            index = np.sort(np.random.RandomState(FLAGS.seed).choice(rows, self.num_rows, replace=False))
+        self.logdir = FLAGS.logdir
+        self.conditions = conditions_from_rows(attention, still_cond_used_for_sampling_list, index)
+        self.job = SimpleNamespace(T=FLAGS.T, still_condition=list(FLAGS.still_condition), num_class=list(num_class),
+                                   cont_dim=cont_dim, transformer_con=transformer_con, transformer_dis=transformer_dis,
+                                   con_idx=con_idx, dis_idx=dis_idx, chunk_size=FLAGS.eval_batch_size,
+                                   seed=FLAGS.seed, num_threads=FLAGS.sample_threads,
+                                   decode_workers=FLAGS.decode_workers, concurrent_denoisers=FLAGS.concurrent_denoisers)
+        self.latest_sample_file = None
+        self.pending = []
+        self.executor = None
+        if FLAGS.sample_async:
+            self.executor = ProcessPoolExecutor(max_workers=1, mp_context=mp.get_context('spawn'),
+                                                initializer=_init_worker,
+                                                initargs=(attention.to('cpu'), still_cond_used_for_sampling_list,
+                                                          index, self.job))
+
+    def __call__(self, step, net_sampler, trainer_dis_list, device, final=False):
+        path = os.path.join(self.logdir, f'sample_{step}.csv')
+        if self.executor is None:
+            start = time.perf_counter()
+            write_samples(path, self.num_rows, self.conditions, net_sampler, trainer_dis_list, self.job, device)
+            self.latest_sample_file = path
+            self._report(step, path, self.num_rows, time.perf_counter() - start)
+            return
+        self.pending = [each for each in self.pending if not each.done()]
+        if self.pending and not final:
+            logging.info(f"Sampling still running, skip sampling at step {step}")
+            return
+        samplers = copy.deepcopy(net_sampler).cpu(), [copy.deepcopy(each).cpu() for each in trainer_dis_list]
+        future = self.executor.submit(_sample_job, step, path, self.num_rows, samplers)
+        future.add_done_callback(self._on_done)
+        self.pending.append(future)
+        # the checkpoint written right after this call records the sample of its step, still being written
+        self.latest_sample_file = path
+
+    def _on_done(self, future):
+        if future.exception() is not None:
+            logging.error(f"Background sampling failed: {future.exception()!r}")
+            return
+        self._report(*future.result())
+
+    def _report(self, step, path, num_rows, seconds):
+        logging.info(f"Sampled {num_rows} rows at step {step} to {path} in {seconds:.1f}s")
+        telemetry.emit('sampling', step=step, rows=num_rows, seconds=seconds,
+                       events_per_s=num_rows / max(seconds, 1e-9), background=self.executor is not None)
+
+    def close(self):
+        # wait for outstanding samples before training returns
+        if self.executor is not None:
+            self.executor.shutdown(wait=True)
+            self.executor = None
@@ -0,0 +1,169 @@
+"""Load test of generation_server.py: concurrent simulation workers asking for next-event predictions.
+
+Every worker simulates `--cases_per_request` cases of `--input` at a time. It asks the server for the next event
+of each of them in one request, then appends the returned resources to the histories, as a simulation service
+would. Reports p50/p99 request latency and request/event throughput, plus the server's mean batch size.
+Without `--url`/`--socket` a server on the model of `--logdir` is started in this process.
+
+    python benchmarks/load_test.py --logdir codi_exp --input tabular_datasets/gen_seq_consulta.csv --workers 32
+"""
+import argparse
+import csv
+import http.client
+import json
+import os
+import socket
+import sys
+import threading
+import time
+from urllib.parse import urlparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np
+
+MARKERS = ('Start', 'End')
+
+
+class _UnixConnection(http.client.HTTPConnection):
+    def __init__(self, path):
+        super().__init__('localhost')
+        self.unix_path = path
+
+    def connect(self):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.connect(self.unix_path)
+
+
+def _connection(args):
+    if args.socket:
+        return _UnixConnection(args.socket)
+    url = urlparse(args.url)
+    return http.client.HTTPConnection(url.hostname, url.port)
+
+
+def read_cases(path):
+    # activity names of every case, cases framed by Start/End rows
+    cases, case = [], []
+    with open(path, newline='') as f:
+        for row in csv.DictReader(f):
+            if row['act'] in MARKERS:
+                if case:
+                    cases.append(case)
+                case = []
+            else:
+                case.append(row['act'])
+    if case:
+        cases.append(case)
+    return cases
+
+
+def _worker(args, cases, seed, deadline, latencies, counts):
+    rng = np.random.RandomState(seed)
+    connection = _connection(args)
+    while time.perf_counter() < deadline:
+        batch = [cases[k] for k in rng.randint(0, len(cases), args.cases_per_request)]
+        prev_res = [[] for _ in batch]
+        for k in range(max(map(len, batch))):
+            active = [c for c, case in enumerate(batch) if len(case) > k]
+            body = json.dumps({'events': [{'activity': batch[c][k], 'prev_activities': batch[c][:k],
+                                           'prev_resources': prev_res[c]} for c in active]})
+            start = time.perf_counter()
+            connection.request('POST', '/predict', body, {'Content-Type': 'application/json'})
+            response = connection.getresponse()
+            reply = json.loads(response.read())
+            latencies.append(time.perf_counter() - start)
+            if response.status != 200:
+                raise RuntimeError(f'server replied {response.status}: {reply}')
+            for c, event in zip(active, reply['events']):
+                prev_res[c].append(event['res'])
+            counts.append(len(active))
+            if time.perf_counter() >= deadline:
+                break
+    connection.close()
+
+
+def run(args):
+    cases = read_cases(args.input)
+    latencies, counts, errors = [], [], []
+
+    def target(seed):
+        try:
+            _worker(args, cases, seed, deadline, latencies, counts)
+        except Exception as e:
+            errors.append(e)
+
+    stats = _get_stats(args)
+    start = time.perf_counter()
+    deadline = start + args.duration
+    threads = [threading.Thread(target=target, args=(args.seed + k,)) for k in range(args.workers)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    seconds = time.perf_counter() - start
+    if errors:
+        raise errors[0]
+    after = _get_stats(args)
+    latencies = np.array(latencies) * 1000
+    batches = after['batches'] - stats['batches']
+    return {'workers': args.workers, 'cases_per_request': args.cases_per_request, 'seconds': round(seconds, 3),
+            'requests': len(latencies), 'events': int(sum(counts)),
+            'requests_per_s': len(latencies) / seconds, 'events_per_s': sum(counts) / seconds,
+            'latency_p50_ms': float(np.percentile(latencies, 50)), 'latency_p99_ms': float(np.percentile(latencies, 99)),
+            'latency_mean_ms': float(latencies.mean()), 'server_batches': batches,
+            'server_mean_batch': (after['events'] - stats['events']) / max(batches, 1)}
+
+
+def _get_stats(args):
+    connection = _connection(args)
+    connection.request('GET', '/stats')
+    stats = json.loads(connection.getresponse().read())
+    connection.close()
+    return stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Load test of the generation server.')
+    parser.add_argument('--input', required=True, help='CSV of activity sequences the workers simulate')
+    parser.add_argument('--url', default=None, help='server to test, e.g. http://127.0.0.1:8765')
+    parser.add_argument('--socket', default=None, help='Unix socket of the server to test')
+    parser.add_argument('--logdir', default='./codi_exp', help='model of the in-process server')
+    parser.add_argument('--max_batch', type=int, default=256, help='in-process server: max events of a batch')
+    parser.add_argument('--max_wait_ms', type=float, default=5., help='in-process server: max batching wait')
+    parser.add_argument('--workers', type=int, default=16, help='concurrent client workers')
+    parser.add_argument('--cases_per_request', type=int, default=4, help='cases a worker advances per request')
+    parser.add_argument('--duration', type=float, default=20., help='seconds of load')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', default=None, help='results JSON')
+    args = parser.parse_args()
+
+    server = None
+    if not args.url and not args.socket:
+        import torch
+        from generation import Generator
+        from generation_server import GenerationServer, MicroBatcher
+        model = os.path.join(args.logdir, 'generator.safetensors')
+        if not os.path.exists(model):
+            model = os.path.join(args.logdir, 'ckpt.pt')
+        torch.manual_seed(args.seed)
+        batcher = MicroBatcher(Generator.load(model), args.max_batch, args.max_wait_ms)
+        server = GenerationServer(batcher, port=0)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        args.url = f'http://127.0.0.1:{server.server_port}'
+    try:
+        results = run(args)
+    finally:
+        if server is not None:
+            server.shutdown()
+            server.server_close()
+            batcher.close()
+    for key, value in results.items():
+        print(f'{key:>20}: {value:.2f}' if isinstance(value, float) else f'{key:>20}: {value}')
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,300 @@
+"""End-to-end pipeline benchmarks.
+
+Times, on the bundled training log, on scaled copies of it and on synthetic logs of synthetic_logs.py:
+  read_xes_s / preprocessing_s       pm4py.read.read_xes and tabular_dataload._preprocessing
+  transform_rows_per_s               GeneralTransformer.transform of the continuous and discrete columns
+  inverse_transform_rows_per_s       GeneralTransformer.inverse_transform of the same
+  train_steps_per_s                  training_with + backward + optimizer steps on one batch
+  sampling_rows_per_s                a full sampling_with chain over --bench_sample_rows rows
+  sampling_allocations_per_chain     tensor allocations of that chain (torch.profiler memory profile),
+  sampling_allocated_mb_per_chain    and the megabytes they allocate
+  sample_write_rows_per_s            periodic sampling to CSV (chains, decoding, formatting) over
+                                     --bench_write_chunks chunks, decoded inline
+  sample_write_pipelined_rows_per_s  the same with decoding and formatting in --decode_workers threads
+  generation_ms_per_case             the eval-mode trace completion loop of co_evolving_condition.train
+
+Results go to --bench_output as JSON. With --bench_baseline, every metric is compared against a stored run
+and the process exits with status 1 when one is worse by more than --bench_tolerance.
+
+    python benchmarks/run_benchmarks.py --bench_scales 1,2 --T 50 --bench_output bench.json
+"""
+import json
+import os
+import platform
+import statistics
+import sys
+import tempfile
+import time
+from contextlib import contextmanager
+from types import SimpleNamespace
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np
+import pandas as pd
+import pm4py
+import torch
+from absl import app, flags
+
+import main  # noqa: F401, defines the model and training flags
+import co_evolving_condition
+import tabular_dataload
+from attention_batch import AttentionBatch
+from model_builder import set_model_sizes, model_config, build_models
+from background_sampling import write_samples
+from utils import training_with, conditions_from_rows, sample_chunks, warmup_lr
+from scaled_logs import write_scaled_log
+from synthetic_logs import cases_for_events, generate_log, write_xes
+
+FLAGS = flags.FLAGS
+flags.DEFINE_string('bench_log', 'diffu/ConsultaDataMining201618_0.2/train_ConsultaDataMining201618.xes',
+                    help='bundled log to benchmark, relative to tabular_datasets')
+flags.DEFINE_string('bench_scales', '1,2', help='replication factors of the log, 1 is the bundled log itself')
+flags.DEFINE_string('bench_synthetic_events', '', help='sizes (events) of synthetic logs to benchmark as well')
+flags.DEFINE_integer('bench_repeats', 5, help='timed repetitions of the fast benchmarks, the median is kept')
+flags.DEFINE_integer('bench_sample_rows', 512, help='rows of the timed sampling chain')
+flags.DEFINE_integer('bench_write_chunks', 4, help='chunks of --bench_sample_rows rows written to CSV')
+flags.DEFINE_integer('bench_gen_cases', 5, help='cases completed by the timed generation loop')
+flags.DEFINE_string('bench_dir', None, help='directory of scaled logs and checkpoints, a temporary one if unset')
+flags.DEFINE_string('bench_output', 'benchmark_results.json', help='results JSON')
+flags.DEFINE_string('bench_baseline', None, help='results JSON of a previous run to compare against')
+flags.DEFINE_float('bench_tolerance', 0.2, help='allowed relative slowdown against the baseline')
+
+# metrics where larger is better, all others are durations
+_RATES = ('_per_s',)
+
+
+@contextmanager
+def _timed(module, name, totals):
+    # accumulates the time spent in module.name into totals[name]
+    fn = getattr(module, name)
+
+    def wrapper(*args, **kwargs):
+        st = time.perf_counter()
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            totals[name] = totals.get(name, 0.) + time.perf_counter() - st
+
+    setattr(module, name, wrapper)
+    try:
+        yield totals
+    finally:
+        setattr(module, name, fn)
+
+
+def _median_time(fn, repeats):
+    fn()
+    times = []
+    for _ in range(repeats):
+        st = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - st)
+    return statistics.median(times)
+
+
+def _allocations(fn):
+    # (allocating operator calls, allocated bytes) of one call of fn
+    with torch.profiler.profile(activities=[torch.profiler.ProfilerActivity.CPU], profile_memory=True) as prof:
+        fn()
+    events = [each for each in prof.events() if each.name != '[memory]' and each.self_cpu_memory_usage > 0]
+    return len(events), sum(each.self_cpu_memory_usage for each in events)
+
+
+def _reset_flags(data, logdir, eval):
+    FLAGS.data = data
+    FLAGS.logdir = logdir
+    FLAGS.eval = eval
+    FLAGS.still_condition = '0'
+    FLAGS.sample_async = False
+    FLAGS.distributed = False
+
+
+def _build_models(train_cont_data, train_dis_data_list, device):
+    # the models of co_evolving_condition.train for the still condition 0
+    set_model_sizes(FLAGS, train_cont_data.shape[1], [each.shape[1] for each in train_dis_data_list])
+    return build_models(model_config(FLAGS, train_cont_data.shape[0]), device)
+
+
+def _gen_seq(df, num_cases):
+    # activity sequences of the first cases, framed by Start/End as the --gen_seq_output files
+    df = df[df[FLAGS.state_column] == 'complete'].sort_values([FLAGS.id_column, FLAGS.time_column], kind='stable')
+    rows = []
+    for case, group in list(df.groupby(FLAGS.id_column, sort=False))[:num_cases]:
+        rows.append((case, 'Start'))
+        rows.extend((case, act) for act in group[FLAGS.act_column])
+        rows.append((case, 'End'))
+    return pd.DataFrame(rows, columns=['caseid', 'act'])
+
+
+def benchmark_log(data, workdir, device):
+    result = {}
+    totals = {}
+    _reset_flags(data, os.path.join(workdir, 'train'), False)
+    with _timed(pm4py.read, 'read_xes', totals), _timed(tabular_dataload, '_preprocessing', totals):
+        train, train_cont_data, train_dis_data, _, attention_train_list, _, (transformer_con, transformer_dis, meta), \
+            con_idx, dis_idx = tabular_dataload.get_dataset(FLAGS)
+    result['activity_instances'] = int(train.shape[0])
+    result['read_xes_s'] = totals['read_xes']
+    result['preprocessing_s'] = totals['_preprocessing']
+
+    train_con, train_dis = train[:, con_idx], train[:, dis_idx]
+    t = _median_time(lambda: (transformer_con.transform(train_con), transformer_dis.transform(train_dis)),
+                     FLAGS.bench_repeats)
+    result['transform_rows_per_s'] = train.shape[0] / t
+    t = _median_time(lambda: (transformer_con.inverse_transform(train_cont_data),
+                              transformer_dis.inverse_transform(train_dis_data)), FLAGS.bench_repeats)
+    result['inverse_transform_rows_per_s'] = train.shape[0] / t
+
+    num_class = np.array([each[0] for each in transformer_dis.output_info])
+    splits = np.cumsum(num_class)[:-1]
+    train_dis_data_list = np.split(train_dis_data, splits, axis=1)
+    still_cond_used_for_sampling_list = [train_dis_data_list[0]]
+    FLAGS.still_condition = [0]
+    model_cont, trainer_cont, net_sampler, model_dis_list, trainer_dis_list = _build_models(
+        train_cont_data, train_dis_data_list, device)
+    attention = AttentionBatch.from_lists(attention_train_list, device=device)
+
+    batch = min(FLAGS.training_batch_size, train.shape[0])
+    x_0_cont = torch.tensor(train_cont_data[:batch]).to(device)
+    x_0_dis_list = [torch.tensor(each[:batch]).to(device) for each in train_dis_data_list]
+    x_attention = attention.rows(0, batch)
+    optim_cont = torch.optim.Adam(model_cont.parameters(), lr=FLAGS.lr_con)
+    optim_dis_list = [torch.optim.Adam(each.parameters(), lr=FLAGS.lr_dis) for each in model_dis_list]
+    sched_cont = torch.optim.lr_scheduler.LambdaLR(optim_cont, lr_lambda=warmup_lr)
+
+    def train_step():
+        cont_loss, dis_loss_list = training_with(x_0_cont, x_0_dis_list, x_attention, trainer_cont, trainer_dis_list,
+                                                 trainer_cont, FLAGS, still_cond_used_for_sampling_list)
+        optim_cont.zero_grad()
+        cont_loss.backward()
+        torch.nn.utils.clip_grad_norm_(model_cont.parameters(), FLAGS.grad_clip)
+        optim_cont.step()
+        sched_cont.step()
+        for i in range(len(num_class)):
+            if i not in FLAGS.still_condition:
+                dis_loss_list[i].backward()
+                optim_dis_list[i].step()
+                optim_dis_list[i].zero_grad()
+
+    result['train_steps_per_s'] = 1. / _median_time(train_step, FLAGS.bench_repeats)
+
+    model_cont.eval()
+    for each in model_dis_list:
+        each.eval()
+    sample_rows = min(FLAGS.bench_sample_rows, train.shape[0])
+    conditions = conditions_from_rows(attention, still_cond_used_for_sampling_list)
+
+    def sample():
+        for _ in sample_chunks(sample_rows, sample_rows, conditions, net_sampler, trainer_dis_list, num_class,
+                               train_cont_data.shape[1], transformer_con, FLAGS, device):
+            pass
+
+    result['sampling_rows_per_s'] = sample_rows / _median_time(sample, max(1, FLAGS.bench_repeats // 2))
+    allocations, allocated = _allocations(sample)
+    result['sampling_allocations_per_chain'] = allocations
+    result['sampling_allocated_mb_per_chain'] = allocated / 2 ** 20
+
+    write_rows = sample_rows * FLAGS.bench_write_chunks
+    os.makedirs(workdir, exist_ok=True)
+    job = SimpleNamespace(T=FLAGS.T, still_condition=FLAGS.still_condition, num_class=num_class,
+                          cont_dim=train_cont_data.shape[1], transformer_con=transformer_con,
+                          transformer_dis=transformer_dis, con_idx=con_idx, dis_idx=dis_idx, chunk_size=sample_rows)
+    for name, workers in (('sample_write_rows_per_s', 0), ('sample_write_pipelined_rows_per_s', FLAGS.decode_workers)):
+        job.decode_workers = workers
+        t = _median_time(lambda: write_samples(os.path.join(workdir, 'sample.csv'), write_rows, conditions, net_sampler,
+                                               trainer_dis_list, job, device), max(1, FLAGS.bench_repeats // 2))
+        result[name] = write_rows / t
+
+    # eval-mode generation runs from a checkpoint of these (untrained) weights
+    ckpt = {'model_con': model_cont.state_dict()}
+    for i, each in enumerate(model_dis_list):
+        ckpt[f'model_dis_{i}'] = each.state_dict()
+    logdir = os.path.join(workdir, 'generate')
+    os.makedirs(logdir, exist_ok=True)
+    torch.save(ckpt, os.path.join(logdir, 'ckpt.pt'))
+    gen_seq = _gen_seq(pm4py.convert_to_dataframe(pm4py.read.read_xes(os.path.join(tabular_dataload.DATA_PATH, data))),
+                       FLAGS.bench_gen_cases)
+    gen_seq_path = os.path.join(logdir, 'gen_seq.csv')
+    gen_seq.to_csv(gen_seq_path, index=False)
+    _reset_flags(data, logdir, True)
+    FLAGS.gen_seq_output = gen_seq_path
+    totals = {}
+    with _timed(tabular_dataload, 'load_data', totals):
+        st = time.perf_counter()
+        co_evolving_condition.train(FLAGS)
+        elapsed = time.perf_counter() - st
+    result['generation_ms_per_case'] = 1e3 * (elapsed - totals['load_data']) / gen_seq['caseid'].nunique()
+    return result
+
+
+def compare(results, baseline, tolerance):
+    """Relative change of every metric against the baseline run, and the list of regressions beyond tolerance."""
+    base = {(each['log'], each['scale']): each['metrics'] for each in baseline['results']}
+    changes, regressions = [], []
+    for each in results['results']:
+        reference = base.get((each['log'], each['scale']))
+        if reference is None:
+            continue
+        for name, value in each['metrics'].items():
+            if name not in reference or not reference[name] or name == 'activity_instances':
+                continue
+            change = value / reference[name] - 1.
+            worse = -change if name.endswith(_RATES) else change
+            line = f"{each['log']} x{each['scale']} {name}: {reference[name]:.4g} -> {value:.4g} ({change:+.1%})"
+            changes.append(line)
+            if worse > tolerance:
+                regressions.append(line)
+    return changes, regressions
+
+
+def run(argv):
+    torch.manual_seed(FLAGS.seed)
+    np.random.seed(FLAGS.seed)
+    device = torch.device('cpu')
+    # absolute, since tabular_dataload resolves relative log paths against tabular_datasets
+    workdir = os.path.abspath(FLAGS.bench_dir or tempfile.mkdtemp(prefix='bench_'))
+    if '.' in workdir:
+        # tabular_dataload names its outputs after the log path up to the first dot
+        raise ValueError(f'--bench_dir must not contain a dot: {workdir}')
+    os.makedirs(workdir, exist_ok=True)
+    src = os.path.join(tabular_dataload.DATA_PATH, FLAGS.bench_log)
+
+    results = {'environment': {'python': platform.python_version(), 'torch': torch.__version__,
+                               'platform': platform.platform(), 'cpus': os.cpu_count(),
+                               'torch_threads': torch.get_num_threads(), 'T': FLAGS.T,
+                               'training_batch_size': FLAGS.training_batch_size},
+               'results': []}
+    for scale in map(int, FLAGS.bench_scales.split(',')):
+        # every log, the bundled one at scale 1 included, is a copy in workdir: preprocessing writes its outputs
+        # next to the log it reads, never into tabular_datasets. The copies have no dot before the extension
+        data = write_scaled_log(src, workdir, scale, FLAGS.id_column)
+        print(f'benchmarking {FLAGS.bench_log} x{scale}')
+        metrics = benchmark_log(data, os.path.join(workdir, f'x{scale}'), device)
+        results['results'].append({'log': FLAGS.bench_log, 'scale': scale, 'metrics': metrics})
+        print(json.dumps(metrics, indent=2))
+    for events in [int(each) for each in FLAGS.bench_synthetic_events.split(',') if each]:
+        data = os.path.join(workdir, f'synthetic_{events}.xes')
+        write_xes(generate_log(cases_for_events(events), seed=FLAGS.seed), data)
+        print(f'benchmarking synthetic log of {events} events')
+        metrics = benchmark_log(data, os.path.join(workdir, f'synthetic_{events}'), device)
+        results['results'].append({'log': f'synthetic_{events}', 'scale': 1, 'metrics': metrics})
+        print(json.dumps(metrics, indent=2))
+
+    with open(FLAGS.bench_output, 'w') as f:
+        json.dump(results, f, indent=2)
+    print(f'results written to {FLAGS.bench_output}')
+
+    if FLAGS.bench_baseline:
+        with open(FLAGS.bench_baseline) as f:
+            baseline = json.load(f)
+        changes, regressions = compare(results, baseline, FLAGS.bench_tolerance)
+        print('\n'.join(changes))
+        if regressions:
+            print(f'{len(regressions)} regression(s) beyond {FLAGS.bench_tolerance:.0%}:')
+            print('\n'.join(regressions))
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    app.run(run)
@@ -0,0 +1,32 @@
+"""Scaled copies of an event log: every case replicated `scale` times under new case ids."""
+import os
+import shutil
+import pandas as pd
+import pm4py
+
+
+def scale_log(df, id_column, scale):
+    # copies keep activities, resources and timestamps, only the case ids differ
+    copies = []
+    for r in range(scale):
+        copy = df.copy()
+        for column in (id_column, 'case:concept:name'):
+            if column in copy.columns:
+                copy[column] = copy[column].astype(str) + (f'_{r}' if r else '')
+        copies.append(copy)
+    return pd.concat(copies, ignore_index=True)
+
+
+def write_scaled_log(src_path, dst_dir, scale, id_column='caseid'):
+    """Writes the log at `src_path` replicated `scale` times to `dst_dir`, returns the new XES path.
+
+    At scale 1 the log is copied as it is, so preprocessing outputs land next to the copy, not the source.
+    """
+    name = os.path.splitext(os.path.basename(src_path))[0].replace('.', '_')
+    dst_path = os.path.join(dst_dir, f'{name}_x{scale}.xes')
+    if scale == 1 and not os.path.exists(dst_path):
+        shutil.copyfile(src_path, dst_path)
+    elif not os.path.exists(dst_path):
+        df = pm4py.convert_to_dataframe(pm4py.read.read_xes(src_path))
+        pm4py.write_xes(scale_log(df, id_column, scale), dst_path, case_id_key=id_column)
+    return dst_path
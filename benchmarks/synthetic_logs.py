@@ -0,0 +1,196 @@
+"""Synthetic event logs in the schema of the bundled training logs, for load testing.
+
+Every activity instance becomes a start and a complete event with `caseid`, `concept:name`,
+`time:timestamp`, `user` and `lifecycle:transition`. Every case is framed by Start/End events. Activities
+follow a random sparse transition graph, each one is performed by a resource from its own pool, and a
+fraction of consecutive activities run as parallel branches (start, start, complete, complete). All
+columns are built with whole-log numpy operations and the XES is written as text, so a few million events
+take seconds.
+
+    python benchmarks/synthetic_logs.py --events 2000000 --activities 40 --resources 500 --output logs/synth
+"""
+import argparse
+import os
+import numpy as np
+import pandas as pd
+
+COLUMNS = ['caseid', 'concept:name', 'time:timestamp', 'user', 'lifecycle:transition']
+
+_XES_HEADER = '''<?xml version="1.0" encoding="utf-8" ?>
+<log xes.version="1849-2016" xes.features="nested-attributes" xmlns="http://www.xes-standard.org/">
+\t<extension name="Concept" prefix="concept" uri="http://www.xes-standard.org/concept.xesext" />
+\t<extension name="Time" prefix="time" uri="http://www.xes-standard.org/time.xesext" />
+\t<extension name="Lifecycle" prefix="lifecycle" uri="http://www.xes-standard.org/lifecycle.xesext" />
+\t<string key="origin" value="csv" />
+'''
+
+
+def _segmented_exclusive_cumsum(values, starts):
+    # sum of the preceding values of the same segment, segments begin at the indices `starts`
+    total = np.cumsum(values)
+    before = np.r_[0., total[:-1]]
+    return before - np.repeat(before[starts], np.diff(np.r_[starts, len(values)]))
+
+
+def cases_for_events(events, min_length=3, max_length=15):
+    """Number of cases of a log of about `events` events."""
+    # every case has 4 marker events (Start/End, start and complete) and 2 events per activity
+    return max(1, round(events / (4 + min_length + max_length)))
+
+
+def generate_log(num_cases, num_activities=20, num_resources=100, min_length=3, max_length=15,
+                 parallel_prob=0.1, successors=3, resources_per_activity=5, mean_wait=3600., mean_process=1800.,
+                 start='2020-01-01', mean_interarrival=600., seed=0):
+    """Columns of a synthetic log as numpy arrays, events sorted by case, timestamp and lifecycle.
+
+    Case lengths (activities between Start and End) are uniform in [min_length, max_length]. An activity
+    is followed by one of `successors` random activities. Waiting times are exponential and processing
+    times log-normal with per-activity means around mean_wait / mean_process seconds. An activity starts
+    a parallel branch with the next one with probability `parallel_prob`.
+    """
+    rng = np.random.RandomState(seed)
+    lengths = rng.randint(min_length, max_length + 1, num_cases)
+    num = int(lengths.sum())
+    case = np.repeat(np.arange(num_cases), lengths)
+    first = np.r_[0, np.cumsum(lengths)[:-1]]
+    position = np.arange(num) - np.repeat(first, lengths)
+
+    # activities: a random walk on a sparse transition graph, one step for all cases at once
+    graph = rng.randint(0, num_activities, (num_activities, successors))
+    activity = np.empty(num, dtype=np.int64)
+    current = rng.randint(0, num_activities, num_cases)
+    for p in range(lengths.max()):
+        alive = np.flatnonzero(lengths > p)
+        activity[first[alive] + p] = current[alive]
+        current = graph[current, rng.randint(0, successors, num_cases)]
+    pools = rng.randint(0, num_resources, (num_activities, resources_per_activity))
+    resource = pools[activity, rng.randint(0, resources_per_activity, num)]
+
+    # durations in seconds, each activity with its own scale
+    wait_scale = mean_wait * rng.lognormal(0., 0.5, num_activities)
+    process_scale = mean_process * rng.lognormal(0., 0.5, num_activities)
+    wait = np.rint(rng.exponential(1., num) * wait_scale[activity])
+    process = np.rint(rng.lognormal(0., 1., num) * process_scale[activity] / np.exp(0.5))
+    wait[first] = 0.
+
+    # parallel pairs (i, i + 1) within a case, never overlapping: i + 1 starts `gap` seconds after i
+    last = position == np.repeat(lengths, lengths) - 1
+    parallel = (rng.rand(num) < parallel_prob) & ~last
+    parallel &= ~np.r_[False, parallel[:-1]]
+    second = np.r_[False, parallel[:-1]]
+    gap = np.rint(rng.exponential(60., num))
+    next_wait = np.r_[wait[1:], 0.]
+    advance = process + next_wait
+    advance[parallel] = gap[parallel]
+    # the next activity waits for both branches: i ends process[i] - gap[i] after i + 1 started
+    branch = np.flatnonzero(second)
+    advance[branch] = np.maximum(process[branch - 1] - gap[branch - 1], process[branch]) + next_wait[branch]
+
+    case_start = np.cumsum(rng.exponential(mean_interarrival, num_cases))
+    start_time = np.repeat(case_start, lengths) + _segmented_exclusive_cumsum(advance, first)
+    end_time = start_time + process
+    case_end = np.maximum.reduceat(end_time, first)
+
+    # events: the Start/End markers and a start and complete event per activity instance
+    names = np.array([f'Activity {i}' for i in range(num_activities)] + ['Start', 'End'], dtype=object)
+    users = np.array([f'{i}' for i in range(num_resources)] + ['Start', 'End'], dtype=object)
+    ev_case = np.r_[np.arange(num_cases), np.arange(num_cases), case, case]
+    ev_name = np.r_[np.full(num_cases, num_activities), np.full(num_cases, num_activities + 1), activity, activity]
+    ev_user = np.r_[np.full(num_cases, num_resources), np.full(num_cases, num_resources + 1), resource, resource]
+    ev_time = np.r_[case_start, case_end, start_time, end_time]
+    ev_complete = np.r_[np.zeros(num_cases, dtype=bool), np.zeros(num_cases, dtype=bool),
+                        np.zeros(num, dtype=bool), np.ones(num, dtype=bool)]
+    # markers get both transitions like the bundled logs: duplicate them as complete events
+    marker = np.arange(2 * num_cases)
+    ev_case, ev_name, ev_user, ev_time = (np.r_[each, each[marker]] for each in (ev_case, ev_name, ev_user, ev_time))
+    ev_complete = np.r_[ev_complete, np.ones(2 * num_cases, dtype=bool)]
+    # Start first and End last within a case, starts before completes at equal times
+    rank = np.select([ev_name == num_activities, ev_name == num_activities + 1], [0, 2], 1)
+    order = np.lexsort((ev_complete, ev_time, rank, ev_case))
+
+    timestamps = np.datetime64(start, 's') + np.rint(ev_time[order]).astype('timedelta64[s]')
+    return {'caseid': ev_case[order], 'concept:name': names[ev_name[order]],
+            'time:timestamp': np.datetime_as_string(timestamps, unit='s'), 'user': users[ev_user[order]],
+            'lifecycle:transition': np.where(ev_complete[order], 'complete', 'start').astype(object)}
+
+
+_XES_EVENT = ('\t\t<event>\n\t\t\t<string key="caseid" value="%s" />\n'
+              '\t\t\t<string key="concept:name" value="%s" />\n'
+              '\t\t\t<string key="lifecycle:transition" value="%s" />\n'
+              '\t\t\t<string key="user" value="%s" />\n'
+              '\t\t\t<date key="time:timestamp" value="%s" />\n'
+              '\t\t\t<string key="task" value="%s" />\n\t\t</event>\n')
+
+# events formatted and written per chunk
+_CHUNK = 200000
+
+
+def _encode(values, escape):
+    # escaped strings as a list, every distinct value escaped once
+    codes, uniques = pd.factorize(values)
+    return np.array([escape(str(each)) for each in uniques], dtype=object)[codes].tolist()
+
+
+def _xml_escape(value):
+    return value.replace('&', '&amp;').replace('<', '&lt;').replace('>', '&gt;').replace('"', '&quot;')
+
+
+def _csv_escape(value):
+    return '"' + value.replace('"', '""') + '"' if any(c in value for c in ',"\n') else value
+
+
+def write_csv(log, path):
+    columns = [log['caseid'].tolist(), _encode(log['concept:name'], _csv_escape), log['time:timestamp'].tolist(),
+               _encode(log['user'], _csv_escape), log['lifecycle:transition'].tolist()]
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write(','.join(COLUMNS) + '\n')
+        for st in range(0, len(columns[0]), _CHUNK):
+            f.write(''.join('%s,%s,%s,%s,%s\n' % row for row in zip(*(each[st:st + _CHUNK] for each in columns))))
+
+
+def write_xes(log, path):
+    """Writes the log as XES text in the layout of the bundled training logs (events grouped in traces)."""
+    case = log['caseid']
+    case_str, name, user = (_encode(log[each], _xml_escape) for each in ('caseid', 'concept:name', 'user'))
+    transition, timestamp = log['lifecycle:transition'].tolist(), log['time:timestamp'].tolist()
+    new_trace = np.flatnonzero(np.r_[True, case[1:] != case[:-1]])
+    trace_end = np.r_[new_trace[1:], len(case)]
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write(_XES_HEADER)
+        for st in range(0, len(new_trace), max(1, _CHUNK // 32)):
+            parts = []
+            for first, end in zip(new_trace[st:st + _CHUNK // 32], trace_end[st:st + _CHUNK // 32]):
+                parts.append('\t<trace>\n\t\t<string key="concept:name" value="%s" />\n' % case_str[first])
+                parts.extend(_XES_EVENT % row for row in zip(case_str[first:end], name[first:end],
+                                                             transition[first:end], user[first:end],
+                                                             timestamp[first:end], name[first:end]))
+                parts.append('\t</trace>\n')
+            f.write(''.join(parts))
+        f.write('</log>\n')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Writes a synthetic event log as XES and CSV.')
+    parser.add_argument('--events', type=int, default=100000, help='approximate number of events')
+    parser.add_argument('--activities', type=int, default=20)
+    parser.add_argument('--resources', type=int, default=100)
+    parser.add_argument('--min_length', type=int, default=3, help='fewest activities per case')
+    parser.add_argument('--max_length', type=int, default=15, help='most activities per case')
+    parser.add_argument('--parallel_prob', type=float, default=0.1, help='probability of a parallel branch')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', default='synthetic', help='output path without extension')
+    parser.add_argument('--formats', default='xes,csv')
+    args = parser.parse_args()
+
+    num_cases = cases_for_events(args.events, args.min_length, args.max_length)
+    log = generate_log(num_cases, args.activities, args.resources, args.min_length, args.max_length,
+                       args.parallel_prob, seed=args.seed)
+    os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+    for fmt in args.formats.split(','):
+        path = f'{args.output}.{fmt}'
+        {'xes': write_xes, 'csv': write_csv}[fmt](log, path)
+        print(f'{len(log["caseid"])} events of {num_cases} cases written to {path}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,126 @@
+"""Inference bundle: the sampler weights of a checkpoint and everything generation needs, in one file.
+
+The file has the safetensors layout: an 8-byte little-endian header length, a JSON header with the dtype, shape
+and byte range of every tensor, then the raw tensor bytes. It can be memory-mapped, and read by the
+`safetensors` package too. The header's `__metadata__` holds the generation entry of the checkpoint (model
+config, `i2s` vocabularies, transformer min/max metadata) as JSON. Optimizer and scheduler state, and the models
+of still-condition columns that sampling never runs, are left out. Tensors are read from the mapping only when
+they are requested.
+
+    python bundle.py --logdir codi_exp [--output codi_exp/generator.safetensors] [--dtype bf16]
+"""
+import argparse
+import json
+import mmap
+import os
+import struct
+import torch
+
+_DTYPES = {torch.float64: 'F64', torch.float32: 'F32', torch.float16: 'F16', torch.bfloat16: 'BF16',
+           torch.int64: 'I64', torch.int32: 'I32', torch.int16: 'I16', torch.int8: 'I8', torch.uint8: 'U8',
+           torch.bool: 'BOOL'}
+_TORCH_DTYPES = {name: dtype for dtype, name in _DTYPES.items()}
+_ALIGN = 8
+
+
+def write_bundle(path, tensors, metadata):
+    """Writes the named tensors and a JSON-able metadata dict to `path` in the safetensors layout."""
+    tensors = {name: tensor.detach().cpu().contiguous() for name, tensor in tensors.items()}
+    header = {'__metadata__': {'generation': json.dumps(metadata)}}
+    offset = 0
+    for name, tensor in tensors.items():
+        size = tensor.numel() * tensor.element_size()
+        header[name] = {'dtype': _DTYPES[tensor.dtype], 'shape': list(tensor.shape),
+                        'data_offsets': [offset, offset + size]}
+        offset += size
+    encoded = json.dumps(header, separators=(',', ':')).encode('utf-8')
+    encoded += b' ' * (-len(encoded) % _ALIGN)
+    with open(path, 'wb') as f:
+        f.write(struct.pack('<Q', len(encoded)))
+        f.write(encoded)
+        for tensor in tensors.values():
+            f.write(tensor.reshape(-1).view(torch.uint8).numpy().tobytes())
+
+
+class Bundle:
+    """A memory-mapped bundle; `tensor(name)` views the mapped bytes without reading the rest of the file."""
+
+    def __init__(self, path):
+        with open(path, 'rb') as f:
+            size = struct.unpack('<Q', f.read(8))[0]
+            header = json.loads(f.read(size))
+            # copy-on-write: the tensors are writable views, pages are read on first access
+            self._buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_COPY)
+        self._data_start = 8 + size
+        self.metadata = json.loads(header.pop('__metadata__')['generation'])
+        self._entries = header
+
+    def keys(self):
+        return self._entries.keys()
+
+    def tensor(self, name):
+        entry = self._entries[name]
+        dtype = _TORCH_DTYPES[entry['dtype']]
+        start, end = entry['data_offsets']
+        if end == start:
+            return torch.empty(entry['shape'], dtype=dtype)
+        count = (end - start) // torch.tensor([], dtype=dtype).element_size()
+        return torch.frombuffer(self._buffer, dtype=dtype, count=count,
+                                offset=self._data_start + start).reshape(entry['shape'])
+
+    def state_dict(self, model):
+        prefix = f'{model}.'
+        return {name[len(prefix):]: self.tensor(name) for name in self._entries if name.startswith(prefix)}
+
+    def generation_state(self):
+        # the checkpoint's generation entry, with the attention embeddings of the bundled models
+        state = dict(self.metadata)
+        state['attention_embeddings'] = {}
+        for model in state['models']:
+            prefix = f'attention.{model}.'
+            names = sorted((name for name in self._entries if name.startswith(prefix)),
+                           key=lambda name: int(name[len(prefix):]))
+            state['attention_embeddings'][model] = [self.tensor(name) for name in names]
+        return state
+
+
+def sampler_models(config):
+    # the models sampling runs: the continuous one and the discrete ones that are not still conditions
+    return ['model_con'] + [f'model_dis_{i}' for i in range(len(config['dis_input_size']))
+                            if i not in config['still_condition']]
+
+
+def export_bundle(ckpt, path, dtype=torch.float32):
+    """Writes the inference bundle of a training checkpoint, floating tensors stored as `dtype`."""
+    if 'generation' not in ckpt:
+        raise ValueError('the checkpoint has no generation entry, it was written by an older training run')
+    state = dict(ckpt['generation'])
+    embeddings = state.pop('attention_embeddings')
+    state['models'] = sampler_models(state['config'])
+    state['dtype'] = _DTYPES[dtype]
+    cast = lambda tensor: tensor.to(dtype) if tensor.is_floating_point() else tensor
+    tensors = {}
+    for model in state['models']:
+        for name, tensor in ckpt[model].items():
+            tensors[f'{model}.{name}'] = cast(tensor)
+        for k, tensor in enumerate(embeddings[model]):
+            tensors[f'attention.{model}.{k}'] = cast(tensor)
+    write_bundle(path, tensors, state)
+    return path
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Exports the inference bundle of a training checkpoint.')
+    parser.add_argument('--logdir', default='./codi_exp', help='directory of ckpt.pt')
+    parser.add_argument('--output', default=None, help='bundle path, generator.safetensors in logdir by default')
+    parser.add_argument('--dtype', choices=['fp32', 'bf16'], default='fp32', help='dtype of the stored weights')
+    args = parser.parse_args()
+    ckpt = torch.load(os.path.join(args.logdir, 'ckpt.pt'), map_location=torch.device('cpu'))
+    output = args.output or os.path.join(args.logdir, 'generator.safetensors')
+    export_bundle(ckpt, output, {'fp32': torch.float32, 'bf16': torch.bfloat16}[args.dtype])
+    print(f'{output}: {os.path.getsize(output) / 2 ** 20:.1f} MB, '
+          f"ckpt.pt: {os.path.getsize(os.path.join(args.logdir, 'ckpt.pt')) / 2 ** 20:.1f} MB")
+
+
+if __name__ == '__main__':
+    main()
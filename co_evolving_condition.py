@@ -1,33 +1,42 @@
 import os
-import math
 import json
+import time
 import torch
 from absl import flags
 # import torch
 # import matplotlib.pyplot as plt
 from tensorboardX import SummaryWriter
-from diffusion_continuous import GaussianDiffusionTrainer, GaussianDiffusionSampler
+import pandas as pd
 import tabular_dataload
 from torch.utils.data import DataLoader
-from models.tabular_unet import tabularUnet
 from diffusion_discrete import MultinomialDiffusion
+from model_builder import set_model_sizes, model_config, build_models, load_attention_embeddings
+from generation import generation_state
+from log_writer import GeneratedLogWriter
+from attention_batch import AttentionBatch
+from background_sampling import PeriodicSampler
+import distributed
+import profiling
+import telemetry
+from profiling import stage
 # import evaluation
 import logging
 # import numpy as np
 # import pandas as pd
 from utils import *
-from torchvision import transforms
 
 def train(FLAGS):
 
     FLAGS = flags.FLAGS
     device = torch.device("cuda:0" if torch.cuda.is_available() else "cpu")
+    rank, world_size = distributed.init_distributed(FLAGS)
+    is_main = rank == 0
 
     #Load Datasets
-    train, train_cont_data, train_dis_data, test, attention_train_list, attention_test_list, (transformer_con, transformer_dis, meta), con_idx, dis_idx = tabular_dataload.get_dataset(FLAGS)
-    # for att_i in attention_train
-    attention_tensor_list = [torch.tensor(attention_train).to(device) for attention_train in attention_train_list]
-    print('attention_tensor_list', attention_tensor_list[0].type(), attention_tensor_list[1].shape, attention_tensor_list[2].type() ,attention_tensor_list[3].shape, attention_tensor_list[4].type())
+    train, train_cont_data, train_dis_data, test, attention_train_list, attention_test_list, (transformer_con, transformer_dis, meta), con_idx, dis_idx = tabular_dataload.get_dataset(FLAGS, write_files=is_main)
+    # attention context laid out once (sequence-first) and kept on the device
+    attention_train = AttentionBatch.from_lists(attention_train_list, device=device)
+    print('attention_train', attention_train.prev_acts.shape, attention_train.prev_res.shape, attention_train.curr_act.shape)
 
 
     FLAGS.still_condition = [int(each) for each in FLAGS.still_condition.split(',')]
@@ -77,39 +86,26 @@ def train(FLAGS):
     # elif meta['problem_type'] == 'regression': metric = "r2"
     # else: metric = 'macro_f1'
     
-    # Condtinuous Diffusion Model Setup
-    FLAGS.cont_input_size = train_cont_data.shape[1]
-    FLAGS.cont_cond_size = [each_cond.shape[1] for each_cond in train_dis_data_list]
+    # Continuous and Discrete Diffusion Model Setup
+    set_model_sizes(FLAGS, train_cont_data.shape[1], num_class)
     print('FLAGS.cont_cond_size',FLAGS.cont_cond_size)
-    FLAGS.cont_output_size = train_cont_data.shape[1]
-    FLAGS.encoder_dim =  list(map(int, FLAGS.encoder_dim_con.split(',')))
-    FLAGS.nf =  FLAGS.nf_con
-    model_cont = tabularUnet(FLAGS, '-1')
+    print('FLAGS.dis_cond_size',FLAGS.dis_cond_size)
+    model_cont, trainer_cont, net_sampler, model_dis_list, trainer_dis_list = build_models(
+        model_config(FLAGS, train_dis_data.shape[0]), device)
     optim_cont = torch.optim.Adam(model_cont.parameters(), lr=FLAGS.lr_con)
     sched_cont = torch.optim.lr_scheduler.LambdaLR(optim_cont, lr_lambda=warmup_lr)
-    trainer_cont = GaussianDiffusionTrainer(model_cont, FLAGS.beta_1, FLAGS.beta_T, FLAGS.T).to(device)
-    net_sampler = GaussianDiffusionSampler(model_cont, FLAGS.beta_1, FLAGS.beta_T, FLAGS.T, FLAGS.mean_type, FLAGS.var_type).to(device)
-
-    FLAGS.dis_input_size = [0]*len(num_class)
-    FLAGS.dis_cond_size = [0]*len(num_class)
-    FLAGS.dis_output_size = [0]*len(num_class)
-    model_dis_list = [0]*len(num_class)
-    optim_dis_list = [0]*len(num_class)
-    sched_dis_list = [0]*len(num_class)
-    trainer_dis_list = [0]*len(num_class)
-    for i in range(len(num_class)):
-        # Discrete Diffusion Model Setup
-
-        FLAGS.dis_input_size[i] = train_dis_data_list[i].shape[1]
-        FLAGS.dis_cond_size[i] = [each_cond.shape[1] for each_cond in train_dis_con_data_list[i]]
-        print('FLAGS.dis_cond_size[i]',FLAGS.dis_cond_size[i])
-        FLAGS.dis_output_size[i] = train_dis_data_list[i].shape[1]
-        FLAGS.encoder_dim =  list(map(int, FLAGS.encoder_dim_dis.split(',')))
-        FLAGS.nf =  FLAGS.nf_dis
-        model_dis_list[i] = tabularUnet(FLAGS, i)
-        optim_dis_list[i] = torch.optim.Adam(model_dis_list[i].parameters(), lr=FLAGS.lr_dis)
-        sched_dis_list[i] = torch.optim.lr_scheduler.LambdaLR(optim_dis_list[i], lr_lambda=warmup_lr)
-        trainer_dis_list[i] = MultinomialDiffusion(num_class[i], train_dis_data_list[i].shape, model_dis_list[i], FLAGS, timesteps=FLAGS.T,loss_type='vb_stochastic').to(device)
+    optim_dis_list = [torch.optim.Adam(each.parameters(), lr=FLAGS.lr_dis) for each in model_dis_list]
+    sched_dis_list = [torch.optim.lr_scheduler.LambdaLR(each, lr_lambda=warmup_lr) for each in optim_dis_list]
+
+    sampler_dis_list = list(trainer_dis_list)
+    if world_size > 1:
+        # gradients are all-reduced by the DDP wrappers of the training path, sampling keeps the plain models
+        trainer_cont.model = distributed.wrap_model(model_cont)
+        for i in range(len(num_class)):
+            if i not in FLAGS.still_condition:
+                trainer_dis_list[i] = MultinomialDiffusion(num_class[i], train_dis_data_list[i].shape, distributed.wrap_model(model_dis_list[i]), FLAGS, timesteps=FLAGS.T,loss_type='vb_stochastic').to(device)
+        torch.manual_seed(FLAGS.seed + rank)
+        np.random.seed(FLAGS.seed + rank)
 
     if FLAGS.parallel:
         trainer = torch.nn.DataParallel(trainer_cont)
@@ -124,9 +120,11 @@ def train(FLAGS):
 
     scores_max_eval = -10
 
-    total_steps_both = FLAGS.total_epochs_both * int(train.shape[0]/FLAGS.training_batch_size+1)   # 20000, training times
+    # each process trains on its own contiguous shard of the rows
+    shard_start, shard_end, rows_per_rank = distributed.shard_rows(train.shape[0], rank, world_size)
+    total_steps_both = FLAGS.total_epochs_both * int(rows_per_rank/FLAGS.training_batch_size+1)   # 20000, training times
     print('total_steps_both', total_steps_both)
-    sample_step = FLAGS.sample_step * int(train.shape[0]/FLAGS.training_batch_size+1)   # 2000, sample times
+    sample_step = FLAGS.sample_step * int(rows_per_rank/FLAGS.training_batch_size+1)   # 2000, sample times
     logging.info("Total steps: %d" %total_steps_both)
     logging.info("Sample steps: %d" %sample_step)
     logging.info("Continuous: %d, %d" %(train_cont_data.shape[0], train_cont_data.shape[1]))
@@ -138,41 +136,46 @@ def train(FLAGS):
         datalooper_train_dis_list = [0]*len(num_class)
         x_0_dis_list = [0]*len(num_class)
         epoch = 0
-        train_iter_cont = DataLoader(train_cont_data, batch_size=FLAGS.training_batch_size)
-        train_iter_attention_list = [DataLoader(torch.tensor(attention_train), batch_size=FLAGS.training_batch_size) for attention_train in attention_train_list]
+        train_iter_cont = DataLoader(train_cont_data[shard_start:shard_end], batch_size=FLAGS.training_batch_size)
         datalooper_train_cont = infiniteloop(train_iter_cont)
-        datalooper_train_attention_list = [infiniteloop(train_iter_attention) for train_iter_attention in train_iter_attention_list]
+        datalooper_train_attention = attention_train.rows(shard_start, shard_end).iter_batches(FLAGS.training_batch_size)
         for i in range(len(num_class)):
             # train_iter_con = DataLoader(train_con_data, batch_size=FLAGS.training_batch_size)
-            train_iter_dis_list[i] = DataLoader(train_dis_data_list[i], batch_size=FLAGS.training_batch_size)
+            # one-hot batches come out in the working dtype, no per-step cast
+            train_iter_dis_list[i] = DataLoader(train_dis_data_list[i][shard_start:shard_end].astype(np.float32),
+                                                batch_size=FLAGS.training_batch_size)
             # datalooper_train_con = infiniteloop(train_iter_con)
             datalooper_train_dis_list[i] = infiniteloop(train_iter_dis_list[i])
-        writer = SummaryWriter(FLAGS.logdir)
-        writer.flush()
+        writer = None
+        periodic_sampler = None
+        if is_main:
+            writer = SummaryWriter(FLAGS.logdir)
+            writer.flush()
+            periodic_sampler = PeriodicSampler(FLAGS, attention_train, still_cond_used_for_sampling_list, num_class,
+                                               train_cont_data.shape[1], transformer_con, transformer_dis, con_idx, dis_idx)
+        train_rate = telemetry.Rate()
         for step in range(total_steps_both):
             model_cont.train()
-            x_0_cont = next(datalooper_train_cont).to(device)
-                # ns_con, ns_dis = make_negative_condition(x_0_con, x_0_dis)
-                # con_loss, con_loss_ns, dis_loss, dis_loss_ns = training_with(x_0_con, x_0_dis, trainer, trainer_dis, ns_con, ns_dis, transformer_dis, FLAGS)
+            with stage('next_batch'):
+                x_0_cont = next(datalooper_train_cont).to(device)
+                    # ns_con, ns_dis = make_negative_condition(x_0_con, x_0_dis)
+                    # con_loss, con_loss_ns, dis_loss, dis_loss_ns = training_with(x_0_con, x_0_dis, trainer, trainer_dis, ns_con, ns_dis, transformer_dis, FLAGS)
 
-            x_attention_list = [next(datalooper_train_attention).to(device) for datalooper_train_attention in datalooper_train_attention_list]
-            for i, each in enumerate(x_attention_list):
-                if i == 1 or i == 0 or i == 4:
-                    x_attention_list[i] = each.permute(1, 0)
+                x_attention = next(datalooper_train_attention)
 
-            for i in range(len(num_class)):
-                if i not in FLAGS.still_condition:
-                    # model_con.train()
-                    model_dis_list[i].train()
+                for i in range(len(num_class)):
+                    if i not in FLAGS.still_condition:
+                        # model_con.train()
+                        model_dis_list[i].train()
 
-                    # x_0_con = next(datalooper_train_con).to(device).float()
-                x_0_dis_list[i] = next(datalooper_train_dis_list[i]).to(device)
+                        # x_0_con = next(datalooper_train_con).to(device).float()
+                    x_0_dis_list[i] = next(datalooper_train_dis_list[i]).to(device)
 
 
                 # ns_con, ns_dis = make_negative_condition(x_0_con, x_0_dis)
                 # con_loss, con_loss_ns, dis_loss, dis_loss_ns = training_with(x_0_con, x_0_dis, trainer, trainer_dis, ns_con, ns_dis, transformer_dis, FLAGS)
             # !dis_loss_list = training_with(x_0_dis_list, trainer_dis_list, FLAGS)
-            cont_loss, dis_loss_list = training_with(x_0_cont, x_0_dis_list, x_attention_list,
+            cont_loss, dis_loss_list = training_with(x_0_cont, x_0_dis_list, x_attention,
                                                      trainer_cont, trainer_dis_list,
                                                      trainer_cont, FLAGS,
                                                      still_cond_used_for_sampling_list)
@@ -180,23 +183,29 @@ def train(FLAGS):
             # loss_dis = dis_loss + FLAGS.lambda_dis * dis_loss_ns
             loss_cont = cont_loss
             optim_cont.zero_grad()
-            loss_cont.backward()
-            torch.nn.utils.clip_grad_norm_(model_cont.parameters(), FLAGS.grad_clip)
-            optim_cont.step()
-            sched_cont.step()
-            writer.add_scalar('loss_continuous', cont_loss, step)
+            with stage('backward_continuous'):
+                loss_cont.backward()
+            with stage('optimizer_continuous'):
+                torch.nn.utils.clip_grad_norm_(model_cont.parameters(), FLAGS.grad_clip)
+                optim_cont.step()
+                sched_cont.step()
+            if is_main:
+                writer.add_scalar('loss_continuous', cont_loss, step)
             for i in range(len(num_class)):
                 # loss_con = con_loss + FLAGS.lambda_con * con_loss_ns
                 # loss_dis = dis_loss + FLAGS.lambda_dis * dis_loss_ns
                 if i not in FLAGS.still_condition:
                     loss_dis = dis_loss_list[i]
-                    loss_dis.backward()
-                    optim_dis_list[i].step()
-                    sched_dis_list[i].step()
-                    optim_dis_list[i].zero_grad()
-                    torch.nn.utils.clip_grad_value_(trainer_dis_list[i].parameters(), FLAGS.grad_clip)  # , self.args.clip_value)
-                    torch.nn.utils.clip_grad_norm_(trainer_dis_list[i].parameters(), FLAGS.grad_clip)  # , self.args.clip_norm)
-                    writer.add_scalar('loss_discrete', dis_loss_list[i], step)
+                    with stage('backward_discrete', i):
+                        loss_dis.backward()
+                    with stage('optimizer_discrete', i):
+                        optim_dis_list[i].step()
+                        sched_dis_list[i].step()
+                        optim_dis_list[i].zero_grad()
+                        torch.nn.utils.clip_grad_value_(trainer_dis_list[i].parameters(), FLAGS.grad_clip)  # , self.args.clip_value)
+                        torch.nn.utils.clip_grad_norm_(trainer_dis_list[i].parameters(), FLAGS.grad_clip)  # , self.args.clip_norm)
+                    if is_main:
+                        writer.add_scalar('loss_discrete', dis_loss_list[i], step)
 
             # log
             # writer.add_scalar('loss_continuous_ns', con_loss_ns, step)
@@ -205,7 +214,13 @@ def train(FLAGS):
             # writer.add_scalar('total_discrete', loss_dis, step)
             # model_dis_list[i].train(mode=False)
 
-            if (step+1) % int(train.shape[0]/FLAGS.training_batch_size+1) == 0:
+            train_rate.add(x_0_cont.shape[0])
+            if (step+1) % FLAGS.telemetry_interval == 0 or step == (total_steps_both-1):
+                losses = {f'loss_discrete_{i}': float(dis_loss_list[i]) for i in range(len(num_class))
+                          if i not in FLAGS.still_condition}
+                train_rate.emit('train', step=step, epoch=epoch, loss_continuous=float(cont_loss), **losses)
+
+            if (step+1) % int(rows_per_rank/FLAGS.training_batch_size+1) == 0:
 
                 # logging.info(f"Epoch :{epoch}, diffusion continuous loss: {con_loss:.3f}, discrete loss: {dis_loss:.3f}")
                 # logging.info(f"Epoch :{epoch}, CL continuous loss: {con_loss_ns:.3f}, discrete loss: {dis_loss_ns:.3f}")
@@ -216,66 +231,55 @@ def train(FLAGS):
                         logging.info(f"Epoch :{epoch}, discrete loss: {dis_loss_list[i]:.6f}")
                 epoch +=1
 
-            if step > 0 and sample_step > 0 and step % sample_step == 0 or step==(total_steps_both-1):
-                print('llll')
-                log_x_T_dis_list = [0] * len(num_class)
-                x_dis_list = [0] * len(num_class)
-                sample_dis_list = [0] * len(num_class)
-                sample_list = [0] * len(num_class)
-
-                model_cont.eval()
-                for i in range(len(num_class)):
-                    if i not in FLAGS.still_condition:
-                        model_dis_list[i].eval()
-                for i, each in enumerate(attention_tensor_list):
-                    if i == 1 or i == 0 or i == 4:
-                        attention_tensor_list[i] = each.permute(1, 0)
-                with torch.no_grad():
-                    x_T_cont = torch.randn(train_cont_data.shape[0], train_cont_data.shape[1]).to(device)
+            # sampling and checkpoints only on the main process
+            if is_main and (step > 0 and sample_step > 0 and step % sample_step == 0 or step==(total_steps_both-1)):
+                with train_rate.excluded():
+                    model_cont.eval()
                     for i in range(len(num_class)):
-                        log_x_T_dis_list[i] = log_sample_categorical(torch.zeros(train_dis_data_list[i].shape, device=device), num_class[i]).to(device)
-                    x_cont, x_dis_list = sampling_with(x_T_cont, log_x_T_dis_list, attention_tensor_list, net_sampler, trainer_dis_list, transformer_con, FLAGS, still_cond_used_for_sampling_list)
-                sample_cont = transformer_con.inverse_transform(x_cont.detach().cpu().numpy())
-                # sample_dis = transformer_dis.inverse_transform(still_cond_used_for_sampling)
-                x_dis = torch.tensor(np.concatenate(x_dis_list, axis=1))
-                x_dis = apply_activate(x_dis, transformer_dis.output_info)
-                sample_dis = transformer_dis.inverse_transform(x_dis.detach().cpu().numpy())
-                sample = np.zeros([train_cont_data.shape[0], len(con_idx + dis_idx)])
-                for i in range(len(con_idx)):
-                    sample[:, con_idx[i]] = sample_cont[:, i]
-                for i in range(len(dis_idx)):
-                    sample[:, dis_idx[i]] = sample_dis[:, i]
-                sample_pd = pd.DataFrame(sample).dropna()
-                # scores, std, param = evaluation.compute_scores(train=train, test = None, synthesized_data=[sample], metadata=meta, eval=None)
-                # div_mean, div_std = evaluation.compute_diversity(train=train, fake=[sample])
-                # scores['coverage'] = div_mean['coverage']
-                # std['coverage'] = div_std['coverage']
-                # scores['density'] = div_mean['density']
-                # std['density'] = div_std['density']
-                # f1 = scores[metric]
-                # logging.info(f"---------Epoch {epoch} Evaluation----------")
-                # logging.info(scores)
-                # logging.info(std)
-
-                # if scores_max_eval < torch.tensor(f1):
-                #     scores_max_eval = torch.tensor(f1)
-                if True:
-                    logging.info(f"Save model!")
-                    ckpt = {
-                        'model_con': model_cont.state_dict(),
-                        'sched_con': sched_cont.state_dict(),
-                        'optim_con': optim_cont.state_dict(),
-                        'step': step,
-                        'sample': sample,
-                        # 'ml_param': param
-                    }
-                    for i in range(len(num_class)):
-                        ckpt[f'model_dis_{i}'] = model_dis_list[i].state_dict()
-                        ckpt[f'sched_dis_{i}'] = sched_dis_list[i].state_dict()
-                        ckpt[f'optim_dis_{i}'] = optim_dis_list[i].state_dict()
-                        # 'ml_param': param
-
-                    torch.save(ckpt, os.path.join(FLAGS.logdir, 'ckpt.pt'))
+                        if i not in FLAGS.still_condition:
+                            model_dis_list[i].eval()
+                    with stage('periodic_sampling'):
+                        periodic_sampler(step, net_sampler, sampler_dis_list, device, final=step == (total_steps_both-1))
+                    # scores, std, param = evaluation.compute_scores(train=train, test = None, synthesized_data=[sample], metadata=meta, eval=None)
+                    # div_mean, div_std = evaluation.compute_diversity(train=train, fake=[sample])
+                    # scores['coverage'] = div_mean['coverage']
+                    # std['coverage'] = div_std['coverage']
+                    # scores['density'] = div_mean['density']
+                    # std['density'] = div_std['density']
+                    # f1 = scores[metric]
+                    # logging.info(f"---------Epoch {epoch} Evaluation----------")
+                    # logging.info(scores)
+                    # logging.info(std)
+
+                    # if scores_max_eval < torch.tensor(f1):
+                    #     scores_max_eval = torch.tensor(f1)
+                    with stage('checkpoint'):
+                        logging.info(f"Save model!")
+                        ckpt = {
+                            'model_con': model_cont.state_dict(),
+                            'sched_con': sched_cont.state_dict(),
+                            'optim_con': optim_cont.state_dict(),
+                            'step': step,
+                            'sample_file': periodic_sampler.latest_sample_file,
+                            'generation': generation_state(FLAGS, train_dis_data.shape[0], transformer_con,
+                                                           transformer_dis, con_idx, dis_idx, meta, model_cont,
+                                                           model_dis_list),
+                            # 'ml_param': param
+                        }
+                        for i in range(len(num_class)):
+                            ckpt[f'model_dis_{i}'] = model_dis_list[i].state_dict()
+                            ckpt[f'sched_dis_{i}'] = sched_dis_list[i].state_dict()
+                            ckpt[f'optim_dis_{i}'] = optim_dis_list[i].state_dict()
+                            # 'ml_param': param
+
+                        checkpoint_start = time.perf_counter()
+                        torch.save(ckpt, os.path.join(FLAGS.logdir, 'ckpt.pt'))
+                        telemetry.emit('checkpoint', step=step, seconds=time.perf_counter() - checkpoint_start,
+                                       bytes=os.path.getsize(os.path.join(FLAGS.logdir, 'ckpt.pt')))
+            profiling.step()
+        if periodic_sampler is not None:
+            periodic_sampler.close()
+        distributed.cleanup()
         logging.info(f"Evaluation best : {scores_max_eval}")
 
         #final test
@@ -329,14 +333,21 @@ def train(FLAGS):
         # logging.info(std)
 
     else:
-        ckpt = torch.load(os.path.join(FLAGS.logdir, 'ckpt.pt'), map_location=torch.device('cpu'))
-        model_cont.load_state_dict(ckpt['model_con'])
-        model_cont.eval()
-        for i in range(len(num_class)):
-            if i not in FLAGS.still_condition:
-                model_dis_list[i].load_state_dict(ckpt[f'model_dis_{i}'])
-                # model_con.eval()
-                model_dis_list[i].eval()
+        checkpoint_start = time.perf_counter()
+        with stage('load_checkpoint'):
+            ckpt = torch.load(os.path.join(FLAGS.logdir, 'ckpt.pt'), map_location=torch.device('cpu'))
+            model_cont.load_state_dict(ckpt['model_con'])
+            model_cont.eval()
+            for i in range(len(num_class)):
+                if i not in FLAGS.still_condition:
+                    model_dis_list[i].load_state_dict(ckpt[f'model_dis_{i}'])
+                    # model_con.eval()
+                    model_dis_list[i].eval()
+            if 'generation' in ckpt:
+                load_attention_embeddings(model_cont, ckpt['generation']['attention_embeddings']['model_con'])
+                for i in range(len(num_class)):
+                    load_attention_embeddings(model_dis_list[i], ckpt['generation']['attention_embeddings'][f'model_dis_{i}'])
+        telemetry.emit('load_checkpoint', seconds=time.perf_counter() - checkpoint_start)
 
         def transformer(x):
             data = [x]
@@ -354,7 +365,6 @@ def train(FLAGS):
 
         #############
         res_list = json_input['attention'][1]['i2s']
-        dict_res_index = dict(zip(range(len(res_list)), res_list))
 
         local_path = os.path.join(DATA_PATH, FLAGS.gen_seq_output)
         gen = pd.read_csv(local_path)
@@ -362,20 +372,27 @@ def train(FLAGS):
         gen['act'] = gen['act'].map(lambda x: '_'.join(x.split()))
         gen['act'] = gen['act'].map(
             lambda x: json_input['columns'][0]['i2s'].index(x) if x in json_input['columns'][0]['i2s'] else x)
-        gen_res = []
-        gen_wait = []
-        gen_process = []
         gen_act = list(gen['act'])
         acts_prev = []
         res_prev = []
+        from datetime import datetime
+        output_path = os.path.join(FLAGS.logdir, f'gen_sample_{datetime.now().strftime("%Y%m%d_%H%M%S")}.{FLAGS.gen_output_format}')
+        writer = GeneratedLogWriter(output_path, res_list, chunk_rows=FLAGS.gen_chunk_rows)
+        # sampled resource codes and log times of the rows since chunk_start, written every gen_chunk_rows rows
+        chunk_start = 0
+        gen_res = []
+        gen_wait = []
+        gen_process = []
+        last_res = None
+        generation_start = time.perf_counter()
         for i in range(len(gen_act)):
             if gen_act[i] == 'Start':
                 start_flag=i
-                gen_res.append('Start')
+                gen_res.append(0)
                 gen_wait.append(0)
                 gen_process.append(0)
             elif gen_act[i] == 'End':
-                gen_res.append('End')
+                gen_res.append(0)
                 gen_wait.append(0)
                 gen_process.append(0)
                 # pass
@@ -392,14 +409,14 @@ def train(FLAGS):
                     acts_prev = [[]]
                     res_prev = [[]]
                     acts_prev[0].append(int(gen_act[i-1]))
-                    res_prev[0].append(int(gen_res[i-1]))
+                    res_prev[0].append(last_res)
 
                     acts_padding = [[False for each in acts_prev[0]]]
                     res_padding = [[False for each in res_prev[0]]]
                 else:
 
                     acts_prev[0].append(int(gen_act[i - 1]))
-                    res_prev[0].append(int(gen_res[i - 1]))
+                    res_prev[0].append(last_res)
                     if len(acts_prev[0]) >= 30:
                         acts_prev[0] = acts_prev[0][-30:]
                     if len(res_prev[0]) >= 30:
@@ -407,49 +424,41 @@ def train(FLAGS):
                     acts_padding = [[False for each in acts_prev[0]]]
                     res_padding = [[False for each in res_prev[0]]]
 
-                attention_tensor_list = [torch.tensor(acts_prev).to(device), torch.tensor(res_prev).to(device),
-                                             torch.tensor(acts_padding).to(device),torch.tensor(res_padding).to(device),
-                                         torch.tensor(cur_act).to(device) ]
-                for i, each in enumerate(attention_tensor_list):
-                    if i == 1 or i == 0 or i == 4:
-                        attention_tensor_list[i] = each.permute(1, 0)
+                attention = AttentionBatch.from_rows(acts_prev, res_prev, acts_padding, res_padding, cur_act, device=device)
                 log_x_T_dis_list = [0] * len(num_class)
                 x_dis_list = [0] * len(num_class)
-                with torch.no_grad():
+                with torch.no_grad(), stage('generate_event'):
                     x_T_cont = torch.randn(1, train_cont_data.shape[1]).to(device)
                     for i in range(len(num_class)):
                         log_x_T_dis_list[i] = log_sample_categorical(
                             torch.zeros((1, train_dis_data_list[i].shape[1]), device=device), num_class[i]).to(
                             device)
-                    x_cont, x_dis_list = sampling_with(x_T_cont, log_x_T_dis_list, attention_tensor_list,
+                    x_cont, x_dis_list = sampling_with(x_T_cont, log_x_T_dis_list, attention,
                                                        net_sampler, trainer_dis_list,
                                                        transformer_con, FLAGS, still_cond_used_for_sampling_list)
-                sample_cont = transformer_con.inverse_transform(x_cont.detach().cpu().numpy())
-                # sample_dis = transformer_dis.inverse_transform(still_cond_used_for_sampling)
-                x_dis = torch.tensor(np.concatenate(x_dis_list, axis=1))
-                x_dis = apply_activate(x_dis, transformer_dis.output_info)
-                sample_dis = transformer_dis.inverse_transform(x_dis.detach().cpu().numpy())
-                sample = np.zeros([1, len(con_idx + dis_idx)])
-                for i in range(len(con_idx)):
-                    sample[:, con_idx[i]] = sample_cont[:, i]
-                for i in range(len(dis_idx)):
-                    sample[:, dis_idx[i]] = sample_dis[:, i]
+                sample = decode_samples(x_cont, x_dis_list, transformer_con, transformer_dis, con_idx, dis_idx)
                 # sample_pd = pd.DataFrame(sample).dropna()
                 # print('sample', sample)
-                new_res = sample[:, 1][0]
+                last_res = int(sample[:, 1][0])
 
-                gen_res.append(new_res)
+                gen_res.append(last_res)
                 gen_wait.append(sample[:, 2][0])
                 gen_process.append(sample[:, 3][0])
-
-        gen['res'] = gen_res
-        gen['wait'] = gen_wait
-        gen['process'] = gen_process
-        gen['res'] = gen['res'].map(lambda x:x if x=='Start' or x=='End' else dict_res_index[int(x)])
-        gen['wait'] = gen['wait'].map(lambda x: round(math.exp(x) - 1))
-        gen['process'] = gen['process'].map(lambda x: round(math.exp(x) - 1))
-        from datetime import datetime
-        gen.to_csv(os.path.join(FLAGS.logdir, f'gen_sample_{datetime.now().strftime("%Y%m%d_%H%M%S")}.csv'), index=False)
+                profiling.step()
+            if len(gen_res) == FLAGS.gen_chunk_rows or chunk_start + len(gen_res) == len(gen_act):
+                with stage('write_output'):
+                    writer.write(gen.iloc[chunk_start:chunk_start + len(gen_res)], gen_res, gen_wait, gen_process)
+                chunk_start += len(gen_res)
+                gen_res, gen_wait, gen_process = [], [], []
+        with stage('write_output'):
+            writer.close()
+
+        generation_seconds = time.perf_counter() - generation_start
+        num_cases = gen_act.count('Start')
+        num_events = len(gen_act) - num_cases - gen_act.count('End')
+        telemetry.emit('generation', cases=num_cases, events=num_events, seconds=generation_seconds,
+                       ms_per_case=1000 * generation_seconds / max(num_cases, 1),
+                       events_per_s=num_events / max(generation_seconds, 1e-9))
 
         # # fake_sample=[]
         #     log_x_T_dis_list = [0]*len(num_class)
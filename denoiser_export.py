@@ -0,0 +1,271 @@
+"""TorchScript and ONNX export of the denoisers, and a sampler that runs the exported reverse step.
+
+`export` traces, for the models of a checkpoint or inference bundle:
+
+* `denoiser_con`: the continuous denoiser, (x, t, conditions...) -> eps,
+* `denoiser_dis_<i>`: the denoiser of every sampled discrete column, (x, t, conditions..., attention) -> logits,
+* `reverse_step`: one full reverse step of `utils.sampling_with` over all columns, with the Gaussian noise of the
+  continuous column and the uniform noise of the categorical draws as inputs,
+
+as `<name>.pt` (TorchScript) and, when the `onnx` package is installed, `<name>.onnx`. `reverse_step.json` holds
+what `TracedSampler` needs to run the chain. `TracedSampler` draws the noise in the order of the eager sampler, so
+with the same seed it returns the samples of `sampling_with`; `--check` asserts that.
+
+    python denoiser_export.py --logdir codi_exp [--onnx] [--check]
+"""
+import argparse
+import json
+import os
+import warnings
+import numpy as np
+import torch
+import torch.nn.functional as F
+from attention_batch import AttentionBatch
+from generation import Generator
+from utils import condition_tensors, log_sample_categorical, sampling_with
+
+ATTENTION_INPUTS = list(AttentionBatch._fields)
+# opset of the ONNX exports, the first with a LayerNormalization op
+OPSET = 17
+
+
+class ContinuousDenoiser(torch.nn.Module):
+    def __init__(self, model):
+        super().__init__()
+        self.model = model
+
+    def forward(self, x, t, conds):
+        return self.model(x, t, list(conds), None, True)
+
+
+class DiscreteDenoiser(torch.nn.Module):
+    def __init__(self, model):
+        super().__init__()
+        self.model = model
+
+    def forward(self, x, t, conds, prev_acts, prev_res, prev_acts_padding, prev_res_padding, curr_act):
+        attention = AttentionBatch(prev_acts, prev_res, prev_acts_padding, prev_res_padding, curr_act)
+        return self.model(x, t, list(conds), attention, False)
+
+
+class ReverseStep(torch.nn.Module):
+    """One time step of `sampling_with`: x_t -> x_{t-1} for the continuous column and the sampled discrete ones.
+
+    `x_dis` holds every discrete column, still conditions as their float one-hot rows. `noise` is the Gaussian
+    noise of the continuous column (zeros at t = 0) and `uniforms` the float64 uniform noise of the Gumbel-max
+    draw of every sampled column, in column order.
+    """
+
+    def __init__(self, net_sampler, trainer_dis_list, still_condition):
+        super().__init__()
+        self.net_sampler = net_sampler
+        self.sampled = [i for i in range(len(trainer_dis_list)) if i not in still_condition]
+        # the models of still-condition columns never run and are left out of the export
+        self.trainer_dis = torch.nn.ModuleDict({str(i): trainer_dis_list[i] for i in self.sampled})
+
+    def forward(self, x_cont, t, noise, prev_acts, prev_res, prev_acts_padding, prev_res_padding, curr_act, x_dis,
+                uniforms):
+        attention = AttentionBatch(prev_acts, prev_res, prev_acts_padding, prev_res_padding, curr_act)
+        x_dis = list(x_dis)
+        mean, log_var = self.net_sampler.p_mean_variance(x_t=x_cont, t=t, cond=x_dis, attention=attention, trans=None)
+        x_cont_next = torch.clip(mean + torch.exp(0.5 * log_var) * noise, -1., 1.)
+        for i, uniform in zip(self.sampled, uniforms):
+            cond = [each for j, each in enumerate(x_dis) if j != i]
+            model_log_prob, _ = self.trainer_dis[str(i)].p_pred(x_dis[i], t, cond, attention)
+            gumbel_noise = -torch.log(-torch.log(uniform + 1e-30) + 1e-30)
+            sample = (gumbel_noise + model_log_prob).argmax(dim=1)
+            x_dis[i] = torch.log(F.one_hot(sample, x_dis[i].shape[1]).float().clamp(min=1e-30))
+        # as in sampling_with, the continuous column only moves on with a sampled discrete column
+        if self.sampled:
+            x_cont = x_cont_next
+        return (x_cont,) + tuple(x_dis[i] for i in self.sampled)
+
+
+def _freeze(module, models):
+    # the attention token embeddings sit outside the module tree, tracing needs them without grad to fold them in
+    module.requires_grad_(False)
+    for model in models:
+        for each in model.attention.src_token_embedding_list:
+            each.requires_grad_(False)
+    return module.eval()
+
+
+def example_inputs(generator, num_rows=4, history=3):
+    """Random inputs of a reverse step at t = 1, in the layout of `ReverseStep.forward`."""
+    attention = AttentionBatch.from_rows(
+        np.random.randint(0, generator.act_pad, (num_rows, history)).tolist(),
+        np.random.randint(0, generator.res_pad, (num_rows, history)).tolist(),
+        (np.random.rand(num_rows, history) < 0.3).tolist(), (np.random.rand(num_rows, history) < 0.3).tolist(),
+        np.random.randint(0, generator.act_pad, (num_rows, 1)).tolist(), device=generator.device)
+    x_cont = torch.randn(num_rows, generator.cont_dim, device=generator.device)
+    x_dis = tuple(torch.log(F.one_hot(torch.randint(0, each, (num_rows,)), each).float().clamp(min=1e-30))
+                  .to(generator.device) for each in generator.num_class)
+    uniforms = tuple(torch.rand(num_rows, each, dtype=torch.float64, device=generator.device)
+                     for i, each in enumerate(generator.num_class) if i not in generator.flags.still_condition)
+    t = torch.ones(num_rows, dtype=torch.long, device=generator.device)
+    return x_cont, t, torch.randn_like(x_cont), *attention, x_dis, uniforms
+
+
+def _onnx_export(module, inputs, path, input_names, output_names, dynamic_axes):
+    try:
+        import onnx  # noqa: F401, torch.onnx.export needs it
+    except ImportError:
+        raise RuntimeError('ONNX export needs the onnx package (pip install onnx onnxruntime)') from None
+    torch.onnx.export(module, inputs, path, input_names=input_names, output_names=output_names,
+                      dynamic_axes=dynamic_axes, opset_version=OPSET, dynamo=False)
+
+
+def export(generator, output_dir, onnx=False):
+    """Traces the denoisers and the reverse step of a Generator into `output_dir`, returns the written paths."""
+    os.makedirs(output_dir, exist_ok=True)
+    still = generator.flags.still_condition
+    sampled = [i for i in range(len(generator.num_class)) if i not in still]
+    step = _freeze(ReverseStep(generator.net_sampler, generator.trainer_dis_list, still),
+                   [generator.net_sampler.model] + [each._denoise_fn for each in generator.trainer_dis_list])
+    inputs = example_inputs(generator)
+    x_cont, t, _, *attention, x_dis, uniforms = inputs
+    rows = {0: 'rows'}
+    attention_axes = {'prev_acts': {0: 'history', 1: 'rows'}, 'prev_res': {0: 'history', 1: 'rows'},
+                      'prev_acts_padding': {0: 'rows', 1: 'history'}, 'prev_res_padding': {0: 'rows', 1: 'history'},
+                      'curr_act': {1: 'rows'}}
+    dis_names = [f'x_dis_{i}' for i in range(len(x_dis))]
+    modules = {
+        'denoiser_con': (ContinuousDenoiser(generator.net_sampler.model), (x_cont, t, x_dis),
+                         ['x', 't'] + [f'cond_{j}' for j in range(len(x_dis))], ['eps']),
+        'reverse_step': (step, inputs,
+                         ['x_cont', 't', 'noise'] + ATTENTION_INPUTS + dis_names + [f'uniform_{i}' for i in sampled],
+                         ['x_cont_next'] + [f'x_dis_{i}_next' for i in sampled]),
+    }
+    for i in sampled:
+        conds = tuple(each for j, each in enumerate(x_dis) if j != i)
+        modules[f'denoiser_dis_{i}'] = (DiscreteDenoiser(generator.trainer_dis_list[i]._denoise_fn),
+                                        (x_dis[i], t, conds, *attention),
+                                        ['x', 't'] + [f'cond_{j}' for j in range(len(conds))] + ATTENTION_INPUTS,
+                                        ['logits'])
+    paths = []
+    with torch.no_grad(), warnings.catch_warnings():
+        # the shape asserts of the models are constant in the trace, which is what tracing warns about
+        warnings.simplefilter('ignore', torch.jit.TracerWarning)
+        for name, (module, example, input_names, output_names) in modules.items():
+            traced = torch.jit.trace(module, example, check_trace=False)
+            paths.append(os.path.join(output_dir, f'{name}.pt'))
+            traced.save(paths[-1])
+            if onnx:
+                dynamic_axes = {each: attention_axes.get(each, rows) for each in input_names + output_names}
+                paths.append(os.path.join(output_dir, f'{name}.onnx'))
+                _onnx_export(module, example, paths[-1], input_names, output_names, dynamic_axes)
+    meta = {'T': generator.flags.T, 'still_condition': list(still), 'num_class': generator.num_class,
+            'cont_dim': generator.cont_dim,
+            'inputs': modules['reverse_step'][2], 'outputs': modules['reverse_step'][3]}
+    paths.append(os.path.join(output_dir, 'reverse_step.json'))
+    with open(paths[-1], 'w') as f:
+        json.dump(meta, f, indent=1)
+    return paths
+
+
+class TracedSampler:
+    """Runs `sampling_with` chains on the exported reverse step, with TorchScript or ONNX Runtime.
+
+    Called like `sampling_with` without the models: `sampler(x_T_cont, log_x_T_dis, attention, still_conds)`.
+    """
+
+    def __init__(self, export_dir, backend='torchscript', device=torch.device('cpu')):
+        with open(os.path.join(export_dir, 'reverse_step.json')) as f:
+            self.meta = json.load(f)
+        self.backend = backend
+        self.device = device
+        if backend == 'torchscript':
+            self.step = torch.jit.load(os.path.join(export_dir, 'reverse_step.pt'), map_location=device)
+        elif backend == 'onnx':
+            try:
+                import onnxruntime
+            except ImportError:
+                raise RuntimeError('the onnx backend needs the onnxruntime package') from None
+            self.session = onnxruntime.InferenceSession(os.path.join(export_dir, 'reverse_step.onnx'),
+                                                        providers=['CPUExecutionProvider'])
+            self.step = self._run_onnx
+        else:
+            raise ValueError(f'unknown backend {backend!r}, expected torchscript or onnx')
+
+    def _run_onnx(self, *inputs):
+        x_dis, uniforms = inputs[-2:]
+        tensors = list(inputs[:-2]) + list(x_dis) + list(uniforms)
+        feed = {name: tensor.cpu().numpy() for name, tensor in zip(self.meta['inputs'], tensors)}
+        return tuple(torch.from_numpy(each).to(self.device) for each in self.session.run(self.meta['outputs'], feed))
+
+    def __call__(self, x_T_cont, log_x_T_dis, attention, still_cond_used_for_sampling):
+        still = self.meta['still_condition']
+        sampled = [i for i in range(len(log_x_T_dis)) if i not in still]
+        x_cont = x_T_cont
+        x_dis = list(log_x_T_dis)
+        still_cond = condition_tensors(still_cond_used_for_sampling, still, x_cont.device)
+        for i in still:
+            x_dis[i] = still_cond[i]
+        with torch.no_grad():
+            for time_step in reversed(range(self.meta['T'])):
+                t = x_cont.new_ones([x_cont.shape[0], ], dtype=torch.long) * time_step
+                # the random draws of the eager chain: Gaussian noise, then one uniform per sampled column
+                noise = torch.randn_like(x_cont) if time_step > 0 else torch.zeros_like(x_cont)
+                uniforms = tuple(torch.rand(x_dis[i].shape, dtype=torch.float64, device=x_cont.device)
+                                 for i in sampled)
+                out = self.step(x_cont, t, noise, *attention, tuple(x_dis), uniforms)
+                x_cont = out[0]
+                for i, each in zip(sampled, out[1:]):
+                    x_dis[i] = each
+        return x_cont, [x.detach().cpu() for x in x_dis]
+
+
+def check(generator, sampler, num_rows=64, seed=0):
+    """Max abs difference of the continuous samples and the number of differing discrete ones, eager vs traced."""
+    np.random.seed(seed)
+    _, _, _, *attention, x_dis, _ = example_inputs(generator, num_rows, history=5)
+    attention = AttentionBatch(*attention)
+    conditions = [torch.exp(each).numpy() for each in x_dis]
+    results = []
+    for run in ('eager', 'traced'):
+        torch.manual_seed(seed)
+        with torch.no_grad():
+            x_T_cont = torch.randn(num_rows, generator.cont_dim).to(generator.device)
+            log_x_T_dis = [log_sample_categorical(torch.zeros((num_rows, each), device=generator.device), each)
+                           .to(generator.device) for each in generator.num_class]
+            if run == 'eager':
+                results.append(sampling_with(x_T_cont, log_x_T_dis, attention, generator.net_sampler,
+                                             generator.trainer_dis_list, generator.transformer_con, generator.flags,
+                                             conditions))
+            else:
+                results.append(sampler(x_T_cont, log_x_T_dis, attention, conditions))
+    (cont_eager, dis_eager), (cont_traced, dis_traced) = results
+    cont_diff = (cont_eager - cont_traced).abs().max().item()
+    dis_diff = sum(int((a.argmax(1) != b.argmax(1)).sum()) for a, b in zip(dis_eager, dis_traced))
+    return cont_diff, dis_diff
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Exports the denoisers to TorchScript and ONNX.')
+    parser.add_argument('--logdir', default='./codi_exp', help='directory of the model')
+    parser.add_argument('--model', default=None,
+                        help='inference bundle or checkpoint, generator.safetensors in logdir if present else ckpt.pt')
+    parser.add_argument('--output', default=None, help='export directory, <logdir>/export by default')
+    parser.add_argument('--onnx', action='store_true', help='also export ONNX graphs (needs the onnx package)')
+    parser.add_argument('--check', action='store_true', help='compare the exported chain with the eager one')
+    parser.add_argument('--backend', choices=['torchscript', 'onnx'], default='torchscript',
+                        help='runtime of the --check chain')
+    parser.add_argument('--tolerance', type=float, default=1e-5, help='--check tolerance of the continuous samples')
+    args = parser.parse_args()
+
+    model = args.model or os.path.join(args.logdir, 'generator.safetensors')
+    if not args.model and not os.path.exists(model):
+        model = os.path.join(args.logdir, 'ckpt.pt')
+    generator = Generator.load(model)
+    output = args.output or os.path.join(args.logdir, 'export')
+    for path in export(generator, output, onnx=args.onnx):
+        print(f'{path}: {os.path.getsize(path) / 2 ** 20:.1f} MB')
+    if args.check:
+        cont_diff, dis_diff = check(generator, TracedSampler(output, args.backend))
+        print(f'{args.backend} vs eager: continuous max abs diff {cont_diff:.3g}, discrete mismatches {dis_diff}')
+        if cont_diff > args.tolerance or dis_diff:
+            raise SystemExit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,6 +1,7 @@
 import torch
 import torch.nn.functional as F
 import numpy as np
+from profiling import stage
 # from inspect import isfunction
 
 
@@ -168,6 +169,10 @@ class MultinomialDiffusion(torch.nn.Module):
         return out
 
     def log_sample_categorical(self, logits):
+        with stage('log_sample_categorical'):
+            return self._log_sample_categorical(logits)
+
+    def _log_sample_categorical(self, logits):
         full_sample = []
         # k=0
         # for i in range(len(num_classes)):
@@ -0,0 +1,44 @@
+import math
+import os
+import torch
+import torch.distributed as dist
+from torch.nn.parallel import DistributedDataParallel
+
+
+def get_rank():
+    return dist.get_rank() if dist.is_initialized() else 0
+
+
+def init_distributed(FLAGS):
+    # joins the process group set up by torchrun (RANK, WORLD_SIZE, MASTER_ADDR, ... in the environment)
+    if not FLAGS.distributed:
+        return 0, 1
+    dist.init_process_group(backend='gloo')
+    local_world_size = int(os.environ.get('LOCAL_WORLD_SIZE', dist.get_world_size()))
+    num_threads = FLAGS.threads_per_proc if FLAGS.threads_per_proc > 0 else max(1, os.cpu_count() // local_world_size)
+    torch.set_num_threads(num_threads)
+    return dist.get_rank(), dist.get_world_size()
+
+
+def shard_rows(num_rows, rank, world_size):
+    """Contiguous rows [start, end) of this rank and the per-rank row count used for the step schedule.
+
+    The per-rank count is the same on every rank so all processes run the same number of steps
+    (a gradient all-reduce is a collective and would hang otherwise). Shards differ by at most one row, so none
+    is empty: a rank without rows would loop forever on its empty data loader.
+    """
+    if num_rows < world_size:
+        raise ValueError(f'{num_rows} training rows cannot be sharded over {world_size} processes')
+    start = rank * num_rows // world_size
+    end = (rank + 1) * num_rows // world_size
+    return start, end, math.ceil(num_rows / world_size)
+
+
+def wrap_model(model):
+    # the continuous model does not use its attention block, hence find_unused_parameters
+    return DistributedDataParallel(model, find_unused_parameters=True, broadcast_buffers=False)
+
+
+def cleanup():
+    if dist.is_initialized():
+        dist.destroy_process_group()
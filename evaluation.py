@@ -1,5 +1,10 @@
+import hashlib
+import json
+import pickle
+from collections import OrderedDict, deque
 import numpy as np
 import pandas as pd
+from scipy import sparse
 from xgboost import XGBClassifier, XGBRegressor
 from sklearn.ensemble import AdaBoostClassifier, RandomForestClassifier, RandomForestRegressor
 from sklearn.linear_model import LogisticRegression, LinearRegression
@@ -8,16 +13,43 @@ from sklearn.preprocessing import OneHotEncoder
 from sklearn.tree import DecisionTreeClassifier
 from sklearn.metrics import classification_report, accuracy_score, f1_score, precision_score, recall_score, roc_auc_score
 from sklearn.metrics import explained_variance_score, mean_squared_error, mean_absolute_error, r2_score
+from sklearn.metrics import pairwise_distances
 from sklearn.model_selection import ParameterGrid
+from sklearn.neighbors import NearestNeighbors
 from sklearn.utils._testing import ignore_warnings
 from sklearn.exceptions import ConvergenceWarning
 import logging
-from prdc import compute_prdc
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+import multiprocessing as mp
+from threadpoolctl import threadpool_limits
 from tqdm import tqdm
 
 CATEGORICAL = "categorical"
 CONTINUOUS = "continuous"
 
+# successive halving: fraction of grid cells kept per round, rows of the smallest budget
+_HALVING_FACTOR = 3
+_HALVING_MIN_ROWS = 500
+
+# one-hot width from which FeatureMaker(sparse='auto') builds CSR features
+_SPARSE_MIN_WIDTH = 64
+
+# estimators fitted directly on CSR features
+_SPARSE_MODELS = (LogisticRegression, LinearRegression, DecisionTreeClassifier, AdaBoostClassifier,
+                  RandomForestClassifier, RandomForestRegressor, MLPClassifier, MLPRegressor,
+                  XGBClassifier, XGBRegressor)
+
+# prepared features of the last few evaluated datasets
+_FEATURE_CACHE = OrderedDict()
+_FEATURE_CACHE_SIZE = 4
+
+# memory of one block of distances in compute_prdc_blocked, in MiB
+_PRDC_BLOCK_MB = 64
+# query rows per radius search of the tree algorithms
+_PRDC_QUERY_ROWS = 1024
+
 _MODELS = {
     'binary_classification': [ # 184
          {
@@ -156,18 +188,29 @@ _MODELS = {
 
 
 class FeatureMaker:
+    """Model features of a data array: scaled continuous columns and one-hot encoded categorical columns.
+
+    With sparse=True the features are a CSR matrix, which keeps large activity/resource vocabularies
+    cheap; 'auto' switches to CSR when the one-hot columns are at least _SPARSE_MIN_WIDTH wide.
+    """
 
-    def __init__(self, metadata, label_column='label', label_type='int', sample=50000):
+    def __init__(self, metadata, label_column='label', label_type='int', sample=50000, sparse='auto', seed=0):
         self.columns = metadata['columns']
         self.label_column = label_column
         self.label_type = label_type
         self.sample = sample
+        # own stream for the row subsample: cached and uncached runs leave the global numpy stream alike
+        self.random_state = np.random.RandomState(seed)
         self.encoders = dict()
+        if sparse == 'auto':
+            width = sum(cinfo['size'] for cinfo in self.columns
+                        if cinfo['type'] != CONTINUOUS and cinfo['name'] != label_column and cinfo['size'] > 2)
+            sparse = width >= _SPARSE_MIN_WIDTH
+        self.sparse = sparse
 
     def make_features(self, data):
-        data = data.copy()
-        np.random.shuffle(data)
-        data = data[:self.sample]
+        # shuffled rows without shuffling a copy of the whole array (same permutation as np.random.shuffle)
+        data = data[self.random_state.permutation(len(data))[:self.sample]]
 
         features = []
         labels = []
@@ -202,35 +245,59 @@ class FeatureMaker:
                     if encoder:
                         feature = encoder.transform(col)
                     else:
-                        encoder = OneHotEncoder(sparse=False, handle_unknown='ignore')
+                        encoder = OneHotEncoder(sparse=self.sparse, handle_unknown='ignore')
                         self.encoders[index] = encoder
                         feature = encoder.fit_transform(col)
 
             features.append(feature)
 
-        features = np.column_stack(features)
+        if self.sparse:
+            features = sparse.hstack([each if sparse.issparse(each) else each.reshape(-1, 1) for each in features],
+                                     format='csr')
+        else:
+            features = np.column_stack(features)
 
         return features, labels
 
 
-def _prepare_ml_problem(train, val, test, metadata, eval): 
-    fm = FeatureMaker(metadata)
-    x_trains, y_trains = [], []
-
-    for i in train:
-        x_train, y_train = fm.make_features(i)
-        x_trains.append(x_train)
-        y_trains.append(y_train)
-
-    x_val, y_val = fm.make_features(val)
-    if eval is None:
-        x_test = None
-        y_test = None
+def _digest(data):
+    # content hash of an array with its shape and dtype; object arrays (mixed strings and numbers) are pickled
+    if data is None:
+        return None
+    data = np.asarray(data)
+    digest = hashlib.sha1(repr((data.shape, data.dtype.str)).encode())
+    digest.update(pickle.dumps(data, protocol=4) if data.dtype.hasobject else np.ascontiguousarray(data).view(np.uint8))
+    return digest.hexdigest()
+
+
+def _prepare_ml_problem(train, val, test, metadata, eval):
+    # features of the same (synthetic replicas, validation, test) arrays are reused across calls,
+    # with the encoders fitted on the first replica
+    key = (json.dumps(metadata, sort_keys=True, default=str), tuple(_digest(i) for i in train), _digest(val),
+           _digest(test) if eval is not None else None)
+    if key not in _FEATURE_CACHE:
+        fm = FeatureMaker(metadata)
+        x_trains, y_trains = [], []
+
+        for i in train:
+            x_train, y_train = fm.make_features(i)
+            x_trains.append(x_train)
+            y_trains.append(y_train)
+
+        x_val, y_val = fm.make_features(val)
+        if eval is None:
+            x_test = None
+            y_test = None
+        else:
+            x_test, y_test = fm.make_features(test)
+        _FEATURE_CACHE[key] = x_trains, y_trains, x_val, y_val, x_test, y_test
+        while len(_FEATURE_CACHE) > _FEATURE_CACHE_SIZE:
+            _FEATURE_CACHE.popitem(last=False)
     else:
-        x_test, y_test = fm.make_features(test)
+        _FEATURE_CACHE.move_to_end(key)
     model = _MODELS[metadata['problem_type']]
 
-    return x_trains, y_trains, x_val, y_val, x_test, y_test, model
+    return (*_FEATURE_CACHE[key], model)
 
 
 def _weighted_f1(y_test, pred):
@@ -241,139 +308,267 @@ def _weighted_f1(y_test, pred):
     return weighted_f1 
 
 
+def _make_model(model_class, param, num_threads=0):
+    # fixed seed so a grid cell scores the same wherever it runs, n_jobs=-1 capped to the worker's threads
+    param = dict(param)
+    if num_threads > 0:
+        for key in ('n_jobs', 'nthread'):
+            if param.get(key) == -1:
+                param[key] = num_threads
+    if 'random_state' not in param and 'random_state' in model_class().get_params():
+        param['random_state'] = 0
+    return model_class(**param)
+
+
+def _model_inputs(model_class, *xs):
+    # CSR features stay sparse for the estimators that accept them, others get dense arrays
+    if issubclass(model_class, _SPARSE_MODELS):
+        return xs
+    return [each.toarray() if sparse.issparse(each) else each for each in xs]
+
+
+# data of the worker processes, set once by _init_worker
+_WORKER = {}
+
+
+def _init_worker(data, num_threads):
+    _WORKER['data'] = data
+    _WORKER['num_threads'] = num_threads
+    if num_threads > 0:
+        _WORKER['limits'] = threadpool_limits(limits=num_threads)
+
+
+def _worker_task(fn, task):
+    return fn(_WORKER['data'], _WORKER['num_threads'], *task)
+
+
+def _run_tasks(fn, tasks, data, n_workers=1, threads_per_worker=0):
+    """Runs fn(data, num_threads, *task) for every task and returns the results in task order.
+
+    With n_workers > 1 the tasks go to a process pool that receives `data` once per worker, each worker capped
+    to `threads_per_worker` BLAS/OpenMP threads (cores / n_workers if 0). Results do not depend on n_workers.
+    """
+    if n_workers <= 1:
+        with threadpool_limits(limits=threads_per_worker if threads_per_worker > 0 else None):
+            return [fn(data, threads_per_worker, *task) for task in tqdm(tasks)]
+    if threads_per_worker <= 0:
+        threads_per_worker = max(1, os.cpu_count() // n_workers)
+    with ProcessPoolExecutor(max_workers=n_workers, mp_context=mp.get_context('spawn'),
+                             initializer=_init_worker, initargs=(data, threads_per_worker)) as executor:
+        return list(tqdm(executor.map(_worker_task, [fn] * len(tasks), tasks), total=len(tasks)))
+
+
+def _grid_tasks(models):
+    # (model_class, param) of every grid cell, and the number of cells of each model
+    tasks = []
+    sizes = []
+    for model_spec in models:
+        param_set = list(ParameterGrid(model_spec.get('kwargs', dict())))
+        tasks.extend((model_spec['class'], param) for param in param_set)
+        sizes.append(len(param_set))
+    return tasks, sizes
+
+
+def _split(results, sizes):
+    st = 0
+    for size in sizes:
+        yield results[st:st + size]
+        st += size
+
+
+def _train_rows(data, rows=None):
+    # first training set, restricted to the given row index
+    x_train, y_train = data['x_trains'][0], data['y_trains'][0]
+    if rows is None:
+        return x_train, y_train
+    return x_train[rows], y_train[rows]
+
+
+def _successive_halving(cell_fn, models, data, metric, n_workers=1, threads_per_worker=0, stats=None):
+    """Successive halving over the grid of every model, returns the results of the last round per model.
+
+    All grid cells are first fitted on a small random subset of the training rows, then only the best
+    1 / _HALVING_FACTOR of each model's cells (by `metric` on the validation set) move on to a budget
+    _HALVING_FACTOR times larger, until the survivors are fitted on all rows. A model with a single
+    survivor skips the intermediate rounds. The smallest budget is at least _HALVING_MIN_ROWS rows, which
+    limits the number of rounds on small data: the first rounds then cut harder, and with a single budget
+    level this is the grid search. The number of fits is added to stats['fits'] if given.
+    """
+    n_rows = len(data['y_trains'][0])
+    # nested subsets: every budget extends the rows of the previous one
+    order = np.random.RandomState(0).permutation(n_rows)
+    survivors = [list(ParameterGrid(model_spec.get('kwargs', dict()))) for model_spec in models]
+    rounds = 1 + int(np.ceil(np.log(max(len(each) for each in survivors)) / np.log(_HALVING_FACTOR)))
+    levels = 1
+    while n_rows // _HALVING_FACTOR ** levels >= _HALVING_MIN_ROWS:
+        levels += 1
+    rounds = min(rounds, levels)
+    for k in range(rounds):
+        last = k == rounds - 1
+        budget = max(_HALVING_MIN_ROWS, n_rows // _HALVING_FACTOR ** (rounds - 1 - k))
+        rows = None if last or budget >= n_rows else np.sort(order[:budget])
+        active = [i for i in range(len(models)) if last or len(survivors[i]) > 1]
+        tasks = [(models[i]['class'], param, rows) for i in active for param in survivors[i]]
+        if stats is not None:
+            stats['fits'] += len(tasks)
+        results = _split(_run_tasks(cell_fn, tasks, data, n_workers, threads_per_worker),
+                         [len(survivors[i]) for i in active])
+        if last:
+            return list(results)
+        for i, model_results in zip(active, results):
+            scores = np.nan_to_num(np.array([each[metric] for each in model_results], dtype=float), nan=-np.inf)
+            # at most as many survivors as the remaining rounds can reduce to one
+            size = min(int(np.ceil(len(scores) / _HALVING_FACTOR)), _HALVING_FACTOR ** (rounds - 2 - k))
+            keep = np.sort(np.argsort(-scores, kind='stable')[:size])
+            survivors[i] = [survivors[i][j] for j in keep]
+
+
+def _search(cell_fn, models, data, metric, search='grid', n_workers=1, threads_per_worker=0, stats=None):
+    # scored grid cells of every model: the full grid, or the survivors of successive halving
+    if search == 'halving':
+        return _successive_halving(cell_fn, models, data, metric, n_workers, threads_per_worker, stats)
+    elif search == 'grid':
+        tasks, sizes = _grid_tasks(models)
+        if stats is not None:
+            stats['fits'] += len(tasks)
+        return list(_split(_run_tasks(cell_fn, tasks, data, n_workers, threads_per_worker), sizes))
+    else:
+        raise ValueError(f'unknown model search: {search}')
+
+
+@ignore_warnings(category=ConvergenceWarning)
+def _multi_classification_cell(data, num_threads, model_class, param, rows=None):
+    x_train, y_train = _train_rows(data, rows)
+    x_valid, y_valid = data['x_valid'], data['y_valid']
+    x_train, x_valid = _model_inputs(model_class, x_train, x_valid)
+    metadata = data['metadata']
+    unique_labels = np.unique(y_train)
+    model = _make_model(model_class, param, num_threads)
+
+    try:
+        model.fit(x_train, y_train)
+    except:
+        pass
+
+    if len(unique_labels) != len(np.unique(y_valid)):
+        pred = [unique_labels[0]] * x_valid.shape[0]
+        pred_prob = np.array([1.] * x_valid.shape[0])
+    else:
+        pred = model.predict(x_valid)
+        pred_prob = model.predict_proba(x_valid)
+
+    macro_f1 = f1_score(y_valid, pred, average='macro')
+    weighted_f1 = _weighted_f1(y_valid, pred)
+    acc = accuracy_score(y_valid, pred)
+
+    # 3. auroc
+    size = [a["size"] for a in metadata["columns"] if a["name"] == "label"][0]
+    rest_label = set(range(size)) - set(unique_labels)
+    tmp = []
+    j = 0
+    for i in range(size):
+        if i in rest_label:
+            tmp.append(np.array([0] * y_valid.shape[0])[:,np.newaxis])
+        else:
+            try:
+                tmp.append(pred_prob[:,[j]])
+            except:
+                tmp.append(pred_prob[:, np.newaxis].reshape(x_valid.shape[0],1))
+            j += 1
+    try:
+        roc_auc = roc_auc_score(np.eye(size)[y_valid], np.hstack(tmp), multi_class='ovr')
+    except ValueError:
+        roc_auc = None
+    return {
+        "name": model_class.__name__,
+        "param": param,
+        "macro_f1": macro_f1,
+        "weighted_f1": weighted_f1,
+        "roc_auc": roc_auc,
+        "accuracy": acc
+    }
+
+
 @ignore_warnings(category=ConvergenceWarning)
-def _evaluate_multi_classification(train, test, fake, metadata, eval):
+def _multi_classification_replica(data, num_threads, model_class, param, replica):
+    x_train, y_train = data['x_trains'][replica], data['y_trains'][replica]
+    x_test, y_test = data['x_test'], data['y_test']
+    x_train, x_test = _model_inputs(model_class, x_train, x_test)
+    metadata = data['metadata']
+    best_model = _make_model(model_class, param, num_threads)
+    try:
+        best_model.fit(x_train, y_train)
+    except:
+        pass
+
+    unique_labels = np.unique(y_train)
+
+    if len(unique_labels) != len(np.unique(y_test)):
+        pred = [unique_labels[0]] * x_test.shape[0]
+        pred_prob = np.array([1.] * x_test.shape[0])
+    else:
+        pred = best_model.predict(x_test)
+        pred_prob = best_model.predict_proba(x_test)
+
+    macro_f1 = f1_score(y_test, pred, average='macro')
+    weighted_f1 = _weighted_f1(y_test, pred)
+    acc = accuracy_score(y_test, pred)
+
+    # 3. auroc
+    size = [a["size"] for a in metadata["columns"] if a["name"] == "label"][0]
+    rest_label = set(range(size)) - set(unique_labels)
+    tmp = []
+    j = 0
+    for i in range(size):
+        if i in rest_label:
+            tmp.append(np.array([0] * y_test.shape[0])[:,np.newaxis])
+        else:
+            try:
+                tmp.append(pred_prob[:,[j]])
+            except:
+                tmp.append(pred_prob[:, np.newaxis].reshape(x_test.shape[0],1))
+            j += 1
+    roc_auc = roc_auc_score(np.eye(size)[y_test], np.hstack(tmp), multi_class='ovr')
+
+    return {
+        "name": model_class.__name__,
+        "macro_f1": macro_f1,
+        "weighted_f1": weighted_f1,
+        "roc_auc": roc_auc,
+        "accuracy": acc
+    }
+
+
+def _ml_data(x_trains, y_trains, x_valid, y_valid, x_test, y_test, metadata):
+    return {'x_trains': x_trains, 'y_trains': y_trains, 'x_valid': x_valid, 'y_valid': y_valid,
+            'x_test': x_test, 'y_test': y_test, 'metadata': metadata}
+
+
+@ignore_warnings(category=ConvergenceWarning)
+def _evaluate_multi_classification(train, test, fake, metadata, eval, n_workers=1, threads_per_worker=0, search='grid'):
     x_trains, y_trains, x_valid, y_valid, x_test, y_test, classifiers = _prepare_ml_problem(fake, train, test, metadata, eval)
+    data = _ml_data(x_trains, y_trains, x_valid, y_valid, x_test, y_test, metadata)
     best_f1_scores = []
-    unique_labels = np.unique(y_trains[0])
-    
+
     if eval is None:
-        for model_spec in classifiers:
-            model_class = model_spec['class']
-            model_kwargs = model_spec.get('kwargs', dict())
-            model_repr = model_class.__name__
-
-            param_set = list(ParameterGrid(model_kwargs))
-
-            results = []
-            for param in tqdm(param_set):
-                model = model_class(**param)
-
-                try:
-                    model.fit(x_trains[0], y_trains[0])
-                except:
-                    pass 
-                
-                if len(unique_labels) != len(np.unique(y_valid)):
-                    pred = [unique_labels[0]] * len(x_valid)
-                    pred_prob = np.array([1.] * len(x_valid))
-                else:
-                    pred = model.predict(x_valid)
-                    pred_prob = model.predict_proba(x_valid)
-
-                macro_f1 = f1_score(y_valid, pred, average='macro')
-                weighted_f1 = _weighted_f1(y_valid, pred)
-                acc = accuracy_score(y_valid, pred)
-
-                # 3. auroc
-                size = [a["size"] for a in metadata["columns"] if a["name"] == "label"][0]
-                rest_label = set(range(size)) - set(unique_labels)
-                tmp = []
-                j = 0
-                for i in range(size):
-                    if i in rest_label:
-                        tmp.append(np.array([0] * y_valid.shape[0])[:,np.newaxis])
-                    else:
-                        try:
-                            tmp.append(pred_prob[:,[j]])
-                        except:
-                            tmp.append(pred_prob[:, np.newaxis].reshape(x_valid.shape[0],1))
-                        j += 1
-                try:
-                    roc_auc = roc_auc_score(np.eye(size)[y_valid], np.hstack(tmp), multi_class='ovr')
-                except ValueError:
-                    roc_auc = None
-                results.append(
-                    {   
-                        "name": model_repr,
-                        "param": param,
-                        "macro_f1": macro_f1,
-                        "weighted_f1": weighted_f1,
-                        "roc_auc": roc_auc, 
-                        "accuracy": acc
-                    }
-                )
-
-            results = pd.DataFrame(results)   
+        for results in _search(_multi_classification_cell, classifiers, data, 'macro_f1', search, n_workers, threads_per_worker):
+            results = pd.DataFrame(results)
             best_f1_scores.append(results.values[results.macro_f1.idxmax()])
 
     else:
         params = eval
-        i=0
-        for model_spec in classifiers:
-            model_class = model_spec['class']
-            model_kwargs = model_spec.get('kwargs', dict())
-            model_repr = model_class.__name__
-
-            def _calc(best_model):
-                best_scores = []
-                for x_train, y_train in zip(x_trains, y_trains):
-                    try:
-                        best_model.fit(x_train, y_train)
-                    except:
-                        pass 
-
-                    unique_labels = np.unique(y_train)
-
-                    if len(unique_labels) != len(np.unique(y_test)):
-                        pred = [unique_labels[0]] * len(x_test)
-                        pred_prob = np.array([1.] * len(x_test))
-                    else:
-                        pred = best_model.predict(x_test)
-                        pred_prob = best_model.predict_proba(x_test)
-
-                    macro_f1 = f1_score(y_test, pred, average='macro')
-                    weighted_f1 = _weighted_f1(y_test, pred)
-                    acc = accuracy_score(y_test, pred)
-
-                    # 3. auroc
-                    size = [a["size"] for a in metadata["columns"] if a["name"] == "label"][0]
-                    rest_label = set(range(size)) - set(unique_labels)
-                    tmp = []
-                    j = 0
-                    for i in range(size):
-                        if i in rest_label:
-                            tmp.append(np.array([0] * y_test.shape[0])[:,np.newaxis])
-                        else:
-                            try:
-                                tmp.append(pred_prob[:,[j]])
-                            except:
-                                tmp.append(pred_prob[:, np.newaxis].reshape(x_test.shape[0],1))
-                            j += 1
-                    roc_auc = roc_auc_score(np.eye(size)[y_test], np.hstack(tmp), multi_class='ovr')
-                        
-                    best_scores.append(
-                        {   
-                            "name": model_repr,
-                            "macro_f1": macro_f1,
-                            "weighted_f1": weighted_f1,
-                            "roc_auc": roc_auc, 
-                            "accuracy": acc
-                        }
-                    )
-                return pd.DataFrame(best_scores).mean(axis=0)
-
-            def _df(dataframe):
-                return {
-                    "name": model_repr,
-                    "macro_f1": dataframe.macro_f1,
-                    "roc_auc": dataframe.roc_auc,
-                    "weighted_f1": dataframe.weighted_f1,
-                    "accuracy": dataframe.accuracy,
-                }
-
-            best_f1_scores.append(_df(_calc(model_class(**params['param'][i]))))
-            i+=1
+        tasks = [(model_spec['class'], params['param'][i], replica)
+                 for i, model_spec in enumerate(classifiers) for replica in range(len(x_trains))]
+        all_scores = _run_tasks(_multi_classification_replica, tasks, data, n_workers, threads_per_worker)
+        for model_spec, best_scores in zip(classifiers, _split(all_scores, [len(x_trains)] * len(classifiers))):
+            dataframe = pd.DataFrame(best_scores).mean(axis=0)
+            best_f1_scores.append({
+                "name": model_spec['class'].__name__,
+                "macro_f1": dataframe.macro_f1,
+                "roc_auc": dataframe.roc_auc,
+                "weighted_f1": dataframe.weighted_f1,
+                "accuracy": dataframe.accuracy,
+            })
 
     if eval is None:
         return pd.DataFrame(best_f1_scores, columns=['name', 'param', 'macro_f1', 'weighted_f1', 'roc_auc', 'accuracy']), None, None
@@ -382,151 +577,144 @@ def _evaluate_multi_classification(train, test, fake, metadata, eval):
 
 
 @ignore_warnings(category=ConvergenceWarning)
-def _evaluate_binary_classification(train, test, fake, metadata, eval):
+def _binary_classification_cell(data, num_threads, model_class, param, rows=None):
+    x_train, y_train = _train_rows(data, rows)
+    x_valid, y_valid = data['x_valid'], data['y_valid']
+    x_train, x_valid = _model_inputs(model_class, x_train, x_valid)
+    metadata = data['metadata']
+    unique_labels = np.unique(y_train)
+    model = _make_model(model_class, param, num_threads)
+
+    try:
+        model.fit(x_train, y_train)
+    except ValueError:
+        pass
+
+    if len(unique_labels) == 1:
+        pred = [unique_labels[0]] * x_valid.shape[0]
+        pred_prob = np.array([1.] * x_valid.shape[0])
+    else:
+        pred = model.predict(x_valid)
+        pred_prob = model.predict_proba(x_valid)
+
+    binary_f1 = f1_score(y_valid, pred, average='binary')
+    weighted_f1 = _weighted_f1(y_valid, pred)
+    acc = accuracy_score(y_valid, pred)
+    precision = precision_score(y_valid, pred, average='binary')
+    recall = recall_score(y_valid, pred, average='binary')
+    macro_f1 = f1_score(y_valid, pred, average='macro')
+
+    # auroc
+    size = [a["size"] for a in metadata["columns"] if a["name"] == "label"][0]
+    rest_label = set(range(size)) - set(unique_labels)
+    tmp = []
+    j = 0
+    for i in range(size):
+        if i in rest_label:
+            tmp.append(np.array([0] * y_valid.shape[0])[:,np.newaxis])
+        else:
+            try:
+                tmp.append(pred_prob[:,[j]])
+            except:
+                tmp.append(pred_prob[:, np.newaxis].reshape(x_valid.shape[0],1))
+            j += 1
+    roc_auc = roc_auc_score(np.eye(size)[y_valid], np.hstack(tmp))
+
+    return {
+        "name": model_class.__name__,
+        "param": param,
+        "binary_f1": binary_f1,
+        "weighted_f1": weighted_f1,
+        "roc_auc": roc_auc,
+        "accuracy": acc,
+        "precision": precision,
+        "recall": recall,
+        "macro_f1": macro_f1
+    }
+
+
+@ignore_warnings(category=ConvergenceWarning)
+def _binary_classification_replica(data, num_threads, model_class, param, replica):
+    x_train, y_train = data['x_trains'][replica], data['y_trains'][replica]
+    x_test, y_test = data['x_test'], data['y_test']
+    x_train, x_test = _model_inputs(model_class, x_train, x_test)
+    metadata = data['metadata']
+    best_model = _make_model(model_class, param, num_threads)
+    try:
+        best_model.fit(x_train, y_train)
+    except ValueError:
+        pass
+    unique_labels = np.unique(y_train)
+
+    if len(unique_labels) == 1:
+        pred = [unique_labels[0]] * x_test.shape[0]
+        pred_prob = np.array([1.] * x_test.shape[0])
+    else:
+        pred = best_model.predict(x_test)
+        pred_prob = best_model.predict_proba(x_test)
+
+    binary_f1 = f1_score(y_test, pred, average='binary')
+    weighted_f1 = _weighted_f1(y_test, pred)
+    acc = accuracy_score(y_test, pred)
+    precision = precision_score(y_test, pred, average='binary')
+    recall = recall_score(y_test, pred, average='binary')
+    macro_f1 = f1_score(y_test, pred, average='macro')
+
+    # auroc
+    size = [a["size"] for a in metadata["columns"] if a["name"] == "label"][0]
+    rest_label = set(range(size)) - set(unique_labels)
+    tmp = []
+    j = 0
+    for i in range(size):
+        if i in rest_label:
+            tmp.append(np.array([0] * y_test.shape[0])[:,np.newaxis])
+        else:
+            try:
+                tmp.append(pred_prob[:,[j]])
+            except:
+                tmp.append(pred_prob[:, np.newaxis].reshape(x_test.shape[0],1))
+            j += 1
+    try:
+        roc_auc = roc_auc_score(np.eye(size)[y_test], np.hstack(tmp))
+    except ValueError:
+        roc_auc = roc_auc_score(np.eye(size)[y_test], np.hstack(tmp))
+
+    return {
+        "name": model_class.__name__,
+        "binary_f1": binary_f1,
+        "weighted_f1": weighted_f1,
+        "roc_auc": roc_auc,
+        "accuracy": acc,
+        "precision": precision,
+        "recall": recall,
+        "macro_f1": macro_f1
+    }
+
+
+@ignore_warnings(category=ConvergenceWarning)
+def _evaluate_binary_classification(train, test, fake, metadata, eval, n_workers=1, threads_per_worker=0, search='grid'):
     x_trains, y_trains, x_valid, y_valid, x_test, y_test, classifiers = _prepare_ml_problem(fake, train, test, metadata, eval)
+    data = _ml_data(x_trains, y_trains, x_valid, y_valid, x_test, y_test, metadata)
 
     best_f1_scores = []
-    unique_labels = np.unique(y_trains[0])
     if eval is None:
-        for model_spec in classifiers:
-            model_class = model_spec['class']
-            model_kwargs = model_spec.get('kwargs', dict())
-            model_repr = model_class.__name__
-
-
-            param_set = list(ParameterGrid(model_kwargs))
-
-            results = []
-            for param in tqdm(param_set):
-                model = model_class(**param)
-                
-                try:
-                    model.fit(x_trains[0], y_trains[0])
-                except ValueError:
-                    pass
-
-                if len(unique_labels) == 1:
-                    pred = [unique_labels[0]] * len(x_valid)
-                    pred_prob = np.array([1.] * len(x_valid))
-                else:
-                    pred = model.predict(x_valid)
-                    pred_prob = model.predict_proba(x_valid)
-
-                binary_f1 = f1_score(y_valid, pred, average='binary')
-                weighted_f1 = _weighted_f1(y_valid, pred)
-                acc = accuracy_score(y_valid, pred)
-                precision = precision_score(y_valid, pred, average='binary')
-                recall = recall_score(y_valid, pred, average='binary')
-                macro_f1 = f1_score(y_valid, pred, average='macro')
-
-                # auroc
-                size = [a["size"] for a in metadata["columns"] if a["name"] == "label"][0]
-                rest_label = set(range(size)) - set(unique_labels)
-                tmp = []
-                j = 0
-                for i in range(size):
-                    if i in rest_label:
-                        tmp.append(np.array([0] * y_valid.shape[0])[:,np.newaxis])
-                    else:
-                        try:
-                            tmp.append(pred_prob[:,[j]])
-                        except:
-                            tmp.append(pred_prob[:, np.newaxis].reshape(x_valid.shape[0],1))
-                        j += 1
-                roc_auc = roc_auc_score(np.eye(size)[y_valid], np.hstack(tmp))
-
-                results.append(
-                    {   
-                        "name": model_repr,
-                        "param": param,
-                        "binary_f1": binary_f1,
-                        "weighted_f1": weighted_f1,
-                        "roc_auc": roc_auc, 
-                        "accuracy": acc, 
-                        "precision": precision, 
-                        "recall": recall, 
-                        "macro_f1": macro_f1
-                    }
-                )
-
-            results = pd.DataFrame(results)  
+        for results in _search(_binary_classification_cell, classifiers, data, 'binary_f1', search, n_workers, threads_per_worker):
+            results = pd.DataFrame(results)
             best_f1_scores.append(results.values[results.binary_f1.idxmax()])
     else:
         params = eval
-        i=0
-        for model_spec in classifiers:
-            model_class = model_spec['class']
-            model_kwargs = model_spec.get('kwargs', dict())
-            model_repr = model_class.__name__
-
-            def _calc(best_model):
-                best_scores = []
-                for x_train, y_train in zip(x_trains, y_trains):
-                    try:
-                        best_model.fit(x_train, y_train)
-                    except ValueError:
-                        pass
-                    unique_labels = np.unique(y_train)
-
-                    if len(unique_labels) == 1:
-                        pred = [unique_labels[0]] * len(x_test)
-                        pred_prob = np.array([1.] * len(x_test))
-                    else:
-                        pred = best_model.predict(x_test)
-                        pred_prob = best_model.predict_proba(x_test)
-
-                    binary_f1 = f1_score(y_test, pred, average='binary')
-                    weighted_f1 = _weighted_f1(y_test, pred)
-                    acc = accuracy_score(y_test, pred)
-                    precision = precision_score(y_test, pred, average='binary')
-                    recall = recall_score(y_test, pred, average='binary')
-                    macro_f1 = f1_score(y_test, pred, average='macro')
-
-                    # auroc
-                    size = [a["size"] for a in metadata["columns"] if a["name"] == "label"][0]
-                    rest_label = set(range(size)) - set(unique_labels)
-                    tmp = []
-                    j = 0
-                    for i in range(size):
-                        if i in rest_label:
-                            tmp.append(np.array([0] * y_test.shape[0])[:,np.newaxis])
-                        else:
-                            try:
-                                tmp.append(pred_prob[:,[j]])
-                            except:
-                                tmp.append(pred_prob[:, np.newaxis].reshape(x_test.shape[0],1))
-                            j += 1
-                    try:
-                        roc_auc = roc_auc_score(np.eye(size)[y_test], np.hstack(tmp))
-                    except ValueError:
-                        roc_auc = roc_auc_score(np.eye(size)[y_test], np.hstack(tmp))
-
-                    best_scores.append(
-                        {   
-                            "name": model_repr,
-                            # "param": param,
-                            "binary_f1": binary_f1,
-                            "weighted_f1": weighted_f1,
-                            "roc_auc": roc_auc, 
-                            "accuracy": acc, 
-                            "precision": precision, 
-                            "recall": recall, 
-                            "macro_f1": macro_f1
-                        }
-                    )
-                return pd.DataFrame(best_scores).mean(axis=0)
-
-            def _df(dataframe):
-                return {
-                    "name": model_repr,
-                    "binary_f1": dataframe.binary_f1,
-                    "roc_auc": dataframe.roc_auc,
-                    "weighted_f1": dataframe.weighted_f1,
-                    "accuracy": dataframe.accuracy,
-                }
-
-            best_f1_scores.append(_df(_calc(model_class(**params['param'][i]))))
-            i+=1
+        tasks = [(model_spec['class'], params['param'][i], replica)
+                 for i, model_spec in enumerate(classifiers) for replica in range(len(x_trains))]
+        all_scores = _run_tasks(_binary_classification_replica, tasks, data, n_workers, threads_per_worker)
+        for model_spec, best_scores in zip(classifiers, _split(all_scores, [len(x_trains)] * len(classifiers))):
+            dataframe = pd.DataFrame(best_scores).mean(axis=0)
+            best_f1_scores.append({
+                "name": model_spec['class'].__name__,
+                "binary_f1": dataframe.binary_f1,
+                "roc_auc": dataframe.roc_auc,
+                "weighted_f1": dataframe.weighted_f1,
+                "accuracy": dataframe.accuracy,
+            })
 
     if eval is None:
         return pd.DataFrame(best_f1_scores, columns=['name', 'param', 'binary_f1', 'weighted_f1', 'roc_auc', 'accuracy', 'precision', 'recall','macro_f1']), None, None
@@ -535,107 +723,194 @@ def _evaluate_binary_classification(train, test, fake, metadata, eval):
 
 
 @ignore_warnings(category=ConvergenceWarning)
-def _evaluate_regression(train, test, fake, metadata, eval):
+def _regression_cell(data, num_threads, model_class, param, rows=None):
+    x_train, y_train = _train_rows(data, rows)
+    x_valid, y_valid = data['x_valid'], data['y_valid']
+    x_train, x_valid = _model_inputs(model_class, x_train, x_valid)
+    model = _make_model(model_class, param, num_threads)
+    model.fit(x_train, y_train)
+    pred = model.predict(x_valid)
+
+    r2 = r2_score(y_valid, pred)
+    explained_variance = explained_variance_score(y_valid, pred)
+    mean_squared = mean_squared_error(y_valid, pred)
+    root_mean_squared = mean_squared_error(y_valid, pred, squared=False)
+    mean_absolute = mean_absolute_error(y_valid, pred)
+
+    return {
+        "name": model_class.__name__,
+        "param": param,
+        "r2": r2,
+        "explained_variance": explained_variance,
+        "mean_squared": mean_squared,
+        "mean_absolute": mean_absolute,
+        "rmse": root_mean_squared
+    }
+
+
+@ignore_warnings(category=ConvergenceWarning)
+def _regression_replica(data, num_threads, model_class, param, replica):
+    x_train, y_train, x_test, y_test = data['x_trains'][replica], data['y_trains'][replica], data['x_test'], data['y_test']
+    x_train, x_test = _model_inputs(model_class, x_train, x_test)
+    best_model = _make_model(model_class, param, num_threads)
+    best_model.fit(x_train, y_train)
+    pred = best_model.predict(x_test)
+
+    r2 = r2_score(y_test, pred)
+    explained_variance = explained_variance_score(y_test, pred)
+    mean_squared = mean_squared_error(y_test, pred)
+    root_mean_squared = mean_squared_error(y_test, pred, squared=False)
+    mean_absolute = mean_absolute_error(y_test, pred)
+
+    return {
+        "name": model_class.__name__,
+        "r2": r2,
+        "explained_variance": explained_variance,
+        "mean_squared": mean_squared,
+        "mean_absolute": mean_absolute,
+        "rmse": root_mean_squared
+    }
+
+
+def _prepare_targets(y_trains, y_valid, y_test, metadata):
+    # regression models are fitted and scored on log(y), with y clipped at 1
+    if metadata['problem_type'] != 'regression':
+        return y_trains, y_valid, y_test
+    y_trains = [np.log(np.clip(i, 1, None)) for i in y_trains]
+    y_valid = np.log(np.clip(y_valid, 1, None))
+    if y_test is not None:
+        y_test = np.log(np.clip(y_test, 1, None))
+    return y_trains, y_valid, y_test
+
+
+@ignore_warnings(category=ConvergenceWarning)
+def _evaluate_regression(train, test, fake, metadata, eval, n_workers=1, threads_per_worker=0, search='grid'):
     
     x_trains, y_trains, x_valid, y_valid, x_test, y_test, regressors = _prepare_ml_problem(fake, train, test, metadata, eval)
 
     best_r2_scores = []
 
-
-    y_trains = [np.log(np.clip(i, 1, None)) for i in y_trains]
-    y_valid = np.log(np.clip(y_valid, 1, None))
+    y_trains, y_valid, y_test = _prepare_targets(y_trains, y_valid, y_test, metadata)
 
     if eval is None:
-        for model_spec in regressors:
-            model_class = model_spec['class']
-            model_kwargs = model_spec.get('kwargs', dict())
-            model_repr = model_class.__name__
-
-            param_set = list(ParameterGrid(model_kwargs))
-
-            results = []
-            for param in tqdm(param_set):
-                model = model_class(**param)
-                model.fit(x_trains[0], y_trains[0])
-                pred = model.predict(x_valid)
-
-                r2 = r2_score(y_valid, pred)
-                explained_variance = explained_variance_score(y_valid, pred)
-                mean_squared = mean_squared_error(y_valid, pred)
-                root_mean_squared = mean_squared_error(y_valid, pred, squared=False)
-                mean_absolute = mean_absolute_error(y_valid, pred)
-
-                results.append(
-                    {   
-                        "name": model_repr,
-                        "param": param,
-                        "r2": r2,
-                        "explained_variance": explained_variance,
-                        "mean_squared": mean_squared, 
-                        "mean_absolute": mean_absolute, 
-                        "rmse": root_mean_squared
-                    }
-                )
-
+        data = _ml_data(x_trains, y_trains, x_valid, y_valid, x_test, y_test, metadata)
+        for results in _search(_regression_cell, regressors, data, 'r2', search, n_workers, threads_per_worker):
             results = pd.DataFrame(results)
-
-            
             best_r2_scores.append(results.values[results.r2.idxmax()])
 
     else:
-        y_test = np.log(np.clip(y_test, 1, None))
+        data = _ml_data(x_trains, y_trains, x_valid, y_valid, x_test, y_test, metadata)
         params = eval
-        i=0
-        for model_spec in regressors:
-            model_class = model_spec['class']
-            model_kwargs = model_spec.get('kwargs', dict())
-            model_repr = model_class.__name__
-
-            def _calc(best_model):
-                best_scores = []
-                for x_train, y_train in zip(x_trains, y_trains):
-
-                    best_model.fit(x_train, y_train)
-                    pred = best_model.predict(x_test)
-
-                    r2 = r2_score(y_test, pred)
-                    explained_variance = explained_variance_score(y_test, pred)
-                    mean_squared = mean_squared_error(y_test, pred)
-                    root_mean_squared = mean_squared_error(y_test, pred, squared=False)
-                    mean_absolute = mean_absolute_error(y_test, pred)
-
-                    best_scores.append(
-                        {   
-                            "name": model_repr,
-                            "r2": r2,
-                            "explained_variance": explained_variance,
-                            "mean_squared": mean_squared, 
-                            "mean_absolute": mean_absolute, 
-                            "rmse": root_mean_squared
-                        }
-                    )
-
-                return pd.DataFrame(best_scores).mean(axis=0)
-
-            def _df(dataframe):
-                return {
-                    "name": model_repr,
-                    "r2": dataframe.r2,
-                    "explained_variance": dataframe.explained_variance,
-                    "MAE": dataframe.mean_absolute,
-                    "RMSE": dataframe.rmse,
-                }
-
-            best_r2_scores.append(_df(_calc(model_class(**params['param'][i]))))
-            i+=1
+        tasks = [(model_spec['class'], params['param'][i], replica)
+                 for i, model_spec in enumerate(regressors) for replica in range(len(x_trains))]
+        all_scores = _run_tasks(_regression_replica, tasks, data, n_workers, threads_per_worker)
+        for model_spec, best_scores in zip(regressors, _split(all_scores, [len(x_trains)] * len(regressors))):
+            dataframe = pd.DataFrame(best_scores).mean(axis=0)
+            best_r2_scores.append({
+                "name": model_spec['class'].__name__,
+                "r2": dataframe.r2,
+                "explained_variance": dataframe.explained_variance,
+                "MAE": dataframe.mean_absolute,
+                "RMSE": dataframe.rmse,
+            })
 
     if eval is None:
         return pd.DataFrame(best_r2_scores, columns=['name', 'param', 'r2', 'explained_variance', 'mean_squared', 'mean_absolute', 'rmse']), None, None
     else:     
         return pd.DataFrame(best_r2_scores), None, None 
 
+def _prdc_block_rows(n_cols):
+    # rows per distance block so that one block of float64 distances takes about _PRDC_BLOCK_MB
+    return max(1, int(_PRDC_BLOCK_MB * 2 ** 20 // (8 * max(n_cols, 1))))
+
+
+def _map_blocks(fn, num_rows, block_rows, n_jobs):
+    """fn(start, end) over consecutive row blocks, yielded in block order.
+
+    Blocks run on n_jobs threads (all cores if -1; BLAS releases the GIL), with at most n_jobs blocks in
+    flight so that memory stays bounded.
+    """
+    starts = range(0, num_rows, block_rows)
+    n_jobs = n_jobs if n_jobs > 0 else os.cpu_count()
+    if n_jobs == 1:
+        for st in starts:
+            yield fn(st, min(st + block_rows, num_rows))
+        return
+    with ThreadPoolExecutor(max_workers=n_jobs) as executor:
+        pending = deque()
+        for st in starts:
+            pending.append(executor.submit(fn, st, min(st + block_rows, num_rows)))
+            if len(pending) >= n_jobs:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+
+def _knn_radii(features, nearest_k, algorithm, n_jobs):
+    # distance of every row to its nearest_k-th neighbour, the row itself included as in compute_prdc
+    if algorithm != 'brute':
+        nn = NearestNeighbors(n_neighbors=nearest_k + 1, algorithm=algorithm, n_jobs=n_jobs).fit(features)
+        return nn.kneighbors(features)[0][:, -1]
+
+    def block(st, end):
+        distances = pairwise_distances(features[st:end], features, metric='euclidean')
+        # copy, a view would keep the whole block of distances alive
+        return np.partition(distances, nearest_k, axis=1)[:, nearest_k].copy()
+
+    return np.concatenate(list(_map_blocks(block, features.shape[0], _prdc_block_rows(features.shape[0]), n_jobs)))
+
+
+def _within_radii(queries, features, radii, algorithm, n_jobs):
+    """For every query row: whether some row of `features` is closer than its own radius, and how many are."""
+    nn = NearestNeighbors(algorithm=algorithm, n_jobs=n_jobs).fit(features)
+    counts = []
+    for st in range(0, queries.shape[0], _PRDC_QUERY_ROWS):
+        distances, indices = nn.radius_neighbors(queries[st:st + _PRDC_QUERY_ROWS], radius=radii.max())
+        counts.extend((dist < radii[ind]).sum() for dist, ind in zip(distances, indices))
+    counts = np.array(counts)
+    return counts > 0, counts
+
+
+def compute_prdc_blocked(real_features, fake_features, nearest_k, algorithm='brute', n_jobs=-1):
+    """Precision, recall, density and coverage as prdc.compute_prdc, without full pairwise distance matrices.
+
+    With algorithm='brute' the real-fake distances are computed in blocks of real rows of about
+    _PRDC_BLOCK_MB each, spread over n_jobs threads (all cores if -1). 'kd_tree' and 'ball_tree' use
+    sklearn's NearestNeighbors instead, which is faster for low-dimensional features.
+    """
+    real_radii = _knn_radii(real_features, nearest_k, algorithm, n_jobs)
+    fake_radii = _knn_radii(fake_features, nearest_k, algorithm, n_jobs)
+
+    if algorithm == 'brute':
+        def block(st, end):
+            distances = pairwise_distances(real_features[st:end], fake_features, metric='euclidean')
+            inside = distances < real_radii[st:end, None]
+            return (inside.any(axis=0), inside.sum(axis=0), (distances < fake_radii[None, :]).any(axis=1),
+                    distances.min(axis=1) < real_radii[st:end])
+
+        fake_inside = np.zeros(fake_features.shape[0], dtype=bool)
+        fake_counts = np.zeros(fake_features.shape[0], dtype=np.int64)
+        real_recalled, real_covered = [], []
+        for inside, counts, recalled, covered in _map_blocks(block, real_features.shape[0],
+                                                            _prdc_block_rows(fake_features.shape[0]), n_jobs):
+            fake_inside |= inside
+            fake_counts += counts
+            real_recalled.append(recalled)
+            real_covered.append(covered)
+        real_recalled = np.concatenate(real_recalled)
+        real_covered = np.concatenate(real_covered)
+    else:
+        fake_inside, fake_counts = _within_radii(fake_features, real_features, real_radii, algorithm, n_jobs)
+        real_recalled, _ = _within_radii(real_features, fake_features, fake_radii, algorithm, n_jobs)
+        nn = NearestNeighbors(n_neighbors=1, algorithm=algorithm, n_jobs=n_jobs).fit(fake_features)
+        real_covered = nn.kneighbors(real_features)[0][:, 0] < real_radii
+
+    return dict(precision=fake_inside.mean(), recall=real_recalled.mean(),
+                density=(1. / float(nearest_k)) * fake_counts.mean(), coverage=real_covered.mean())
+
+
 @ignore_warnings(category=ConvergenceWarning)
-def compute_diversity(train, fake):
+def compute_diversity(train, fake, algorithm='brute', n_jobs=-1):
     nearest_k = 5
     if train.shape[0] >= 50000:
         num = np.random.randint(0, train.shape[0], 50000)
@@ -648,9 +923,9 @@ def compute_diversity(train, fake):
     scores = []
     for i, data in enumerate(fake_features_lst):
         fake_features = data
-        metrics = compute_prdc(real_features=real_features,
-                        fake_features=fake_features,
-                        nearest_k=nearest_k)
+        metrics = compute_prdc_blocked(real_features=real_features,
+                                       fake_features=fake_features,
+                                       nearest_k=nearest_k, algorithm=algorithm, n_jobs=n_jobs)
         metrics['i'] = i
         scores.append(metrics)
     return pd.DataFrame(scores).mean(axis=0), pd.DataFrame(scores).std(axis=0)
@@ -661,10 +936,43 @@ _EVALUATORS = {
     'regression': _evaluate_regression
 }
 
-def compute_scores(train, test, synthesized_data, metadata, eval):
-    a, b, c = _EVALUATORS[metadata['problem_type']](train=train, test=test, fake=synthesized_data, metadata=metadata, eval=eval)
+# grid cell and selection metric of every problem type
+_SEARCH_CELLS = {
+    'binary_classification': (_binary_classification_cell, 'binary_f1'),
+    'multiclass_classification': (_multi_classification_cell, 'macro_f1'),
+    'regression': (_regression_cell, 'r2'),
+}
+
+def compute_scores(train, test, synthesized_data, metadata, eval, n_workers=1, threads_per_worker=0, search='grid'):
+    a, b, c = _EVALUATORS[metadata['problem_type']](train=train, test=test, fake=synthesized_data, metadata=metadata, eval=eval,
+                                                    n_workers=n_workers, threads_per_worker=threads_per_worker,
+                                                    search=search)
     if eval is None:
         return a.mean(axis=0), a.std(axis=0), a[['name','param']]
     else:
         return a.mean(axis=0), a.std(axis=0)
 
+
+
+def compare_search(train, synthesized_data, metadata, n_workers=1, threads_per_worker=0):
+    """Model selection with the full grid vs successive halving on the same data.
+
+    Returns one row per model and search with the selected parameters, their validation score, the number
+    of fits and the wall time of the whole search, to check that halving picks (nearly) the same models.
+    """
+    x_trains, y_trains, x_valid, y_valid, _, _, models = _prepare_ml_problem(synthesized_data, train, None, metadata, None)
+    y_trains, y_valid, _ = _prepare_targets(y_trains, y_valid, None, metadata)
+    data = _ml_data(x_trains, y_trains, x_valid, y_valid, None, None, metadata)
+    cell_fn, metric = _SEARCH_CELLS[metadata['problem_type']]
+    rows = []
+    for search in ('grid', 'halving'):
+        stats = {'fits': 0}
+        st = time.time()
+        all_results = _search(cell_fn, models, data, metric, search, n_workers, threads_per_worker, stats)
+        elapsed = time.time() - st
+        for results in all_results:
+            results = pd.DataFrame(results)
+            best = results.loc[results[metric].idxmax()]
+            rows.append({'search': search, 'name': best['name'], 'param': best['param'], metric: best[metric],
+                         'fits': stats['fits'], 'seconds': elapsed})
+    return pd.DataFrame(rows)
@@ -0,0 +1,195 @@
+"""Library API of a trained model: load once, then sample events and complete traces as pandas frames.
+
+    from event_log_generator import EventLogGenerator
+    generator = EventLogGenerator.load('codi_exp')
+    events = generator.predict(['Validar solicitud'], [['Radicar Solicitud Homologacion']], [['Lina']])
+    log = generator.complete(pd.read_csv('gen_seq_consulta.csv'), batch_size=256)
+    async for event in generator.stream(traces, batch_size=256):
+        ...
+
+Nothing is written to disk. Results are drawn from torch's and numpy's global random state; seed them (or pass
+`seed`) for reproducible output.
+"""
+import asyncio
+import os
+import threading
+import numpy as np
+import pandas as pd
+import torch
+from generation import Generator, MARKERS, RESOURCE
+
+COLUMNS = ['activity', 'res', 'wait', 'process']
+
+
+class EventLogGenerator:
+    """The samplers of a checkpoint or inference bundle, reusable across calls."""
+
+    def __init__(self, generator):
+        self.generator = generator
+        self.resource_codes = {name: code for code, name in enumerate(generator.resources)}
+
+    @classmethod
+    def load(cls, path, device='cpu', runtime='eager', export_dir=None):
+        """Loads a model directory (generator.safetensors if present, else ckpt.pt) or a bundle/checkpoint file.
+
+        `runtime` 'torchscript' or 'onnx' runs the chains on the reverse step exported by denoiser_export.py, found
+        in `export_dir` (<logdir>/export by default).
+        """
+        logdir = path
+        if os.path.isdir(path):
+            path = os.path.join(logdir, 'generator.safetensors')
+            if not os.path.exists(path):
+                path = os.path.join(logdir, 'ckpt.pt')
+        else:
+            logdir = os.path.dirname(path)
+        generator = Generator.load(path, torch.device(device))
+        if runtime != 'eager':
+            generator.use_exported(export_dir or os.path.join(logdir, 'export'), runtime)
+        return cls(generator)
+
+    @property
+    def activities(self):
+        return [name for name in self.generator.act_codes if self.generator.act_codes[name] in
+                self.generator.act_onehot_index]
+
+    @property
+    def resources(self):
+        return list(self.generator.resources)
+
+    def _frame(self, activities, rows):
+        return pd.DataFrame({'activity': list(activities),
+                             'res': [self.generator.resources[int(row[RESOURCE])] for row in rows],
+                             'wait': np.round(np.exp(rows[:, 2]) - 1).astype(np.int64),
+                             'process': np.round(np.exp(rows[:, 3]) - 1).astype(np.int64)}, columns=COLUMNS)
+
+    def predict(self, activities, prev_activities=None, prev_resources=None, chunk_size=1024, seed=None):
+        """Resource and times of the next event of every case, one row per activity name.
+
+        `prev_activities` / `prev_resources` are the names of the events of each case so far (empty by default).
+        """
+        if seed is not None:
+            torch.manual_seed(seed)
+            np.random.seed(seed)
+        acts = [self.generator.activity_code(name) for name in activities]
+        prev_acts = [[self.generator.activity_code(name) for name in each] for each in
+                     (prev_activities or [[] for _ in acts])]
+        prev_res = [[self._resource_code(name) for name in each] for each in (prev_resources or [[] for _ in acts])]
+        if not len(prev_acts) == len(prev_res) == len(acts):
+            raise ValueError('activities, prev_activities and prev_resources must have one entry per case')
+        if not acts:
+            return pd.DataFrame(columns=COLUMNS)
+        rows = np.concatenate([self.generator.sample_events(acts[start:start + chunk_size],
+                                                            prev_acts[start:start + chunk_size],
+                                                            prev_res[start:start + chunk_size])
+                               for start in range(0, len(acts), chunk_size)])
+        return self._frame(activities, rows)
+
+    def sample(self, n, chunk_size=1024, activities=None, seed=None):
+        """`n` first events of cases, for the given activity names (cycled) or activities drawn uniformly."""
+        if seed is not None:
+            torch.manual_seed(seed)
+            np.random.seed(seed)
+        names = list(activities) if activities is not None else self.activities
+        if activities is None:
+            names = [names[k] for k in np.random.randint(0, len(names), n)]
+        else:
+            names = [names[k % len(names)] for k in range(n)]
+        return self.predict(names, chunk_size=chunk_size)
+
+    def complete(self, traces, batch_size=256, act_column='act', seed=None):
+        """Completes a frame of activity sequences (cases framed by Start/End rows, as `generate.py` reads).
+
+        Returns a copy with the activity codes in `act`, the names in `activity` and the sampled `res`, `wait`
+        and `process` columns (seconds). Up to `batch_size` cases are sampled together, the k-th events of all of
+        them in one chain; with 1 every event is its own chain, as in `main.py --eval`.
+        """
+        if seed is not None:
+            torch.manual_seed(seed)
+            np.random.seed(seed)
+        completed = list(self.generator.complete(traces[act_column], batch_size))
+        frame = traces.copy()
+        frame['activity'] = traces[act_column]
+        for k, column in enumerate([act_column, 'res', 'wait', 'process']):
+            frame[column] = [each[k] for each in completed]
+        return frame
+
+    async def stream(self, traces, batch_size=256, unit='event', max_pending=1024, act_column='act',
+                     case_column='caseid'):
+        """Async iterator of the completed events (or cases) of a frame of activity sequences, as they are sampled.
+
+        Sampling runs in a worker thread, `batch_size` cases at a time. The events of a wave are yielded as soon
+        as its chain ran, so the first ones arrive after one wave instead of the whole job. Events are dicts
+        with `caseid`, `position` (in the case), `activity`, `res`, `wait` and `process`; with `unit` 'case' a
+        dict with `caseid` and its `events` is yielded once the last event of a case is done. At most
+        `max_pending` items wait for the consumer before sampling pauses.
+        """
+        if unit not in ('event', 'case'):
+            raise ValueError(f"unknown unit {unit!r}, expected 'event' or 'case'")
+        loop = asyncio.get_running_loop()
+        queue = asyncio.Queue(max_pending)
+        stop = threading.Event()
+        done = object()
+
+        def produce():
+            try:
+                for item in self._completed(traces, batch_size, unit, act_column, case_column):
+                    if stop.is_set():
+                        return
+                    # blocks while the queue is full: the consumer sets the pace
+                    asyncio.run_coroutine_threadsafe(queue.put(item), loop).result()
+                item = done
+            except Exception as e:
+                item = e
+            if not stop.is_set():
+                asyncio.run_coroutine_threadsafe(queue.put(item), loop).result()
+
+        producer = loop.run_in_executor(None, produce)
+        try:
+            while True:
+                item = await queue.get()
+                if item is done:
+                    break
+                if isinstance(item, Exception):
+                    raise item
+                yield item
+        finally:
+            stop.set()
+            # unblocks a pending put of the producer until it sees the stop
+            while not producer.done():
+                while not queue.empty():
+                    queue.get_nowait()
+                await asyncio.sleep(0.001)
+
+    def _completed(self, traces, batch_size, unit, act_column, case_column):
+        # (case id, activity codes, activity names) of every case between the Start/End markers
+        cases, case = [], None
+        ids = traces[case_column] if case_column in traces else range(len(traces))
+        for caseid, name in zip(ids, traces[act_column]):
+            if name in MARKERS:
+                case = None
+                continue
+            if case is None:
+                case = (caseid, [], [])
+                cases.append(case)
+            case[1].append(self.generator.activity_code(name))
+            case[2].append(name)
+        for start in range(0, len(cases), batch_size):
+            batch = cases[start:start + batch_size]
+            events = [[] for _ in batch]
+            for c, k, (_, res, wait, process) in self.generator.waves([codes for _, codes, _ in batch]):
+                caseid, codes, names = batch[c]
+                event = {'caseid': caseid, 'position': k, 'activity': names[k], 'res': res, 'wait': wait,
+                         'process': process}
+                if unit == 'event':
+                    yield event
+                    continue
+                events[c].append(event)
+                if k == len(codes) - 1:
+                    yield {'caseid': caseid, 'events': events[c]}
+
+    def _resource_code(self, name):
+        try:
+            return self.resource_codes[name]
+        except KeyError:
+            raise ValueError(f'resource {name!r} is not in the vocabulary of the checkpoint') from None
+
@@ -0,0 +1,92 @@
+"""Completes activity sequences with resources and times from a trained checkpoint.
+
+The lean counterpart of `main.py --eval`: it reads a CSV with `caseid` and `act` columns (cases framed by
+Start/End rows) and writes it back with the activity codes in `act` and the original names in `activity`, plus
+the sampled `res`, `wait` and `process` columns. Only torch and numpy are imported.
+
+    python generate.py --logdir codi_exp --input tabular_datasets/gen_seq_consulta.csv
+"""
+import argparse
+import csv
+import os
+import time
+from datetime import datetime
+from types import SimpleNamespace
+import numpy as np
+import torch
+import telemetry
+from generation import Generator
+
+
+def read_input(path):
+    """Rows (dicts) of an input CSV and the fields of the completed CSV."""
+    with open(path, newline='') as f:
+        reader = csv.DictReader(f)
+        fields = list(reader.fieldnames)
+        rows = list(reader)
+    return rows, fields + [each for each in ('activity', 'res', 'wait', 'process') if each not in fields]
+
+
+def write_completed(generator, rows, fields, output, batch_size=1):
+    """Writes the input rows completed by `generator` to the CSV `output`, returns the numbers of cases and events."""
+    num_cases = num_events = 0
+    with open(output, 'w', newline='') as f:
+        writer = csv.DictWriter(f, fields, lineterminator='\n')
+        writer.writeheader()
+        completed = generator.complete((row['act'] for row in rows), batch_size)
+        for row, (act, res, wait, process) in zip(rows, completed):
+            num_cases += act == 'Start'
+            num_events += act not in ('Start', 'End')
+            writer.writerow(dict(row, activity=row['act'], act=act, res=res, wait=wait, process=process))
+    return num_cases, num_events
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Completes activity sequences from a trained checkpoint.')
+    parser.add_argument('--logdir', default='./codi_exp', help='directory of the model and the outputs')
+    parser.add_argument('--model', default=None,
+                        help='inference bundle or checkpoint, generator.safetensors in logdir if present else ckpt.pt')
+    parser.add_argument('--input', required=True, help='CSV of the activity sequences')
+    parser.add_argument('--output', default=None, help='output CSV, gen_sample_<time>.csv in logdir by default')
+    parser.add_argument('--runtime', choices=['eager', 'torchscript', 'onnx'], default='eager',
+                        help='runs the sampling chains on the models or on the reverse step of denoiser_export.py')
+    parser.add_argument('--export_dir', default=None, help='directory of the exported reverse step, <logdir>/export')
+    parser.add_argument('--batch_size', type=int, default=1,
+                        help='cases completed together, the k-th events of all of them in one chain; 1 as main.py --eval')
+    parser.add_argument('--seed', type=int, default=2022)
+    parser.add_argument('--device', default='cuda:0' if torch.cuda.is_available() else 'cpu')
+    parser.add_argument('--threads', type=int, default=0, help='torch threads, 0 for default')
+    parser.add_argument('--concurrent_denoisers', action='store_true',
+                        help='run the continuous denoiser of a reverse step in a thread next to the discrete ones')
+    parser.add_argument('--telemetry', type=int, default=1, help='append counters to telemetry.jsonl in logdir')
+    args = parser.parse_args()
+
+    if args.threads > 0:
+        torch.set_num_threads(args.threads)
+    torch.manual_seed(args.seed)
+    np.random.seed(args.seed)
+    telemetry.start(SimpleNamespace(logdir=args.logdir, telemetry=args.telemetry, telemetry_prometheus='',
+                                    distributed=False, eval=True, data=args.input))
+    start = time.perf_counter()
+    model = args.model or os.path.join(args.logdir, 'generator.safetensors')
+    if not args.model and not os.path.exists(model):
+        model = os.path.join(args.logdir, 'ckpt.pt')
+    generator = Generator.load(model, torch.device(args.device))
+    generator.flags.concurrent_denoisers = args.concurrent_denoisers
+    if args.runtime != 'eager':
+        generator.use_exported(args.export_dir or os.path.join(args.logdir, 'export'), args.runtime)
+    telemetry.emit('load_checkpoint', seconds=time.perf_counter() - start)
+
+    output = args.output or os.path.join(args.logdir, f'gen_sample_{datetime.now().strftime("%Y%m%d_%H%M%S")}.csv')
+    rows, fields = read_input(args.input)
+    start = time.perf_counter()
+    num_cases, num_events = write_completed(generator, rows, fields, output, args.batch_size)
+    seconds = time.perf_counter() - start
+    telemetry.emit('generation', cases=num_cases, events=num_events, seconds=seconds,
+                   ms_per_case=1000 * seconds / max(num_cases, 1), events_per_s=num_events / max(seconds, 1e-9))
+    telemetry.close()
+    print(f'{num_events} events of {num_cases} cases written to {output}')
+
+
+if __name__ == '__main__':
+    main()
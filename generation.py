@@ -0,0 +1,215 @@
+"""Trace completion from a trained checkpoint without the training stack.
+
+Training stores everything generation needs in the `generation` entry of ckpt.pt: the model sizes, the fitted
+column transformers, the activity and resource vocabularies and the attention embeddings. `Generator` rebuilds
+the samplers from it with torch and numpy only (no pandas, pm4py, sklearn or absl) and never touches the
+training log, so a generation job starts in about a second.
+"""
+import math
+import os
+from types import SimpleNamespace
+import numpy as np
+import torch
+from attention_batch import AttentionBatch
+from bundle import Bundle, sampler_models
+from model_builder import model_config, build_models, attention_embeddings, load_attention_embeddings
+from tabular_transformer import GeneralTransformer
+from utils import decode_samples, log_sample_categorical, sampling_with
+
+MARKERS = ('Start', 'End')
+# previous events of the case the attention block sees
+HISTORY = 30
+# columns of a decoded row: activity, resource, waiting and processing time
+RESOURCE, WAIT, PROCESS = 1, 2, 3
+
+
+def generation_state(FLAGS, num_rows, transformer_con, transformer_dis, con_idx, dis_idx, meta, model_cont,
+                     model_dis_list):
+    """The `generation` checkpoint entry of a training run."""
+    embeddings = {'model_con': attention_embeddings(model_cont)}
+    for i, model in enumerate(model_dis_list):
+        embeddings[f'model_dis_{i}'] = attention_embeddings(model)
+    return {'config': model_config(FLAGS, num_rows),
+            'transformer_con': transformer_con.state(), 'transformer_dis': transformer_dis.state(),
+            'con_idx': [int(each) for each in con_idx], 'dis_idx': [int(each) for each in dis_idx],
+            'activities': [str(each) for each in meta['columns'][0]['i2s']],
+            'resources': [str(each) for each in meta['attention'][1]['i2s']],
+            'attention_embeddings': embeddings}
+
+
+def activity_key(name):
+    # activity names are stored with their whitespace runs replaced by '_'
+    return '_'.join(name.split())
+
+
+class Generator:
+    """The samplers of a checkpoint, completing activity sequences with resources and times.
+
+    Only the trace-completion setup of `main.py --eval` is supported: the activity column is the still
+    condition and the resource, waiting and processing times are sampled for every event.
+    """
+
+    def __init__(self, state, state_dict, device=torch.device('cpu')):
+        # state: the generation entry of a checkpoint, state_dict(name): weights of model 'model_con' / 'model_dis_<i>'
+        config = state['config']
+        if config['still_condition'] != [0]:
+            raise ValueError(f"generation needs still_condition [0], got {config['still_condition']}")
+        model_cont, _, self.net_sampler, model_dis_list, self.trainer_dis_list = build_models(config, device)
+        models = {'model_con': model_cont}
+        models.update((f'model_dis_{i}', model) for i, model in enumerate(model_dis_list))
+        # the models of still-condition columns never run, their weights are not loaded
+        for name in sampler_models(config):
+            models[name].load_state_dict(state_dict(name))
+            load_attention_embeddings(models[name], state['attention_embeddings'][name])
+        for model in models.values():
+            model.eval()
+
+        self.device = device
+        self.transformer_con = GeneralTransformer.from_state(state['transformer_con'])
+        self.transformer_dis = GeneralTransformer.from_state(state['transformer_dis'])
+        self.con_idx, self.dis_idx = state['con_idx'], state['dis_idx']
+        self.num_class = [each[0] for each in self.transformer_dis.output_info]
+        self.cont_dim = config['cont_input_size']
+        self.flags = SimpleNamespace(T=config['T'], still_condition=config['still_condition'], concurrent_denoisers=False)
+        self.act_codes = {name: code for code, name in enumerate(state['activities'])}
+        self.resources = state['resources']
+        self.act_pad = config['src_vocab_size_list'][0] - 1
+        self.res_pad = config['src_vocab_size_list'][1] - 1
+        # position of every activity code in the one-hot encoding of the condition column
+        self.act_onehot_index = {value: k for k, value in enumerate(self.transformer_dis.meta[0]['i2s'])}
+        # exported reverse step running the chains instead of the eager models, see use_exported
+        self.traced = None
+
+    @classmethod
+    def load(cls, path, device=torch.device('cpu')):
+        """Generator of an inference bundle (`.safetensors`, see bundle.py) or of a training ckpt.pt."""
+        if os.path.splitext(path)[1] == '.safetensors':
+            bundle = Bundle(path)
+            return cls(bundle.generation_state(), bundle.state_dict, device)
+        ckpt = torch.load(path, map_location=torch.device('cpu'))
+        if 'generation' not in ckpt:
+            raise ValueError(f'{path} has no generation entry, it was written by an older training run')
+        return cls(ckpt['generation'], ckpt.__getitem__, device)
+
+    def use_exported(self, export_dir, backend='torchscript'):
+        """Runs the sampling chains on the reverse step exported by denoiser_export.py (TorchScript or ONNX)."""
+        from denoiser_export import TracedSampler
+        self.traced = TracedSampler(export_dir, backend, self.device)
+
+    def share_memory(self):
+        """Moves the weights to shared memory, so worker processes use them without a copy of their own."""
+        self.net_sampler.share_memory()
+        for trainer in self.trainer_dis_list:
+            trainer.share_memory()
+        # the attention token embeddings sit outside the module tree
+        for model in [self.net_sampler.model] + [each._denoise_fn for each in self.trainer_dis_list]:
+            for each in model.attention.src_token_embedding_list:
+                each.share_memory()
+        return self
+
+    def activity_code(self, name):
+        try:
+            return self.act_codes[activity_key(name)]
+        except KeyError:
+            raise ValueError(f'activity {name!r} is not in the vocabulary of the checkpoint') from None
+
+    def sample_events(self, acts, prev_acts, prev_res):
+        """Decoded rows (activity, resource, wait, process) of activity codes `acts`, each after its case history.
+
+        The events are sampled in one chain; histories of different lengths are right-padded as in training.
+        """
+        num_rows = len(acts)
+        prev_acts = [list(each[-HISTORY:]) for each in prev_acts]
+        prev_res = [list(each[-HISTORY:]) for each in prev_res]
+        length = max(max(map(len, prev_acts)), 1)
+        acts_prev = [each + [self.act_pad] * (length - len(each)) for each in prev_acts]
+        res_prev = [each + [self.res_pad] * (length - len(each)) for each in prev_res]
+        padding = [[k >= len(each) for k in range(length)] for each in prev_acts]
+        attention = AttentionBatch.from_rows(acts_prev, res_prev, padding, padding, [[act] for act in acts],
+                                             device=self.device)
+        condition = np.zeros((num_rows, self.num_class[0]))
+        condition[np.arange(num_rows), [self.act_onehot_index[act] for act in acts]] = 1
+        with torch.no_grad():
+            x_T_cont = torch.randn(num_rows, self.cont_dim).to(self.device)
+            log_x_T_dis = [log_sample_categorical(torch.zeros((num_rows, each), device=self.device), each)
+                           .to(self.device) for each in self.num_class]
+            if self.traced is not None:
+                x_cont, x_dis = self.traced(x_T_cont, log_x_T_dis, attention, [condition])
+            else:
+                x_cont, x_dis = sampling_with(x_T_cont, log_x_T_dis, attention, self.net_sampler,
+                                              self.trainer_dis_list, self.transformer_con, self.flags, [condition])
+        return decode_samples(x_cont, x_dis, self.transformer_con, self.transformer_dis, self.con_idx, self.dis_idx)
+
+    def sample_event(self, act, prev_acts, prev_res):
+        """Decoded row (activity, resource, wait, process) of activity code `act` after the case history."""
+        return self.sample_events([act], [prev_acts], [prev_res])[0]
+
+    def event(self, act, row):
+        # (activity code, resource name, wait, process) of a decoded row, times in seconds
+        return act, self.resources[int(row[RESOURCE])], round(math.exp(row[WAIT]) - 1), round(math.exp(row[PROCESS]) - 1)
+
+    def waves(self, cases):
+        """Yields (case, position, event) for lists of activity codes, the events of a wave as soon as it ran.
+
+        Wave k is one chain over the k-th events of all cases that long, after the events of wave k - 1.
+        """
+        prev_res = [[] for _ in cases]
+        for k in range(max(map(len, cases), default=0)):
+            active = [c for c, case in enumerate(cases) if len(case) > k]
+            sample = self.sample_events([cases[c][k] for c in active], [cases[c][:k] for c in active],
+                                        [prev_res[c] for c in active])
+            for c, row in zip(active, sample):
+                prev_res[c].append(int(row[RESOURCE]))
+                yield c, k, self.event(cases[c][k], row)
+
+    def sample_cases(self, cases):
+        """Completes lists of activity codes, one chain per event position over all cases still that long."""
+        rows = [[] for _ in cases]
+        for c, _, event in self.waves(cases):
+            rows[c].append(event)
+        return rows
+
+    def complete(self, acts, batch_size=1):
+        """Yields (activity code, resource, wait, process) for every activity name of `acts`.
+
+        Cases are framed by Start/End markers, which are passed through with zero times. Times are in seconds.
+        With `batch_size` 1 every event is its own chain, the random stream of `main.py --eval`. Otherwise up to
+        `batch_size` cases are completed together, the k-th events of all of them in one chain.
+        """
+        if batch_size <= 1:
+            yield from self._complete_sequential(acts)
+            return
+        # markers, and (case, position) of the events of the buffered cases
+        pending, cases, case = [], [], None
+        for name in acts:
+            if name in MARKERS:
+                case = None
+                if len(cases) >= batch_size:
+                    yield from self._flush(pending, cases)
+                    pending, cases = [], []
+                pending.append(name)
+                continue
+            if case is None:
+                case = len(cases)
+                cases.append([])
+            pending.append((case, len(cases[case])))
+            cases[case].append(self.activity_code(name))
+        yield from self._flush(pending, cases)
+
+    def _flush(self, pending, cases):
+        rows = self.sample_cases(cases)
+        for each in pending:
+            yield (each, each, 0, 0) if each in MARKERS else rows[each[0]][each[1]]
+
+    def _complete_sequential(self, acts):
+        prev_acts, prev_res = [], []
+        for name in acts:
+            if name in MARKERS:
+                prev_acts, prev_res = [], []
+                yield name, name, 0, 0
+                continue
+            act = self.activity_code(name)
+            row = self.sample_event(act, prev_acts, prev_res)
+            prev_acts.append(act)
+            prev_res.append(int(row[RESOURCE]))
+            yield self.event(act, row)
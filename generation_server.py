@@ -0,0 +1,256 @@
+"""Local generation server: next-event predictions over HTTP, coalesced into micro-batches.
+
+Workers POST `/predict` with `{"events": [{"activity": name, "prev_activities": [names], "prev_resources":
+[names]}, ...]}` and get `{"events": [{"res": name, "wait": seconds, "process": seconds}, ...]}` back, one entry
+per requested event. Requests are queued; the batching thread takes up to `--max_batch` events, waiting at most
+`--max_wait_ms` for more after the first, runs one chain for all of them and hands every request its rows.
+`GET /stats` reports the batches run so far.
+
+    python generation_server.py --logdir codi_exp --port 8765 [--socket /tmp/codi.sock]
+"""
+import argparse
+import json
+import os
+import queue
+import socket
+import threading
+import time
+from concurrent.futures import Future
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from types import SimpleNamespace
+import numpy as np
+import torch
+import telemetry
+from generation import Generator
+
+
+class MicroBatcher:
+    """Coalesces queued requests of events into batches of up to `max_batch` events, one chain per batch.
+
+    A request that would overflow a batch waits for the next one; requests of more than `max_batch` events are
+    split into parts of at most `max_batch` events.
+    """
+
+    def __init__(self, generator, max_batch=256, max_wait_ms=5.):
+        self.generator = generator
+        self.max_batch = max_batch
+        self.max_wait = max_wait_ms / 1000
+        self.queue = queue.Queue()
+        self.stats = {'requests': 0, 'events': 0, 'batches': 0, 'seconds': 0.}
+        # request taken from the queue that did not fit into the previous batch
+        self._held = None
+        self._thread = threading.Thread(target=self._run, name='micro-batcher', daemon=True)
+        self._thread.start()
+
+    def submit(self, acts, prev_acts, prev_res):
+        """Future of the decoded rows of one request (activity codes and code histories)."""
+        future = Future()
+        if not acts:
+            future.set_result(np.zeros((0, 4)))
+            return future
+        parts = []
+        for start in range(0, len(acts), self.max_batch):
+            part = Future()
+            self.queue.put((acts[start:start + self.max_batch], prev_acts[start:start + self.max_batch],
+                            prev_res[start:start + self.max_batch], part))
+            parts.append(part)
+        if len(parts) == 1:
+            return parts[0]
+        lock = threading.Lock()
+
+        def collect(_):
+            # parts finish in the batching thread, or in this one when done before their callback is added
+            with lock:
+                if future.done() or not all(part.done() for part in parts):
+                    return
+                errors = [part.exception() for part in parts if part.exception() is not None]
+                if errors:
+                    future.set_exception(errors[0])
+                else:
+                    future.set_result(np.concatenate([part.result() for part in parts]))
+
+        for part in parts:
+            part.add_done_callback(collect)
+        return future
+
+    def close(self):
+        self.queue.put(None)
+        self._thread.join()
+
+    def _next_batch(self):
+        # blocks for the first request, then collects more until the batch is full or the wait is over
+        first, self._held = self._held or self.queue.get(), None
+        if first is None:
+            return None
+        batch, size = [first], len(first[0])
+        deadline = time.perf_counter() + self.max_wait
+        while size < self.max_batch:
+            timeout = deadline - time.perf_counter()
+            try:
+                request = self.queue.get(timeout=timeout) if timeout > 0 else self.queue.get_nowait()
+            except queue.Empty:
+                break
+            if request is None:
+                self.queue.put(None)
+                break
+            if size + len(request[0]) > self.max_batch:
+                self._held = request
+                break
+            batch.append(request)
+            size += len(request[0])
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._next_batch()
+            if batch is None:
+                return
+            start = time.perf_counter()
+            try:
+                rows = self.generator.sample_events([act for request in batch for act in request[0]],
+                                                    [each for request in batch for each in request[1]],
+                                                    [each for request in batch for each in request[2]])
+            except Exception as e:
+                for request in batch:
+                    request[3].set_exception(e)
+                continue
+            offset = 0
+            for acts, _, _, future in batch:
+                future.set_result(rows[offset:offset + len(acts)])
+                offset += len(acts)
+            self.stats['requests'] += len(batch)
+            self.stats['events'] += offset
+            self.stats['batches'] += 1
+            self.stats['seconds'] += time.perf_counter() - start
+
+
+class _Handler(BaseHTTPRequestHandler):
+    server_version = 'CoDiGenerate/1.0'
+    # keep-alive, every reply has a Content-Length
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        if self.path != '/stats':
+            return self._reply(404, {'error': f'unknown path {self.path}'})
+        stats = dict(self.server.batcher.stats)
+        stats['mean_batch'] = stats['events'] / max(stats['batches'], 1)
+        self._reply(200, stats)
+
+    def do_POST(self):
+        if self.path != '/predict':
+            return self._reply(404, {'error': f'unknown path {self.path}'})
+        generator = self.server.batcher.generator
+        try:
+            events = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))))['events']
+            acts = [generator.activity_code(each['activity']) for each in events]
+            prev_acts = [[generator.activity_code(name) for name in each.get('prev_activities', [])]
+                         for each in events]
+            prev_res = [[self.server.resource_code(name) for name in each.get('prev_resources', [])]
+                        for each in events]
+            if any(len(a) != len(r) for a, r in zip(prev_acts, prev_res)):
+                raise ValueError('prev_activities and prev_resources of an event must have the same length')
+        except (ValueError, KeyError, TypeError) as e:
+            return self._reply(400, {'error': str(e)})
+        try:
+            rows = self.server.batcher.submit(acts, prev_acts, prev_res).result()
+        except Exception as e:
+            return self._reply(500, {'error': f'{type(e).__name__}: {e}'})
+        self._reply(200, {'events': [dict(zip(('res', 'wait', 'process'), generator.event(act, row)[1:]))
+                                     for act, row in zip(acts, rows)]})
+
+    def _reply(self, status, body):
+        data = json.dumps(body).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def address_string(self):
+        # client_address is '' on a Unix socket
+        return self.client_address[0] if self.client_address else 'unix'
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+
+class GenerationServer(ThreadingHTTPServer):
+    """HTTP server of a MicroBatcher, on a TCP port or, with `unix_socket`, on a Unix domain socket."""
+
+    daemon_threads = True
+
+    def __init__(self, batcher, host='127.0.0.1', port=8765, unix_socket=None, verbose=False):
+        self.batcher = batcher
+        self.verbose = verbose
+        self.resource_codes = {name: code for code, name in enumerate(batcher.generator.resources)}
+        if unix_socket:
+            self.address_family = socket.AF_UNIX
+            if os.path.exists(unix_socket):
+                os.remove(unix_socket)
+            super().__init__(unix_socket, _Handler)
+        else:
+            super().__init__((host, port), _Handler)
+
+    def server_bind(self):
+        if self.address_family == socket.AF_UNIX:
+            # HTTPServer.server_bind expects a (host, port) address
+            self.socket.bind(self.server_address)
+            self.server_name, self.server_port = 'localhost', 0
+            return
+        super().server_bind()
+
+    def resource_code(self, name):
+        try:
+            return self.resource_codes[name]
+        except KeyError:
+            raise ValueError(f'resource {name!r} is not in the vocabulary of the checkpoint') from None
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Serves next-event predictions with dynamic micro-batching.')
+    parser.add_argument('--logdir', default='./codi_exp', help='directory of the model')
+    parser.add_argument('--model', default=None,
+                        help='inference bundle or checkpoint, generator.safetensors in logdir if present else ckpt.pt')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--socket', default=None, help='serve on this Unix domain socket instead of a TCP port')
+    parser.add_argument('--max_batch', type=int, default=256, help='max events of a batch')
+    parser.add_argument('--max_wait_ms', type=float, default=5., help='max wait for more requests after the first')
+    parser.add_argument('--runtime', choices=['eager', 'torchscript', 'onnx'], default='eager',
+                        help='runs the sampling chains on the models or on the reverse step of denoiser_export.py')
+    parser.add_argument('--seed', type=int, default=2022)
+    parser.add_argument('--device', default='cuda:0' if torch.cuda.is_available() else 'cpu')
+    parser.add_argument('--threads', type=int, default=0, help='torch threads, 0 for default')
+    parser.add_argument('--telemetry', type=int, default=1, help='append counters to telemetry.jsonl in logdir')
+    parser.add_argument('--verbose', action='store_true', help='log every request')
+    args = parser.parse_args()
+
+    if args.threads > 0:
+        torch.set_num_threads(args.threads)
+    torch.manual_seed(args.seed)
+    np.random.seed(args.seed)
+    telemetry.start(SimpleNamespace(logdir=args.logdir, telemetry=args.telemetry, telemetry_prometheus='',
+                                    distributed=False, eval=True, data=''))
+    model = args.model or os.path.join(args.logdir, 'generator.safetensors')
+    if not args.model and not os.path.exists(model):
+        model = os.path.join(args.logdir, 'ckpt.pt')
+    generator = Generator.load(model, torch.device(args.device))
+    if args.runtime != 'eager':
+        generator.use_exported(os.path.join(args.logdir, 'export'), args.runtime)
+    batcher = MicroBatcher(generator, args.max_batch, args.max_wait_ms)
+    server = GenerationServer(batcher, args.host, args.port, args.socket, args.verbose)
+    print(f'serving on {args.socket or f"http://{args.host}:{args.port}"}', flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        batcher.close()
+        telemetry.emit('server', **batcher.stats)
+        telemetry.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,201 @@
+"""Fidelity metrics of a generated event log against a real one.
+
+Both logs are reduced to one row per activity instance with its case, activity, resource, waiting time and
+processing time in seconds. That row comes either from the `wait`/`process` columns of a generated
+`gen_sample_*.csv` or from the start/end timestamps of a log such as `test_*.csv`. Every metric is computed
+with sort/bincount group kernels, so millions of events take seconds.
+
+    python log_metrics.py real.csv generated.csv [--output metrics.json] [--groups_dir per_group/]
+"""
+import argparse
+import json
+import os
+import numpy as np
+import pandas as pd
+
+# candidate column names, first match wins
+CASE_COLUMNS = ['caseid', 'case:concept:name', 'case']
+ACTIVITY_COLUMNS = ['activity', 'task', 'concept:name', 'act']
+RESOURCE_COLUMNS = ['res', 'user', 'resource', 'org:resource']
+START_COLUMNS = ['start_timestamp', 'start_time']
+END_COLUMNS = ['end_timestamp', 'end_time', 'time:timestamp']
+
+MARKERS = ('Start', 'End')
+
+
+def _find_column(df, candidates, name, required=True):
+    for each in candidates:
+        if each in df.columns:
+            return each
+    if required:
+        raise ValueError(f'no {name} column in {list(df.columns)}, expected one of {candidates}')
+    return None
+
+
+def _segment_starts(codes):
+    # first index of every run of equal codes in a sorted code array
+    return np.flatnonzero(np.r_[True, codes[1:] != codes[:-1]])
+
+
+def _segment_cummax_exclusive(codes, values):
+    """Running max of `values` over the preceding rows of the same (sorted) segment, -inf for the first row."""
+    span = np.nanmax(values) - np.nanmin(values) + 1 if len(values) else 1
+    shifted = values + codes * span
+    running = np.maximum.accumulate(shifted) - codes * span
+    previous = np.r_[-np.inf, running[:-1]]
+    previous[_segment_starts(codes)] = -np.inf
+    return previous
+
+
+def load_log(path, case_column=None, activity_column=None, resource_column=None):
+    """Reads a log CSV into columns case, activity, resource, wait, process (seconds), dropping Start/End rows.
+
+    Logs with `wait` and `process` columns are taken as is. Otherwise the processing time is end - start and
+    the waiting time is the gap between an activity's start and the latest end of the activities of its case
+    ordered before it by (start, end), clipped at 0. This differs from tabular_dataload._preprocessing, which
+    measures a start event from the last complete event before it in the order of the event stream; the two
+    agree when the activities of a case do not overlap.
+    """
+    df = pd.read_csv(path, dtype=str, keep_default_na=False)
+    case_column = case_column or _find_column(df, CASE_COLUMNS, 'case')
+    activity_column = activity_column or _find_column(df, ACTIVITY_COLUMNS, 'activity')
+    resource_column = resource_column or _find_column(df, RESOURCE_COLUMNS, 'resource')
+    df = df[~df[activity_column].isin(MARKERS)]
+
+    if 'wait' in df.columns and 'process' in df.columns:
+        wait = df['wait'].to_numpy(dtype=float)
+        process = df['process'].to_numpy(dtype=float)
+    else:
+        end_column = _find_column(df, END_COLUMNS, 'end timestamp')
+        start_column = _find_column(df, START_COLUMNS, 'start timestamp', required=False) or end_column
+        start = pd.to_datetime(df[start_column]).to_numpy().astype('datetime64[s]').astype(float)
+        end = pd.to_datetime(df[end_column]).to_numpy().astype('datetime64[s]').astype(float)
+        codes = pd.factorize(df[case_column])[0]
+        order = np.lexsort((end, start, codes))
+        previous_end = np.empty_like(end)
+        previous_end[order] = _segment_cummax_exclusive(codes[order], end[order])
+        wait = np.where(np.isfinite(previous_end), np.maximum(start - previous_end, 0), 0)
+        process = np.maximum(end - start, 0)
+
+    return pd.DataFrame({'case': df[case_column].to_numpy(), 'activity': df[activity_column].to_numpy(),
+                         'resource': df[resource_column].to_numpy(), 'wait': wait, 'process': process})
+
+
+def _grouped_distances(real_codes, real_values, fake_codes, fake_values, num_groups):
+    """Wasserstein-1 and KS distance between the real and generated values of every group.
+
+    Both samples are sorted once by (group, value); every group is then compared on the merged grid of its
+    values with two searchsorted calls. Groups missing on either side get NaN.
+    """
+    real_order = np.lexsort((real_values, real_codes))
+    fake_order = np.lexsort((fake_values, fake_codes))
+    real_codes, real_values = real_codes[real_order], real_values[real_order]
+    fake_codes, fake_values = fake_codes[fake_order], fake_values[fake_order]
+    real_bounds = np.searchsorted(real_codes, np.arange(num_groups + 1))
+    fake_bounds = np.searchsorted(fake_codes, np.arange(num_groups + 1))
+
+    wasserstein = np.full(num_groups, np.nan)
+    ks = np.full(num_groups, np.nan)
+    for g in range(num_groups):
+        u = real_values[real_bounds[g]:real_bounds[g + 1]]
+        v = fake_values[fake_bounds[g]:fake_bounds[g + 1]]
+        if len(u) == 0 or len(v) == 0:
+            continue
+        grid = np.concatenate([u, v])
+        grid.sort(kind='mergesort')
+        u_cdf = np.searchsorted(u, grid[:-1], side='right') / len(u)
+        v_cdf = np.searchsorted(v, grid[:-1], side='right') / len(v)
+        wasserstein[g] = np.sum(np.abs(u_cdf - v_cdf) * np.diff(grid))
+        ks[g] = np.max(np.abs(u_cdf - v_cdf)) if len(grid) > 1 else 0.
+    return wasserstein, ks
+
+
+def _distributions_by(real, fake, key):
+    # per-group distances of the waiting and processing times, groups given by the `key` column
+    codes, names = pd.factorize(np.concatenate([real[key].to_numpy(), fake[key].to_numpy()]))
+    real_codes, fake_codes = codes[:len(real)], codes[len(real):]
+    table = pd.DataFrame({key: names,
+                          'real_events': np.bincount(real_codes, minlength=len(names)),
+                          'generated_events': np.bincount(fake_codes, minlength=len(names))})
+    for column in ('wait', 'process'):
+        table[f'{column}_wasserstein'], table[f'{column}_ks'] = _grouped_distances(
+            real_codes, real[column].to_numpy(dtype=float), fake_codes, fake[column].to_numpy(dtype=float), len(names))
+    return table
+
+
+def _weighted_mean(table, column):
+    # mean over the groups present in both logs, weighted by their number of real events
+    valid = table[column].notna()
+    weights = table['real_events'][valid]
+    return float(np.average(table[column][valid], weights=weights)) if weights.sum() > 0 else float('nan')
+
+
+def _assignment_frequencies(real, fake):
+    """Relative frequency of every (activity, resource) pair in both logs, and their total variation distance."""
+    activity_codes, activities = pd.factorize(np.concatenate([real['activity'].to_numpy(), fake['activity'].to_numpy()]))
+    resource_codes, resources = pd.factorize(np.concatenate([real['resource'].to_numpy(), fake['resource'].to_numpy()]))
+    pair_codes, pairs = pd.factorize(activity_codes.astype(np.int64) * len(resources) + resource_codes)
+    real_freq = np.bincount(pair_codes[:len(real)], minlength=len(pairs)) / max(len(real), 1)
+    fake_freq = np.bincount(pair_codes[len(real):], minlength=len(pairs)) / max(len(fake), 1)
+    table = pd.DataFrame({'activity': activities[pairs // len(resources)], 'resource': resources[pairs % len(resources)],
+                          'real_freq': real_freq, 'generated_freq': fake_freq})
+    return table, 0.5 * float(np.abs(real_freq - fake_freq).sum())
+
+
+def _cycle_times(log):
+    # sum of the waiting and processing times of every case, i.e. its duration when activities are sequential
+    codes = pd.factorize(log['case'])[0]
+    return np.bincount(codes, weights=(log['wait'] + log['process']).to_numpy(dtype=float))
+
+
+def compute_log_metrics(real, fake):
+    """Fidelity of the generated log `fake` against `real`, both as returned by load_log.
+
+    Returns a dict of summary metrics and a dict of per-group tables (per activity, per resource, per
+    activity-resource pair).
+    """
+    by_activity = _distributions_by(real, fake, 'activity')
+    by_resource = _distributions_by(real, fake, 'resource')
+    assignments, assignment_tvd = _assignment_frequencies(real, fake)
+    real_cycles, fake_cycles = _cycle_times(real), _cycle_times(fake)
+    cycle_wasserstein, cycle_ks = _grouped_distances(np.zeros(len(real_cycles), dtype=np.int64), real_cycles,
+                                                     np.zeros(len(fake_cycles), dtype=np.int64), fake_cycles, 1)
+
+    summary = {'real_events': len(real), 'generated_events': len(fake),
+               'real_cases': len(real_cycles), 'generated_cases': len(fake_cycles)}
+    for name, table in (('activity', by_activity), ('resource', by_resource)):
+        for column in ('wait_wasserstein', 'wait_ks', 'process_wasserstein', 'process_ks'):
+            summary[f'{name}_{column}'] = _weighted_mean(table, column)
+        summary[f'{name}_coverage'] = float((table['generated_events'][table['real_events'] > 0] > 0).mean())
+    summary['resource_activity_tvd'] = assignment_tvd
+    summary['cycle_time_wasserstein'] = float(cycle_wasserstein[0])
+    summary['cycle_time_ks'] = float(cycle_ks[0])
+    return summary, {'activity': by_activity, 'resource': by_resource, 'resource_activity': assignments}
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Fidelity metrics of a generated event log against a real one.')
+    parser.add_argument('real', help='real log CSV, e.g. test_<log>.csv')
+    parser.add_argument('generated', help='generated log CSV, e.g. gen_sample_<time>.csv')
+    parser.add_argument('--case_column', default=None)
+    parser.add_argument('--activity_column', default=None)
+    parser.add_argument('--resource_column', default=None)
+    parser.add_argument('--output', default=None, help='write the summary as JSON to this file')
+    parser.add_argument('--groups_dir', default=None, help='write the per-group tables as CSV to this directory')
+    args = parser.parse_args()
+
+    columns = dict(case_column=args.case_column, activity_column=args.activity_column,
+                   resource_column=args.resource_column)
+    summary, tables = compute_log_metrics(load_log(args.real, **columns), load_log(args.generated, **columns))
+    print(json.dumps(summary, indent=2))
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(summary, f, indent=2)
+    if args.groups_dir:
+        os.makedirs(args.groups_dir, exist_ok=True)
+        for name, table in tables.items():
+            table.to_csv(os.path.join(args.groups_dir, f'{name}.csv'), index=False)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,188 @@
+"""Chunked writers of generated event logs: CSV, dictionary-encoded Parquet and streaming XES.
+
+`GeneratedLogWriter` takes the completed rows of a trace-completion run batch by batch: the input rows and, for
+every row, the sampled resource code and the waiting and processing times as the model outputs them
+(log(1 + seconds)). The vocabulary lookup and the inverse log transform run on whole batches, and rows go to
+the sink every `chunk_rows` rows, so memory does not grow with the log. `write_frame` appends already decoded
+rows. The format follows the file extension (.csv, .parquet, .xes) unless given.
+"""
+import os
+import numpy as np
+import pandas as pd
+
+MARKERS = ('Start', 'End')
+
+_XES_HEADER = '''<?xml version="1.0" encoding="utf-8" ?>
+<log xes.version="1849-2016" xes.features="nested-attributes" xmlns="http://www.xes-standard.org/">
+\t<extension name="Concept" prefix="concept" uri="http://www.xes-standard.org/concept.xesext" />
+\t<extension name="Time" prefix="time" uri="http://www.xes-standard.org/time.xesext" />
+\t<extension name="Lifecycle" prefix="lifecycle" uri="http://www.xes-standard.org/lifecycle.xesext" />
+\t<extension name="Organizational" prefix="org" uri="http://www.xes-standard.org/org.xesext" />
+'''
+# XES keys of the generated columns, other columns keep their name
+XES_KEYS = {'activity': 'concept:name', 'res': 'org:resource'}
+
+
+def _xml_escape(value):
+    return value.replace('&', '&amp;').replace('<', '&lt;').replace('>', '&gt;').replace('"', '&quot;')
+
+
+def _encode(values, format):
+    # format(value) of every value as a list, every distinct value formatted once
+    codes, uniques = pd.factorize(values, use_na_sentinel=False)
+    return np.array([format(each) for each in uniques], dtype=object)[codes].tolist()
+
+
+class CsvSink:
+    def __init__(self, path):
+        self.file = open(path, 'w', newline='')
+        self.header = True
+
+    def write(self, frame):
+        frame.to_csv(self.file, header=self.header, index=False)
+        self.header = False
+
+    def close(self):
+        self.file.close()
+
+
+class ParquetSink:
+    """Parquet row groups of one chunk each; text columns are dictionary-encoded."""
+
+    def __init__(self, path):
+        try:
+            import pyarrow
+            import pyarrow.parquet
+        except ImportError:
+            raise RuntimeError('Parquet output needs the pyarrow package') from None
+        self.pa, self.pq = pyarrow, pyarrow.parquet
+        self.path = path
+        self.writer = None
+
+    def write(self, frame):
+        columns = {}
+        for name in frame.columns:
+            values = frame[name]
+            if values.dtype == object:
+                # mixed columns (activity codes next to Start/End) are stored as text
+                columns[name] = self.pa.array(values.astype(str), self.pa.string()).dictionary_encode()
+            else:
+                columns[name] = self.pa.array(values)
+        table = self.pa.table(columns)
+        if self.writer is None:
+            self.writer = self.pq.ParquetWriter(self.path, table.schema, use_dictionary=True)
+        self.writer.write_table(table.cast(self.writer.schema))
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.close()
+
+
+class XesSink:
+    """XES text written trace by trace; a trace may continue over chunks as long as its rows are contiguous."""
+
+    def __init__(self, path, case_column='caseid'):
+        self.file = open(path, 'w', encoding='utf-8')
+        self.file.write(_XES_HEADER)
+        self.case_column = case_column
+        self.case = None
+
+    def _attribute_lines(self, name, values):
+        key = XES_KEYS.get(name, name)
+        if name == 'time:timestamp' or pd.api.types.is_datetime64_any_dtype(values):
+            values = pd.to_datetime(values)
+            if values.dt.tz is not None:
+                values = values.dt.tz_convert('UTC')
+            # naive timestamps are taken as UTC
+            values = values.dt.strftime('%Y-%m-%dT%H:%M:%S.%f').str[:-3] + '+00:00'
+            tag = 'date'
+        elif pd.api.types.is_bool_dtype(values):
+            tag = 'boolean'
+        elif pd.api.types.is_integer_dtype(values):
+            tag = 'int'
+        elif pd.api.types.is_float_dtype(values):
+            tag = 'float'
+        else:
+            tag = 'string'
+        line = f'\t\t\t<{tag} key="{_xml_escape(key)}" value="%s" />\n'
+        return _encode(values, lambda value: line % _xml_escape(str(value)))
+
+    def write(self, frame):
+        cases = frame[self.case_column].tolist()
+        attributes = [self._attribute_lines(name, frame[name]) for name in frame.columns if name != self.case_column]
+        parts = []
+        for k, case in enumerate(cases):
+            if case != self.case:
+                if self.case is not None:
+                    parts.append('\t</trace>\n')
+                parts.append('\t<trace>\n\t\t<string key="concept:name" value="%s" />\n' % _xml_escape(str(case)))
+                self.case = case
+            parts.append('\t\t<event>\n')
+            parts.extend(each[k] for each in attributes)
+            parts.append('\t\t</event>\n')
+        self.file.write(''.join(parts))
+
+    def close(self):
+        if self.case is not None:
+            self.file.write('\t</trace>\n')
+        self.file.write('</log>\n')
+        self.file.close()
+
+
+SINKS = {'csv': CsvSink, 'parquet': ParquetSink, 'xes': XesSink}
+
+
+class GeneratedLogWriter:
+    """Appends completed rows to a generated log in chunks of `chunk_rows` rows."""
+
+    def __init__(self, path, resources, format=None, chunk_rows=100000, act_column='act'):
+        format = format or os.path.splitext(path)[1][1:].lower()
+        if format not in SINKS:
+            raise ValueError(f'unknown log format {format!r}, expected one of {sorted(SINKS)}')
+        self.path = path
+        self.sink = SINKS[format](path)
+        self.resources = np.array(list(resources), dtype=object)
+        self.chunk_rows = chunk_rows
+        self.act_column = act_column
+        self.buffer = []
+        self.buffered = 0
+        self.rows = 0
+
+    def write(self, rows, res, wait, process):
+        """Appends the input rows (a frame) with their resource codes and log(1 + seconds) times.
+
+        Start/End rows keep their marker as resource and get zero times; their codes and times are ignored.
+        """
+        markers = rows[self.act_column].isin(MARKERS).to_numpy()
+        res = np.asarray(res)
+        frame = rows.copy()
+        frame['res'] = np.where(markers, frame[self.act_column].to_numpy(dtype=object),
+                                self.resources[np.where(markers, 0, res).astype(np.int64)])
+        for name, values in (('wait', wait), ('process', process)):
+            values = np.where(markers, 0., np.asarray(values, dtype=np.float64))
+            frame[name] = np.round(np.exp(values) - 1).astype(np.int64)
+        self.write_frame(frame)
+
+    def write_frame(self, frame):
+        """Appends decoded rows as they are."""
+        self.buffer.append(frame)
+        self.buffered += len(frame)
+        if self.buffered >= self.chunk_rows:
+            self.flush()
+
+    def flush(self):
+        if self.buffer:
+            frame = pd.concat(self.buffer, ignore_index=True) if len(self.buffer) > 1 else self.buffer[0]
+            self.sink.write(frame)
+            self.rows += len(frame)
+        self.buffer, self.buffered = [], 0
+
+    def close(self):
+        self.flush()
+        self.sink.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
@@ -7,6 +7,8 @@ import logging
 import numpy as np
 import pandas as pd
 import co_evolving_condition
+import profiling
+import telemetry
 from utils import *
 
 pd.set_option('display.max_columns', None)
@@ -28,6 +30,8 @@ flags.DEFINE_bool('eval', False, help='load ckpt.pt and evaluate')
 flags.DEFINE_string('still_condition', "0", help='encoder_dim_con')
 flags.DEFINE_integer('seed', 2022, help='random sample')
 flags.DEFINE_string('gen_seq_output', '', help='gen_seq_script')
+flags.DEFINE_enum('gen_output_format', 'csv', ['csv', 'parquet', 'xes'], help='format of the generated log')
+flags.DEFINE_integer('gen_chunk_rows', 10000, help='rows of the generated log written at a time')
 
 # Network Architecture
 flags.DEFINE_multi_integer('encoder_dim', None, help='encoder_dim')
@@ -54,7 +58,7 @@ flags.DEFINE_integer('dmodel', 20, help='attention')
 
 # Training
 flags.DEFINE_integer('training_batch_size', 2100, help='batch size')
-flags.DEFINE_integer('eval_batch_size', 2100, help='batch size')
+flags.DEFINE_integer('eval_batch_size', 2100, help='rows per sampling chunk')
 flags.DEFINE_integer('T', 50, help='total diffusion steps')
 flags.DEFINE_float('beta_1', 0.00001, help='start beta value')
 flags.DEFINE_float('beta_T', 0.02, help='end beta value')
@@ -63,9 +67,25 @@ flags.DEFINE_float('lr_dis', 2e-03, help='target learning rate')
 flags.DEFINE_integer('total_epochs_both', 2000, help='total training steps')
 flags.DEFINE_float('grad_clip', 1., help="gradient norm clipping")
 flags.DEFINE_bool('parallel', False, help='multi gpu training')
+flags.DEFINE_bool('distributed', False, help='multi-process DistributedDataParallel training over gloo, launch with torchrun')
+flags.DEFINE_integer('threads_per_proc', 0, help='torch threads per distributed process, 0 for cores / local processes')
 
 # Sampling
 flags.DEFINE_integer('sample_step', 2000, help='frequency of sampling')
+flags.DEFINE_integer('sample_rows', 0, help='rows drawn by periodic sampling, 0 for as many as training rows')
+flags.DEFINE_bool('sample_async', True, help='run periodic sampling in a background process')
+flags.DEFINE_integer('sample_threads', 1, help='torch threads of the background sampling process, 0 for default')
+flags.DEFINE_integer('decode_workers', 1, help='threads decoding and formatting sampled chunks while the next chunk is sampled, 0 inline')
+flags.DEFINE_bool('concurrent_denoisers', False, help='run the continuous denoiser of a reverse step in a thread next to the discrete ones')
+
+# Profiling
+flags.DEFINE_bool('profile', False, help='time the pipeline stages and write a torch.profiler trace to logdir')
+flags.DEFINE_integer('profile_wait', 1, help='steps skipped before the profiler window')
+flags.DEFINE_integer('profile_warmup', 1, help='profiler warmup steps before recording')
+flags.DEFINE_integer('profile_steps', 5, help='steps recorded in the profiler window')
+flags.DEFINE_bool('telemetry', True, help='append throughput and memory counters to telemetry.jsonl in logdir')
+flags.DEFINE_integer('telemetry_interval', 100, help='training steps per telemetry record')
+flags.DEFINE_string('telemetry_prometheus', '', help='also keep the latest counters in this Prometheus textfile')
 
 # Continuous diffusion model
 flags.DEFINE_enum('mean_type', 'epsilon', ['xprev', 'xstart', 'epsilon'], help='predict variable')
@@ -102,7 +122,8 @@ def main(argv):
     else:
         warnings.simplefilter(action='ignore', category=FutureWarning)
         os.makedirs(FLAGS.logdir,exist_ok=True)
-        gfile_stream = open(os.path.join(FLAGS.logdir, 'train.txt'), 'w')
+        rank = int(os.environ.get('RANK', 0)) if FLAGS.distributed else 0
+        gfile_stream = open(os.path.join(FLAGS.logdir, 'train.txt' if rank == 0 else f'train_rank{rank}.txt'), 'w')
         handler = logging.StreamHandler(gfile_stream)
         formatter = logging.Formatter('%(levelname)s - %(filename)s - %(asctime)s - %(message)s')
         handler.setFormatter(formatter)
@@ -111,7 +132,13 @@ def main(argv):
         logger.setLevel('INFO')
     
     logging.info("Co-evolving Conditional Diffusion models")
-    co_evolving_condition.train(FLAGS)
+    profiling.start(FLAGS)
+    telemetry.start(FLAGS)
+    try:
+        co_evolving_condition.train(FLAGS)
+    finally:
+        profiling.finish()
+        telemetry.close()
 
 if __name__ == '__main__':
     # os.environ['PYTORCH_CUDA_ALLOC_CONF'] = 'max_split_size_mb:512'
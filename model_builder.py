@@ -0,0 +1,64 @@
+"""Denoisers and diffusion processes built from their sizes, shared by training, generation and the benchmarks.
+
+`model_config` collects the flags the models are built from into a plain dict that is stored with the
+checkpoint, so generation can rebuild the models without the data or absl.
+"""
+from types import SimpleNamespace
+from diffusion_continuous import GaussianDiffusionTrainer, GaussianDiffusionSampler
+from diffusion_discrete import MultinomialDiffusion
+from models.tabular_unet import tabularUnet
+
+CONFIG_KEYS = ('cont_input_size', 'cont_cond_size', 'cont_output_size', 'dis_input_size', 'dis_cond_size',
+               'dis_output_size', 'src_vocab_size_list', 'tgt_vocab_size', 'encoder_dim_con', 'encoder_dim_dis',
+               'nf_con', 'nf_dis', 'activation', 'dmodel', 'beta_1', 'beta_T', 'T', 'mean_type', 'var_type',
+               'still_condition')
+
+
+def set_model_sizes(FLAGS, cont_dim, num_class):
+    # the continuous model is conditioned on every discrete column, a discrete model on the other ones
+    num_class = [int(each) for each in num_class]
+    FLAGS.cont_input_size = int(cont_dim)
+    FLAGS.cont_cond_size = list(num_class)
+    FLAGS.cont_output_size = int(cont_dim)
+    FLAGS.dis_input_size = list(num_class)
+    FLAGS.dis_cond_size = [[each for j, each in enumerate(num_class) if j != i] for i in range(len(num_class))]
+    FLAGS.dis_output_size = list(num_class)
+
+
+def model_config(FLAGS, num_rows):
+    config = {key: getattr(FLAGS, key) for key in CONFIG_KEYS}
+    config['still_condition'] = list(config['still_condition'])
+    config['num_rows'] = int(num_rows)
+    return config
+
+
+def build_models(config, device):
+    """Builds the models of a model_config dict, in the order (and random state) of co_evolving_condition.train.
+
+    Returns the continuous model, its trainer and sampler, and the discrete models with their diffusions.
+    """
+    FLAGS = SimpleNamespace(**config)
+    FLAGS.encoder_dim = list(map(int, FLAGS.encoder_dim_con.split(',')))
+    FLAGS.nf = FLAGS.nf_con
+    model_cont = tabularUnet(FLAGS, '-1')
+    trainer_cont = GaussianDiffusionTrainer(model_cont, FLAGS.beta_1, FLAGS.beta_T, FLAGS.T).to(device)
+    net_sampler = GaussianDiffusionSampler(model_cont, FLAGS.beta_1, FLAGS.beta_T, FLAGS.T, FLAGS.mean_type,
+                                           FLAGS.var_type).to(device)
+    model_dis_list, trainer_dis_list = [], []
+    for i, num_class in enumerate(FLAGS.dis_input_size):
+        FLAGS.encoder_dim = list(map(int, FLAGS.encoder_dim_dis.split(',')))
+        FLAGS.nf = FLAGS.nf_dis
+        model_dis_list.append(tabularUnet(FLAGS, i))
+        trainer_dis_list.append(MultinomialDiffusion(num_class, (FLAGS.num_rows, num_class), model_dis_list[i], FLAGS,
+                                                     timesteps=FLAGS.T, loss_type='vb_stochastic').to(device))
+    return model_cont, trainer_cont, net_sampler, model_dis_list, trainer_dis_list
+
+
+def attention_embeddings(model):
+    # the token embeddings of the attention block sit in a plain list, so they are not part of the state_dict
+    return [each.embedding.weight.detach().cpu().clone() for each in model.attention.src_token_embedding_list]
+
+
+def load_attention_embeddings(model, weights):
+    for each, weight in zip(model.attention.src_token_embedding_list, weights):
+        each.embedding.weight.data.copy_(weight)
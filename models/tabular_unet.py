@@ -20,6 +20,7 @@ import torch.nn as nn
 import torch
 
 from models.AttentionBlock import AttentionBlock
+from profiling import stage
 
 get_act = layers.get_act
 default_initializer = layers.default_init
@@ -133,7 +134,8 @@ class tabularUnet(nn.Module):
     if if_cont:
       skip_connections, encoding = self.encoder(inputs, temb, -1)   #encoder input=64, output=256（layers第104行，x=64->128->256)
     else:
-      attention = self.attention(src_list=x_attention[:-3], tgt=x_attention[-1], src_key_padding_mask=x_attention[-3:-1])
+      with stage('attention'):
+        attention = self.attention(src_list=x_attention[:-3], tgt=x_attention[-1], src_key_padding_mask=x_attention[-3:-1])
       skip_connections, encoding = self.encoder(inputs, temb, attention)
     encoding = self.bottom_block(encoding)   #nn(256,256)  input=256, output=256
     encoding = self.act(encoding)    # relu output=256
@@ -0,0 +1,121 @@
+"""Stage annotations for `--profile` runs.
+
+`stage(name)` marks a region as a `torch.profiler.record_function` range and adds its wall time to a named
+timer. Until `start` enables profiling it returns one shared null context, so annotated code only pays a
+global lookup. `start` also sets up a `torch.profiler` capture over a bounded window of steps (training steps,
+or generated events in eval mode), advanced by `step`; `finish` writes the Chrome trace and a per-stage
+summary table to `FLAGS.logdir`.
+"""
+import contextlib
+import logging
+import os
+import threading
+import time
+import torch
+
+_ENABLED = False
+_NULL = contextlib.nullcontext()
+# stage name -> [calls, total seconds, max seconds]
+_TIMERS = {}
+# stages also close in worker threads (concurrent denoisers, decode workers)
+_TIMERS_LOCK = threading.Lock()
+_STATE = {}
+
+
+class _Stage:
+    __slots__ = ('name', 'record', 'start')
+
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        self.record = torch.profiler.record_function(self.name)
+        self.record.__enter__()
+        self.start = time.perf_counter()
+
+    def __exit__(self, *exc):
+        if _STATE['cuda']:
+            torch.cuda.synchronize()
+        elapsed = time.perf_counter() - self.start
+        self.record.__exit__(*exc)
+        with _TIMERS_LOCK:
+            timer = _TIMERS.setdefault(self.name, [0, 0., 0.])
+            timer[0] += 1
+            timer[1] += elapsed
+            timer[2] = max(timer[2], elapsed)
+        return False
+
+
+def stage(name, column=None):
+    """Context manager of a profiled stage, `<name>_<column>` for per-column stages."""
+    if not _ENABLED:
+        return _NULL
+    return _Stage(name if column is None else f'{name}_{column}')
+
+
+def _output_path(FLAGS, name):
+    rank = int(os.environ.get('RANK', 0)) if FLAGS.distributed else 0
+    return os.path.join(FLAGS.logdir, name if rank == 0 else name.replace('.', f'_rank{rank}.', 1))
+
+
+def _trace_ready(prof):
+    prof.export_chrome_trace(_STATE['trace_path'])
+    _STATE['operators'] = prof.key_averages().table(sort_by='self_cpu_time_total', row_limit=25)
+    logging.info(f"Profiler trace written to {_STATE['trace_path']}")
+
+
+def start(FLAGS):
+    """Enables the stage timers and the step-window profiler when FLAGS.profile is set."""
+    global _ENABLED
+    if not FLAGS.profile:
+        return
+    _TIMERS.clear()
+    _STATE.clear()
+    _STATE['cuda'] = torch.cuda.is_available()
+    _STATE['trace_path'] = _output_path(FLAGS, 'profile_trace.json')
+    _STATE['summary_path'] = _output_path(FLAGS, 'profile_summary.txt')
+    _STATE['start'] = time.perf_counter()
+    activities = [torch.profiler.ProfilerActivity.CPU]
+    if _STATE['cuda']:
+        activities.append(torch.profiler.ProfilerActivity.CUDA)
+    schedule = torch.profiler.schedule(wait=FLAGS.profile_wait, warmup=FLAGS.profile_warmup,
+                                       active=FLAGS.profile_steps, repeat=1)
+    _STATE['profiler'] = torch.profiler.profile(activities=activities, schedule=schedule,
+                                                on_trace_ready=_trace_ready, record_shapes=True,
+                                                profile_memory=True)
+    _STATE['profiler'].start()
+    _ENABLED = True
+
+
+def step():
+    """Advances the profiler window by one step."""
+    if _ENABLED:
+        _STATE['profiler'].step()
+
+
+def summary_table():
+    # stages by total time, the share is of the wall time since `start` (nested stages overlap)
+    wall = time.perf_counter() - _STATE['start']
+    lines = [f"{'stage':<32}{'calls':>10}{'total_s':>12}{'mean_ms':>12}{'max_ms':>12}{'share':>9}"]
+    with _TIMERS_LOCK:
+        timers = sorted(((name, list(timer)) for name, timer in _TIMERS.items()), key=lambda item: -item[1][1])
+    for name, (calls, total, longest) in timers:
+        lines.append(f'{name:<32}{calls:>10}{total:>12.3f}{1000 * total / calls:>12.3f}'
+                     f'{1000 * longest:>12.3f}{100 * total / wall:>8.1f}%')
+    lines.append(f"{'wall':<32}{'':>10}{wall:>12.3f}")
+    return '\n'.join(lines)
+
+
+def finish():
+    """Stops the profiler and writes the per-stage summary (and the operator table of the window)."""
+    global _ENABLED
+    if not _ENABLED:
+        return
+    _STATE['profiler'].stop()
+    _ENABLED = False
+    table = summary_table()
+    with open(_STATE['summary_path'], 'w') as f:
+        f.write(table + '\n')
+        if 'operators' in _STATE:
+            f.write('\nOperators of the profiled window\n' + _STATE['operators'] + '\n')
+    logging.info('Stage profile\n' + table)
@@ -0,0 +1,105 @@
+"""Independent replicas of a generated log from one model in shared memory.
+
+The model is loaded once and its weights are moved to shared memory. Then `--workers` processes are started,
+forked where the platform allows, so the weights are not copied. Replica r completes the input with seed
+`--seed + r`, in chains of `--batch_size` cases and with `--threads` torch threads, and writes
+`replica_<r>.csv` to `--output_dir`. The file format is that of generate.py. The replica of a seed is the same
+whichever worker runs it and however many workers there are.
+
+    python replicas.py --logdir codi_exp --input tabular_datasets/gen_seq_consulta.csv --replicas 8 --workers 4
+"""
+import argparse
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import numpy as np
+import torch
+import torch.multiprocessing as mp
+from generate import read_input, write_completed
+from generation import Generator
+
+# state of a worker process, set once by _init_worker
+_WORKER = {}
+
+
+def _memory_mb():
+    # resident and private (unshared) memory of this process in MB, None where /proc is not available
+    try:
+        with open('/proc/self/smaps_rollup') as f:
+            fields = {line.split(':')[0]: int(line.split()[1]) for line in f if line.split()[-1] == 'kB'}
+    except OSError:
+        return None, None
+    return fields['Rss'] / 1024, (fields['Private_Clean'] + fields['Private_Dirty']) / 1024
+
+
+def _init_worker(generator, rows, fields, threads):
+    _WORKER.update(generator=generator, rows=rows, fields=fields)
+    if threads > 0:
+        torch.set_num_threads(threads)
+
+
+def _replica(replica, seed, output, batch_size):
+    torch.manual_seed(seed)
+    np.random.seed(seed)
+    start = time.perf_counter()
+    num_cases, num_events = write_completed(_WORKER['generator'], _WORKER['rows'], _WORKER['fields'], output,
+                                            batch_size)
+    rss, private = _memory_mb()
+    return {'replica': replica, 'seed': seed, 'output': output, 'cases': num_cases, 'events': num_events,
+            'seconds': time.perf_counter() - start, 'pid': os.getpid(), 'rss_mb': rss, 'private_mb': private}
+
+
+def run_replicas(generator, rows, fields, output_dir, replicas, workers, seed=2022, batch_size=64, threads=1):
+    """Writes `replicas` completions of the input rows in `workers` processes, returns the stats of each."""
+    generator.share_memory()
+    os.makedirs(output_dir, exist_ok=True)
+    context = mp.get_context('fork' if 'fork' in multiprocessing.get_all_start_methods() else 'spawn')
+    results = []
+    with ProcessPoolExecutor(workers, mp_context=context, initializer=_init_worker,
+                             initargs=(generator, rows, fields, threads)) as pool:
+        futures = [pool.submit(_replica, r, seed + r, os.path.join(output_dir, f'replica_{r}.csv'), batch_size)
+                   for r in range(replicas)]
+        for future in as_completed(futures):
+            result = future.result()
+            print(f"replica {result['replica']} (seed {result['seed']}): {result['events']} events in "
+                  f"{result['seconds']:.1f}s to {result['output']}", flush=True)
+            results.append(result)
+    return sorted(results, key=lambda each: each['replica'])
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Generates independent replicas of a log in parallel processes.')
+    parser.add_argument('--logdir', default='./codi_exp', help='directory of the model')
+    parser.add_argument('--model', default=None,
+                        help='inference bundle or checkpoint, generator.safetensors in logdir if present else ckpt.pt')
+    parser.add_argument('--input', required=True, help='CSV of the activity sequences')
+    parser.add_argument('--output_dir', default=None, help='directory of the replicas, <logdir>/replicas')
+    parser.add_argument('--replicas', type=int, default=4, help='replicas to generate, seeds seed..seed+replicas-1')
+    parser.add_argument('--workers', type=int, default=0, help='worker processes, 0 for one per core')
+    parser.add_argument('--threads', type=int, default=1, help='torch threads of every worker, 0 for default')
+    parser.add_argument('--batch_size', type=int, default=64, help='cases completed together in one chain')
+    parser.add_argument('--seed', type=int, default=2022)
+    args = parser.parse_args()
+
+    model = args.model or os.path.join(args.logdir, 'generator.safetensors')
+    if not args.model and not os.path.exists(model):
+        model = os.path.join(args.logdir, 'ckpt.pt')
+    generator = Generator.load(model)
+    rows, fields = read_input(args.input)
+    workers = min(args.workers or os.cpu_count(), args.replicas)
+    weights = sum(each.numel() * each.element_size() for module in (generator.net_sampler, *generator.trainer_dis_list)
+                  for each in module.state_dict().values()) / 2 ** 20
+    start = time.perf_counter()
+    results = run_replicas(generator, rows, fields, args.output_dir or os.path.join(args.logdir, 'replicas'),
+                           args.replicas, workers, args.seed, args.batch_size, args.threads)
+    seconds = time.perf_counter() - start
+    events = sum(each['events'] for each in results)
+    private = [each['private_mb'] for each in results if each['private_mb'] is not None]
+    print(f'{args.replicas} replicas, {events} events in {seconds:.1f}s with {workers} workers '
+          f'({events / seconds:.1f} events/s); weights {weights:.1f} MB shared'
+          + (f', at most {max(private):.1f} MB private per worker' if private else ''))
+
+
+if __name__ == '__main__':
+    main()
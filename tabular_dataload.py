@@ -24,7 +24,10 @@ import os
 import numpy as np
 import pm4py
 import copy
+import time
 import pandas as pd
+import telemetry
+from profiling import stage
 
 CATEGORICAL = "categorical"
 CONTINUOUS = "continuous"
@@ -46,7 +49,8 @@ def _get_columns(metadata):
 
 def _preprocessing(df, id_column, act_column, time_column, resource_column, state_column,
                    meta_filename,
-                   preprocessed_data_filename
+                   preprocessed_data_filename,
+                   write_files=True
                    ):
     pd.options.mode.chained_assignment = None
 
@@ -252,8 +256,9 @@ def _preprocessing(df, id_column, act_column, time_column, resource_column, stat
     data = data.reset_index(drop=True)
 
     import json
-    with open(meta_filename, "w") as f:
-        json.dump(json_input, f)
+    if write_files:
+        with open(meta_filename, "w") as f:
+            json.dump(json_input, f)
 
     # with open('test.json') as json_file:
     #     a = json.load(json_file)
@@ -269,15 +274,19 @@ def _preprocessing(df, id_column, act_column, time_column, resource_column, stat
 
     array_dict = {'train': train_1, 'test': test_1, 'train_attention': train_attention,
                   'test_attention': test_attention}
-    np.savez(preprocessed_data_filename, **array_dict)
+    if write_files:
+        np.savez(preprocessed_data_filename, **array_dict)
 
     return array_dict, json_input
 
 
-def load_data(FLAGS, benchmark=False):
+def load_data(FLAGS, benchmark=False, write_files=True):
     # load event log xes
     local_path = os.path.join(DATA_PATH, FLAGS.data)
-    data = pm4py.read.read_xes(local_path)
+    read_start = time.perf_counter()
+    with stage('read_xes'):
+        data = pm4py.read.read_xes(local_path)
+    read_seconds = time.perf_counter() - read_start
     meta_filename = os.path.join(DATA_PATH, FLAGS.data.split(".")[0] + "_meta_preprocessed.json")
     preprocessed_data_filename = os.path.join(DATA_PATH, FLAGS.data.split(".")[0] + "_data_preprocessed.npz")
     df = copy.deepcopy(pd.DataFrame(data, columns=[FLAGS.id_column,
@@ -287,21 +296,28 @@ def load_data(FLAGS, benchmark=False):
                                                    FLAGS.state_column],
                                     ))
     # preprocessing
-    preprocessed_data_array, meta = _preprocessing(df,
-                                                   FLAGS.id_column,
-                                                   FLAGS.act_column,
-                                                   FLAGS.time_column,
-                                                   FLAGS.resource_column,
-                                                   FLAGS.state_column,
-                                                   meta_filename,
-                                                   preprocessed_data_filename
-                                                  )
+    preprocessing_start = time.perf_counter()
+    with stage('_preprocessing'):
+        preprocessed_data_array, meta = _preprocessing(df,
+                                                       FLAGS.id_column,
+                                                       FLAGS.act_column,
+                                                       FLAGS.time_column,
+                                                       FLAGS.resource_column,
+                                                       FLAGS.state_column,
+                                                       meta_filename,
+                                                       preprocessed_data_filename,
+                                                       write_files
+                                                      )
 
     categorical_columns = _get_columns(meta)
     print('categorical_columns',categorical_columns)
     train = preprocessed_data_array['train']
     print('train', train.shape)
     test = preprocessed_data_array['test']
+    preprocessing_seconds = time.perf_counter() - preprocessing_start
+    telemetry.emit('load_data', events=len(df), activity_instances=len(train) + len(test),
+                   read_xes_s=read_seconds, preprocessing_s=preprocessing_seconds,
+                   preprocessing_events_per_s=len(df) / max(preprocessing_seconds, 1e-9))
     attention_train_list = [preprocessed_data_array['train_attention'][:,i].tolist()
                             for i in range(preprocessed_data_array['train_attention'].shape[1])]
     attention_test_list = [preprocessed_data_array['train_attention'][:,i].tolist()
@@ -310,7 +326,7 @@ def load_data(FLAGS, benchmark=False):
 
     return train, test, (categorical_columns, meta), attention_train_list, attention_test_list
 
-def get_dataset(FLAGS, evaluation=False):
+def get_dataset(FLAGS, evaluation=False, write_files=True):
 
   batch_size = FLAGS.training_batch_size if not evaluation else FLAGS.eval_batch_size
 
@@ -320,7 +336,7 @@ def get_dataset(FLAGS, evaluation=False):
 
 
   # Create dataset builders for tabular data.
-  train, test, cols, attention_train_list, attention_test_list = load_data(FLAGS)
+  train, test, cols, attention_train_list, attention_test_list = load_data(FLAGS, write_files=write_files)
   cols_idx = list(np.arange(train.shape[1]))
   dis_idx = cols[0]
   con_idx = [x for x in cols_idx if x not in dis_idx]
@@ -335,11 +351,13 @@ def get_dataset(FLAGS, evaluation=False):
   transformer_con = GeneralTransformer()
   transformer_dis = GeneralTransformer()
 
-  transformer_con.fit(train_con, [])
-  transformer_dis.fit(train_dis, cat_idx_)
+  with stage('transformer_fit'):
+    transformer_con.fit(train_con, [])
+    transformer_dis.fit(train_dis, cat_idx_)
 
-  train_cont_data = transformer_con.transform(train_con)
-  train_dis_data = transformer_dis.transform(train_dis)
+  with stage('transformer_transform'):
+    train_cont_data = transformer_con.transform(train_con)
+    train_dis_data = transformer_dis.transform(train_dis)
   FLAGS.src_vocab_size_list = [each['size']+1 for each in cols[1]['attention']]
 
   FLAGS.tgt_vocab_size = FLAGS.src_vocab_size_list[0]
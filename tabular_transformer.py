@@ -1,5 +1,4 @@
 import numpy as np
-import pandas as pd
 
 CATEGORICAL = "categorical"
 CONTINUOUS = "continuous"
@@ -8,6 +7,7 @@ class Transformer:
 
     @staticmethod
     def get_metadata(data, categorical_columns=tuple()):
+        import pandas as pd
         meta = []
 
         df = pd.DataFrame(data)
@@ -59,6 +59,26 @@ class GeneralTransformer(Transformer):
             else:
                 self.output_dim += info['size']
 
+    def state(self):
+        # fitted state as plain python values, for checkpoints read without pandas
+        plain = lambda value: value.item() if isinstance(value, np.generic) else value
+        meta = []
+        for info in self.meta:
+            info = {key: plain(value) for key, value in info.items()}
+            if info['type'] == CATEGORICAL:
+                info['i2s'] = [plain(each) for each in info['i2s']]
+            meta.append(info)
+        return {'act': self.act, 'meta': meta, 'output_dim': self.output_dim,
+                'output_info': [tuple(each) for each in self.output_info]}
+
+    @classmethod
+    def from_state(cls, state):
+        transformer = cls(state['act'])
+        transformer.meta = state['meta']
+        transformer.output_dim = state['output_dim']
+        transformer.output_info = [tuple(each) for each in state['output_info']]
+        return transformer
+
     def transform(self, data):
         data_t = []
         self.output_info = []
@@ -0,0 +1,136 @@
+"""Throughput and memory counters of every run.
+
+`emit(event, **fields)` appends one JSON line `{"time", "event", **fields, **memory}` to `telemetry.jsonl` in
+`FLAGS.logdir`. Memory is the current and peak RSS of the process and, on CUDA, the torch allocator stats. With
+`FLAGS.telemetry_prometheus` the latest numeric value of every field is also kept as a gauge
+`codi_<event>_<field>` in that Prometheus textfile (for the node_exporter textfile collector). Nothing is
+written before `start`, so modules can emit unconditionally.
+"""
+import contextlib
+import json
+import os
+import sys
+import threading
+import time
+import torch
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+_LOCK = threading.Lock()
+_STATE = {}
+# (event, field) -> latest value, for the Prometheus textfile
+_GAUGES = {}
+
+
+def _output_path(FLAGS, name):
+    rank = int(os.environ.get('RANK', 0)) if FLAGS.distributed else 0
+    return os.path.join(FLAGS.logdir, name if rank == 0 else name.replace('.', f'_rank{rank}.', 1))
+
+
+def memory():
+    """Current and peak resident set size in MB, plus the torch CUDA allocator stats when available."""
+    stats = {}
+    try:
+        with open('/proc/self/statm') as f:
+            stats['rss_mb'] = int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / 2 ** 20
+    except (OSError, ValueError):
+        pass
+    if resource is not None:
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # bytes on macOS, kilobytes elsewhere
+        stats['peak_rss_mb'] = peak / 2 ** 20 if sys.platform == 'darwin' else peak / 2 ** 10
+    if torch.cuda.is_available():
+        stats['torch_allocated_mb'] = torch.cuda.memory_allocated() / 2 ** 20
+        stats['torch_reserved_mb'] = torch.cuda.memory_reserved() / 2 ** 20
+        stats['torch_peak_allocated_mb'] = torch.cuda.max_memory_allocated() / 2 ** 20
+    return stats
+
+
+def start(FLAGS):
+    """Opens the JSON lines stream of this run when FLAGS.telemetry is set."""
+    close()
+    if not FLAGS.telemetry:
+        return
+    os.makedirs(FLAGS.logdir, exist_ok=True)
+    _GAUGES.clear()
+    _STATE['stream'] = open(_output_path(FLAGS, 'telemetry.jsonl'), 'a')
+    _STATE['prometheus'] = FLAGS.telemetry_prometheus
+    _STATE['start'] = time.time()
+    emit('run_start', mode='eval' if FLAGS.eval else 'train', data=FLAGS.data)
+
+
+def enabled():
+    return 'stream' in _STATE
+
+
+def emit(event, **fields):
+    """Writes one record of `event`, a no-op before `start`."""
+    if not enabled():
+        return
+    record = {'time': round(time.time(), 3), 'event': event}
+    record.update(fields)
+    record.update(memory())
+    with _LOCK:
+        _STATE['stream'].write(json.dumps(record) + '\n')
+        _STATE['stream'].flush()
+        if _STATE['prometheus']:
+            for key, value in record.items():
+                if key != 'time' and isinstance(value, (int, float)) and not isinstance(value, bool):
+                    _GAUGES[(event, key)] = value
+            _write_prometheus(_STATE['prometheus'])
+
+
+def _write_prometheus(path):
+    # rewritten as a whole and renamed into place, so the collector never reads a partial file
+    lines = []
+    for (event, key), value in sorted(_GAUGES.items()):
+        name = f'codi_{event}_{key}'
+        lines.append(f'# TYPE {name} gauge\n{name} {value}')
+    tmp = f'{path}.tmp'
+    with open(tmp, 'w') as f:
+        f.write('\n'.join(lines) + '\n')
+    os.replace(tmp, path)
+
+
+def close():
+    if not enabled():
+        return
+    emit('run_end', seconds=round(time.time() - _STATE['start'], 3))
+    with _LOCK:
+        _STATE.pop('stream').close()
+    _STATE.clear()
+
+
+class Rate:
+    """Counts steps and rows between `emit` calls and reports their rates over that window."""
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.start = time.perf_counter()
+        self.steps = 0
+        self.rows = 0
+
+    def add(self, rows, steps=1):
+        self.steps += steps
+        self.rows += rows
+
+    @contextlib.contextmanager
+    def excluded(self):
+        # time spent inside does not count towards the window (e.g. sampling and checkpoints between steps)
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.start += time.perf_counter() - start
+
+    def emit(self, event, **fields):
+        seconds = time.perf_counter() - self.start
+        emit(event, steps=self.steps, rows=self.rows, seconds=round(seconds, 6),
+             steps_per_s=self.steps / seconds if seconds > 0 else 0.,
+             rows_per_s=self.rows / seconds if seconds > 0 else 0., **fields)
+        self.reset()
@@ -1,7 +1,9 @@
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 import torch
 import torch.nn.functional as F
 import numpy as np
-import pandas as pd
+from profiling import stage
 
 def warmup_lr(step):
     return min(step, 5000) / 5000
@@ -31,7 +33,28 @@ def apply_activate(data, output_info):
             assert 0
     return torch.cat(data_t, dim=1)
 
+def decode_samples(x_cont, x_dis_list, transformer_con, transformer_dis, con_idx, dis_idx):
+    # model outputs -> rows in the original column order
+    with stage('decode'):
+        return _decode_samples(x_cont, x_dis_list, transformer_con, transformer_dis, con_idx, dis_idx)
+
+def _decode_samples(x_cont, x_dis_list, transformer_con, transformer_dis, con_idx, dis_idx):
+    sample_cont = transformer_con.inverse_transform(x_cont.detach().cpu().numpy())
+    x_dis = torch.tensor(np.concatenate(x_dis_list, axis=1))
+    x_dis = apply_activate(x_dis, transformer_dis.output_info)
+    sample_dis = transformer_dis.inverse_transform(x_dis.detach().cpu().numpy())
+    sample = np.zeros([sample_cont.shape[0], len(con_idx + dis_idx)])
+    for i in range(len(con_idx)):
+        sample[:, con_idx[i]] = sample_cont[:, i]
+    for i in range(len(dis_idx)):
+        sample[:, dis_idx[i]] = sample_dis[:, i]
+    return sample
+
 def log_sample_categorical(logits, num_class):
+    with stage('log_sample_categorical'):
+        return _log_sample_categorical(logits, num_class)
+
+def _log_sample_categorical(logits, num_class):
     full_sample = []
     # k=0
     # for i in range(len(num_classes)):
@@ -48,27 +71,81 @@ def log_sample_categorical(logits, num_class):
     return log_sample
 
 
+def condition_tensors(still_cond_used_for_sampling, still_condition, device, dtype=torch.float32):
+    # the fixed conditions as device tensors of the working dtype, converted once and then reused as they are;
+    # numpy arrays are wrapped with from_numpy (no copy for float32 arrays on the cpu)
+    tensors = list(still_cond_used_for_sampling)
+    for j in still_condition:
+        each = tensors[j]
+        if not isinstance(each, torch.Tensor):
+            each = torch.from_numpy(np.asarray(each))
+        tensors[j] = each.to(device=device, dtype=dtype)
+    return tensors
+
+# thread running the discrete denoisers of a reverse step next to the continuous one
+_DENOISER_POOL = []
+
+def _denoiser_pool():
+    if not _DENOISER_POOL:
+        _DENOISER_POOL.append(ThreadPoolExecutor(1, thread_name_prefix='denoiser'))
+    return _DENOISER_POOL[0]
+
+def _concurrent_step(pool, time_step, x_t_cont, x_t_dis, still_cond, attention, net_sampler, trainer_dis, trans, FLAGS):
+    # the continuous denoiser reads the state of the previous step only, so it runs in the calling thread while a
+    # pool task runs the discrete columns one after another, each seeing the columns updated before it as in the
+    # sequential step. The Gaussian noise is drawn before the task starts and the continuous denoiser draws
+    # nothing else, so the random draws come in the sequential order and the output is the same
+    grad = torch.is_grad_enabled()
+    t = x_t_cont.new_ones([x_t_cont.shape[0], ], dtype=torch.long) * time_step
+    noise = torch.randn_like(x_t_cont) if time_step > 0 else 0
+    state = [still_cond[j] if j in FLAGS.still_condition else x_t_dis[j] for j in range(len(x_t_dis))]
+
+    def discrete():
+        x_dis = list(state)
+        for i in range(len(x_dis)):
+            if i not in FLAGS.still_condition:
+                with torch.set_grad_enabled(grad), stage('reverse_discrete', i):
+                    x_dis[i] = trainer_dis[i].p_sample(x_dis[i], t, x_dis[:i] + x_dis[i + 1:], attention)
+        return x_dis
+
+    future = pool.submit(discrete)
+    with stage('reverse_continuous'):
+        mean, log_var = net_sampler.p_mean_variance(x_t=x_t_cont, t=t, cond=state, attention=attention, trans=trans)
+        x_t_minus_1_cont = torch.clip(mean + torch.exp(0.5 * log_var) * noise, -1., 1.)
+    x_dis = future.result()
+    # still-condition entries keep what the caller passed, as in the sequential step
+    return x_t_minus_1_cont, [x_t_dis[j] if j in FLAGS.still_condition else x_dis[j] for j in range(len(x_dis))]
+
 def sampling_with(x_T_cont, log_x_T_dis, attention, net_sampler, trainer_dis, trans, FLAGS, still_cond_used_for_sampling):
+    # FLAGS.concurrent_denoisers runs the continuous denoiser of every step next to the discrete ones, see
+    # _concurrent_step
     x_t_cont = x_T_cont
+    still_cond = condition_tensors(still_cond_used_for_sampling, FLAGS.still_condition, x_T_cont.device)
     x_t_dis = [0]*len(log_x_T_dis)
     for i in range(len(log_x_T_dis)):
         x_t_dis[i] = log_x_T_dis[i]
+    pool = _denoiser_pool() if getattr(FLAGS, 'concurrent_denoisers', False) else None
 
     for time_step in reversed(range(FLAGS.T)):
+        if pool is not None:
+            x_t_cont, x_t_dis = _concurrent_step(pool, time_step, x_t_cont, x_t_dis, still_cond, attention,
+                                                 net_sampler, trainer_dis, trans, FLAGS)
+            continue
         t = x_t_cont.new_ones([x_t_cont.shape[0], ], dtype=torch.long) * time_step
         cond = []
         for j in range(len(log_x_T_dis)):
             if j in FLAGS.still_condition:
-                cond.append(torch.tensor(still_cond_used_for_sampling[j]).to(torch.float32).to(x_t_dis[j].device))
+                cond.append(still_cond[j])
             else:
                 cond.append(x_t_dis[j])
-        mean, log_var = net_sampler.p_mean_variance(x_t=x_t_cont, t=t, cond = cond, attention = attention, trans=trans)
-        if time_step > 0:
-            noise = torch.randn_like(x_t_cont)
-        elif time_step == 0:
-            noise = 0
-        x_t_minus_1_cont = mean + torch.exp(0.5 * log_var) * noise
-        x_t_minus_1_cont = torch.clip(x_t_minus_1_cont, -1., 1.)
+        with stage('reverse_continuous'):
+            mean, log_var = net_sampler.p_mean_variance(x_t=x_t_cont, t=t, cond = cond, attention = attention, trans=trans)
+            if time_step > 0:
+                noise = torch.randn_like(x_t_cont)
+            elif time_step == 0:
+                noise = 0
+            x_t_minus_1_cont = mean + torch.exp(0.5 * log_var) * noise
+            x_t_minus_1_cont = torch.clip(x_t_minus_1_cont, -1., 1.)
 
         for i in range(len(log_x_T_dis)):
             if i not in FLAGS.still_condition:
@@ -77,19 +154,65 @@ def sampling_with(x_T_cont, log_x_T_dis, attention, net_sampler, trainer_dis, tr
                 for j in range(len(log_x_T_dis)):
                     if j != i:
                         if j in FLAGS.still_condition:
-                            cond.append(torch.tensor(still_cond_used_for_sampling[j]).to(torch.float32).to(x_t_dis[j].device))
+                            cond.append(still_cond[j])
                         else:
                             cond.append(x_t_dis[j])
                 # cond.append(x_t_cont) #0720
-                x_t_minus_1_dis = trainer_dis[i].p_sample(x_t_dis[i], t, cond, attention)
+                with stage('reverse_discrete', i):
+                    x_t_minus_1_dis = trainer_dis[i].p_sample(x_t_dis[i], t, cond, attention)
 
                 x_t_cont = x_t_minus_1_cont
                 x_t_dis[i] = x_t_minus_1_dis
 
     for each in FLAGS.still_condition:
-        x_t_dis[each] = torch.tensor(still_cond_used_for_sampling[each]).to(torch.float32).to(x_t_dis[FLAGS.still_condition[each]].device)
+        x_t_dis[each] = still_cond[each]
     return  x_t_cont, [x.detach().cpu() for x in x_t_dis]
 
+def conditions_from_rows(attention, still_cond_used_for_sampling, index=None):
+    # conditions(start, end) of sampled rows [start, end): row r uses condition row index[r],
+    # or row r itself when index is None (cycling over the rows past the end)
+    num_rows = attention.num_rows
+    # staged once on the device of the attention histories, chunks are views (or gathers) of them
+    still_cond_used_for_sampling = condition_tensors(still_cond_used_for_sampling,
+                                                    range(len(still_cond_used_for_sampling)), attention.curr_act.device)
+    def conditions(start, end):
+        if index is None and end <= num_rows:
+            return attention.rows(start, end), [each[start:end] for each in still_cond_used_for_sampling]
+        idx = np.arange(start, end) % num_rows if index is None else index[start:end]
+        return attention.take(idx), [each[idx] for each in still_cond_used_for_sampling]
+    return conditions
+
+def sample_chunks(num_rows, chunk_size, conditions, net_sampler, trainer_dis, num_class, cont_dim, trans, FLAGS, device):
+    # reverse chains over fixed-size chunks of rows, so peak memory depends on chunk_size only
+    for start in range(0, num_rows, chunk_size):
+        end = min(start + chunk_size, num_rows)
+        attention, still_cond_used_for_sampling = conditions(start, end)
+        log_x_T_dis = [0] * len(num_class)
+        with torch.no_grad():
+            x_T_cont = torch.randn(end - start, cont_dim).to(device)
+            for i in range(len(num_class)):
+                log_x_T_dis[i] = log_sample_categorical(torch.zeros((end - start, num_class[i]), device=device), num_class[i]).to(device)
+            x_cont, x_dis = sampling_with(x_T_cont, log_x_T_dis, attention, net_sampler, trainer_dis, trans, FLAGS,
+                                          still_cond_used_for_sampling)
+        yield start, x_cont, x_dis
+
+def pipelined(items, work, workers, max_pending=None):
+    # yields work(*item) for every item in order; with workers > 0 the work runs in a thread pool while the
+    # caller keeps producing items, at most max_pending (2 * workers) results wait to be consumed
+    if workers <= 0:
+        for item in items:
+            yield work(*item)
+        return
+    max_pending = max_pending or 2 * workers
+    with ThreadPoolExecutor(workers) as pool:
+        pending = deque()
+        for item in items:
+            pending.append(pool.submit(work, *item))
+            if len(pending) >= max_pending:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
 def training_with(x_0_cont, x_0_dis, x_attention, trainer_cont, trainer_dis, trans, FLAGS, still_cond_used_for_sampling):
 
     t = torch.randint(FLAGS.T, size=(x_0_cont.shape[0], ), device=x_0_cont.device)
@@ -104,14 +227,16 @@ def training_with(x_0_cont, x_0_dis, x_attention, trainer_cont, trainer_dis, tra
         if i not in FLAGS.still_condition:
             log_x_start[i] = torch.log(x_0_dis[i].float().clamp(min=1e-30))
             x_t_dis[i] = trainer_dis[i].q_sample(log_x_start=log_x_start[i], t=t)
+    still_cond = condition_tensors(x_0_dis, FLAGS.still_condition, x_0_cont.device)
     # cond_for_continuous
     cond = []
     for j in range(len(x_0_dis)):
         if j in FLAGS.still_condition:
-            cond.append(x_0_dis[j].to(torch.float32))
+            cond.append(still_cond[j])
         else:
             cond.append(x_t_dis[j])
-    eps = trainer_cont.model(x_t_cont, t, cond, x_attention, True)
+    with stage('forward_continuous'):
+        eps = trainer_cont.model(x_t_cont, t, cond, x_attention, True)
     # eps = trainer_cont.model(x_t_cont, t, cond.to(x_t_cont.device))
     # print('[torch.tensor(still_cond_used_for_sampling).to(torch.float32).to(x_t_cont.device)]', [torch.tensor(still_cond_used_for_sampling).to(torch.float32).to(x_t_cont.device)])
     ps_0_con = trainer_cont.predict_xstart_from_eps(x_t_cont, t, eps=eps)
@@ -125,14 +250,15 @@ def training_with(x_0_cont, x_0_dis, x_attention, trainer_cont, trainer_dis, tra
             for j in range(len(x_0_dis)):
                 if j != i:
                     if j in FLAGS.still_condition:
-                        cond.append(x_0_dis[j].to(torch.float32))
+                        cond.append(still_cond[j])
                     else:
                         cond.append(x_t_dis[j])
             # cond.append(x_t_cont) #0720
-            kl, ps_0_dis = trainer_dis[i].compute_Lt(log_x_start[i], x_t_dis[i], t, cond, x_attention)
-            ps_0_dis = torch.exp(ps_0_dis)
-            kl_prior = trainer_dis[i].kl_prior(log_x_start[i])
-            dis_loss[i] = (kl / pt + kl_prior).mean()
+            with stage('forward_discrete', i):
+                kl, ps_0_dis = trainer_dis[i].compute_Lt(log_x_start[i], x_t_dis[i], t, cond, x_attention)
+                ps_0_dis = torch.exp(ps_0_dis)
+                kl_prior = trainer_dis[i].kl_prior(log_x_start[i])
+                dis_loss[i] = (kl / pt + kl_prior).mean()
 
 
     # # negative condition -> predict negative samples
@@ -161,6 +287,7 @@ def training_with(x_0_cont, x_0_dis, x_attention, trainer_cont, trainer_dis, tra
     # return con_loss, triplet_con, dis_loss, triplet_dis
     return cont_loss, dis_loss
 def make_negative_condition(x_0_con, x_0_dis):
+    import pandas as pd
 
     device = x_0_con.device
     x_0_con = x_0_con.detach().cpu().numpy()